@@ -1,16 +1,50 @@
 import argparse
+import sys
 
 from lib.augmented_generation import rag
+from lib.deadline import degraded_summaries
+from lib.resources import llm_stats_summary
+from lib.search_utils import SEARCH_SERVER_URL
+from lib.tracing import (
+    add_trace_arguments,
+    configure_from_args,
+    is_enabled,
+    report,
+    span,
+)
+
+
+def print_degraded(result, deadline):
+    if degraded := degraded_summaries(result.get("deadline")):
+        print(f"Degraded to meet the {deadline:g} s deadline:")
+        for line in degraded:
+            print(f"  {line}")
+        print()
 
 
 def main():
     parser = argparse.ArgumentParser(description="Retrieval Augmented Generation CLI")
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=SEARCH_SERVER_URL,
+        help="Send searches to a running search_server_cli.py, at http://host:port or unix:/path (default: $RAG_SEARCH_SERVER)",
+    )
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     rag_parser = subparsers.add_parser(
         "rag", help="Perform RAG (search + generate answer)"
     )
     rag_parser.add_argument("query", type=str, help="Search query for RAG")
+    rag_parser.add_argument(
+        "--limit", type=int, default=5, help="Number of results to return (default=5)"
+    )
+    rag_parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Seconds the whole request may take; the context is shortened to fit",
+    )
 
     summarize_parser = subparsers.add_parser(
         "summarize", help="Summarize text using RAG"
@@ -19,6 +53,12 @@ def main():
     summarize_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return (default=5)"
     )
+    summarize_parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Seconds the whole request may take; the context is shortened to fit",
+    )
 
     citations_parser = subparsers.add_parser(
         "citations", help="Generate answer with citations using RAG"
@@ -27,6 +67,12 @@ def main():
     citations_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return (default=5)"
     )
+    citations_parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Seconds the whole request may take; the context is shortened to fit",
+    )
 
     question_parser = subparsers.add_parser(
         "question", help="Answer a question using RAG"
@@ -35,60 +81,101 @@ def main():
     question_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return (default=5)"
     )
+    question_parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Seconds the whole request may take; the context is shortened to fit",
+    )
+
+    add_trace_arguments(parser)
 
     args = parser.parse_args()
+    configure_from_args(args)
 
-    match args.command:
-        case "rag":
-            query = args.query
-            result = rag(query, args.command, args.limit)
-            if result is None:
-                print("Error: No results returned from RAG.")
-            else:
-                print("Search Results:")
-                for res in result["docs"]:
-                    print(f"    - {res['title']}")
-                print("\n")
-                print("RAG RESPONSE:")
-                print(result["response"].text or "No response generated.")
-        case "summarize":
-            query = args.query
-            result = rag(query, args.command, args.limit)
-            if result is None:
-                print("Error: No results returned from RAG.")
-            else:
-                print("Search Results:")
-                for res in result["docs"]:
-                    print(f"    - {res['title']}")
-                print("\n")
-                print("LLM Summary:")
-                print(result["response"].text or "No response generated.")
-        case "citations":
-            query = args.query
-            result = rag(query, args.command, args.limit)
-            if result is None:
-                print("Error: No results returned from RAG.")
-            else:
-                print("Search Results:")
-                for res in result["docs"]:
-                    print(f"    - {res['title']}")
-                print("\n")
-                print("LLM Answer:")
-                print(result["response"].text or "No response generated.")
-        case "question":
-            question = args.question
-            result = rag(question, args.command, args.limit)
-            if result is None:
-                print("Error: No results returned from RAG.")
-            else:
-                print("Search Results:")
-                for res in result["docs"]:
-                    print(f"    - {res['title']}")
-                print("\n")
-                print("Answer:")
-                print(result["response"].text or "No response generated.")
-        case _:
-            parser.print_help()
+    with span(f"rag_cli.{args.command}"):
+        match args.command:
+            case "rag":
+                query = args.query
+                result = rag(
+                    query,
+                    args.command,
+                    args.limit,
+                    server=args.server,
+                    deadline=args.deadline,
+                )
+                if result is None:
+                    print("Error: No results returned from RAG.")
+                else:
+                    print("Search Results:")
+                    for res in result["docs"]:
+                        print(f"    - {res['title']}")
+                    print("\n")
+                    print_degraded(result, args.deadline)
+                    print("RAG RESPONSE:")
+                    print(result["response"].text or "No response generated.")
+            case "summarize":
+                query = args.query
+                result = rag(
+                    query,
+                    args.command,
+                    args.limit,
+                    server=args.server,
+                    deadline=args.deadline,
+                )
+                if result is None:
+                    print("Error: No results returned from RAG.")
+                else:
+                    print("Search Results:")
+                    for res in result["docs"]:
+                        print(f"    - {res['title']}")
+                    print("\n")
+                    print_degraded(result, args.deadline)
+                    print("LLM Summary:")
+                    print(result["response"].text or "No response generated.")
+            case "citations":
+                query = args.query
+                result = rag(
+                    query,
+                    args.command,
+                    args.limit,
+                    server=args.server,
+                    deadline=args.deadline,
+                )
+                if result is None:
+                    print("Error: No results returned from RAG.")
+                else:
+                    print("Search Results:")
+                    for res in result["docs"]:
+                        print(f"    - {res['title']}")
+                    print("\n")
+                    print_degraded(result, args.deadline)
+                    print("LLM Answer:")
+                    print(result["response"].text or "No response generated.")
+            case "question":
+                question = args.question
+                result = rag(
+                    question,
+                    args.command,
+                    args.limit,
+                    server=args.server,
+                    deadline=args.deadline,
+                )
+                if result is None:
+                    print("Error: No results returned from RAG.")
+                else:
+                    print("Search Results:")
+                    for res in result["docs"]:
+                        print(f"    - {res['title']}")
+                    print("\n")
+                    print_degraded(result, args.deadline)
+                    print("Answer:")
+                    print(result["response"].text or "No response generated.")
+            case _:
+                parser.print_help()
+    report()
+    if is_enabled() and (stats := llm_stats_summary()):
+        print(stats, file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import argparse
 
-from lib.evaluation import check_precision
+from lib.evaluation import check_precision, check_spelling
+from lib.tracing import add_trace_arguments, configure_from_args, report, span
 
 
 def main():
@@ -11,11 +12,36 @@ def main():
         default=5,
         help="Number of results to evaluate (k for precision@k, recall@k)",
     )
+    parser.add_argument(
+        "--spelling",
+        action="store_true",
+        help="Evaluate the local spell corrector against the LLM one on generated typos",
+    )
+    parser.add_argument(
+        "--spelling-cases",
+        type=int,
+        default=50,
+        help="Number of misspelled queries to generate (default=50)",
+    )
+    parser.add_argument(
+        "--no-llm",
+        action="store_true",
+        help="Only evaluate the local spell corrector",
+    )
+
+    add_trace_arguments(parser)
 
     args = parser.parse_args()
+    configure_from_args(args)
     limit = args.limit
 
-    check_precision(limit)
+    if args.spelling:
+        with span("evaluation_cli.spelling"):
+            check_spelling(args.spelling_cases, use_llm=not args.no_llm)
+    else:
+        with span("evaluation_cli.precision"):
+            check_precision(limit)
+    report()
 
 
 if __name__ == "__main__":
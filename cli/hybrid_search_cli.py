@@ -1,14 +1,55 @@
 import argparse
+import sys
 
 from lib.hybrid_search import (
+    batch_command,
     normalize_scores,
     rrf_search_command,
     weighted_search_command,
 )
+from lib.deadline import degraded_summaries
+from lib.rerank import verify_listwise_command
+from lib.resources import llm_stats_summary, set_encoder_backend
+from lib.result_cache import ResultCache
+from lib.search_utils import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_BATCH_WORKERS,
+    DEFAULT_RERANK_BUDGET,
+    ENCODER_BACKENDS,
+    MULTI_QUERY_METHODS,
+    RESULT_CACHE_PATH,
+    SEARCH_SERVER_URL,
+    SPECULATIVE_ENHANCE_TIMEOUT,
+)
+from lib.tracing import (
+    add_trace_arguments,
+    configure_from_args,
+    is_enabled,
+    report,
+    span,
+)
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Hybrid Search CLI")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=ENCODER_BACKENDS,
+        default=None,
+        help="Inference backend for the embedding model (default: $RAG_ENCODER_BACKEND or torch)",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=SEARCH_SERVER_URL,
+        help="Send searches to a running search_server_cli.py, at http://host:port or unix:/path (default: $RAG_SEARCH_SERVER); used by weighted-search and rrf-search",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"Answer repeated weighted-search and rrf-search requests from a result cache kept in {RESULT_CACHE_PATH}, invalidated when the index or embeddings are rebuilt",
+    )
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     normalize_parser = subparsers.add_parser(
@@ -45,90 +86,276 @@ def main() -> None:
     rrf_parser.add_argument(
         "--enhance",
         type=str,
-        choices=["spell", "rewrite", "expand"],
+        choices=["spell", "local_spell", "rewrite", "expand", "local_expand"],
         default=None,
-        help="Query enhancement method",
+        help="Query enhancement method (local_spell and local_expand run offline from the index)",
+    )
+    rrf_parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Retrieve for the original query while --enhance runs, then fuse in the enhanced query's results",
+    )
+    rrf_parser.add_argument(
+        "--enhance-timeout",
+        type=float,
+        default=SPECULATIVE_ENHANCE_TIMEOUT,
+        help=f"Seconds --speculative waits for the enhanced query (default={SPECULATIVE_ENHANCE_TIMEOUT})",
+    )
+    rrf_parser.add_argument(
+        "--multi-query",
+        type=str,
+        nargs="*",
+        choices=["spell", "local_spell", "rewrite", "expand"],
+        default=None,
+        help=f"Also search enhanced variants of the query and fuse them all (default variants: {' '.join(MULTI_QUERY_METHODS)})",
     )
     rrf_parser.add_argument(
         "--rerank-method",
         type=str,
-        choices=["individual", "batch", "cross_encoder"],
+        choices=["individual", "batch", "listwise", "cross_encoder", "cascade"],
         default=None,
-        help="Use LLM to rerank results",
+        help="Use LLM to rerank results (listwise: overlapping windows ranked concurrently; cascade: cross-encoder, then the LLM on as many top results as --latency-budget allows)",
+    )
+    rrf_parser.add_argument(
+        "--latency-budget",
+        type=float,
+        default=DEFAULT_RERANK_BUDGET,
+        help=f"Seconds the cascade reranker may spend (default={DEFAULT_RERANK_BUDGET})",
     )
     rrf_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return (default=5)"
     )
+    rrf_parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Seconds the whole request may take; enhancement and reranking are cut back to fit and the degraded stages reported",
+    )
+
+    subparsers.add_parser(
+        "verify-listwise",
+        help="Check offline, with fake LLMs, that listwise reranking survives failed windows",
+    )
+
+    cache_stats_parser = subparsers.add_parser(
+        "cache-stats", help="Show the --cache result cache's hit ratio and latencies"
+    )
+    cache_stats_parser.add_argument(
+        "--clear", action="store_true", help="Empty the cache and reset its counters"
+    )
+
+    batch_parser = subparsers.add_parser(
+        "batch",
+        help="Answer a JSONL file of queries with everything loaded once, streaming JSONL results",
+    )
+    batch_parser.add_argument(
+        "input",
+        type=str,
+        help='JSONL queries, "query" strings or {"query": ...} objects (- for stdin)',
+    )
+    batch_parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Where to write JSONL results (default: stdout)",
+    )
+    batch_parser.add_argument(
+        "--mode",
+        type=str,
+        choices=["rrf", "weighted"],
+        default="rrf",
+        help="Fusion method (default=rrf)",
+    )
+    batch_parser.add_argument(
+        "-k", type=int, default=60, help="RRF k parameter (default=60)"
+    )
+    batch_parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.5,
+        help="Weighted mode's BM25 weight (default=0.5)",
+    )
+    batch_parser.add_argument(
+        "--enhance",
+        type=str,
+        choices=["spell", "local_spell", "rewrite", "expand", "local_expand"],
+        default=None,
+        help="Query enhancement method (rrf mode)",
+    )
+    batch_parser.add_argument(
+        "--rerank-method",
+        type=str,
+        choices=["individual", "batch", "listwise", "cross_encoder", "cascade"],
+        default=None,
+        help="Rerank method (rrf mode)",
+    )
+    batch_parser.add_argument(
+        "--latency-budget",
+        type=float,
+        default=DEFAULT_RERANK_BUDGET,
+        help=f"Seconds the cascade reranker may spend (default={DEFAULT_RERANK_BUDGET})",
+    )
+    batch_parser.add_argument(
+        "--limit", type=int, default=5, help="Number of results to return (default=5)"
+    )
+    batch_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_BATCH_WORKERS,
+        help=f"Worker threads (default={DEFAULT_BATCH_WORKERS})",
+    )
+    batch_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Queries embedded per encoder call (default={DEFAULT_BATCH_SIZE})",
+    )
+
+    add_trace_arguments(parser)
 
     args = parser.parse_args()
+    configure_from_args(args)
+    if args.backend:
+        set_encoder_backend(args.backend)
 
-    match args.command:
-        case "normalize":
-            normalized = normalize_scores(args.scores)
-            for score in normalized:
-                print(f"* {score:.4f}")
-        case "weighted-search":
-            result = weighted_search_command(args.query, args.alpha, args.limit)
-
-            print(
-                f"Weighted Hybrid Search Results for '{result['query']}' (alpha={result['alpha']}):"
-            )
-            print(
-                f"  Alpha {result['alpha']}: {int(result['alpha'] * 100)}% Keyword, {int((1 - result['alpha']) * 100)}% Semantic"
-            )
-            for i, res in enumerate(result["results"], 1):
-                print(f"{i}. {res['title']}")
-                print(f"   Hybrid Score: {res.get('score', 0):.3f}")
-                metadata = res.get("metadata", {})
-                if "bm25_score" in metadata and "semantic_score" in metadata:
-                    print(
-                        f"   BM25: {metadata['bm25_score']:.3f}, Semantic: {metadata['semantic_score']:.3f}"
-                    )
-                print(f"   {res['document'][:100]}...")
-                print()
-        case "rrf-search":
-            result = rrf_search_command(
-                args.query, args.k, args.enhance, args.limit, args.rerank_method
-            )
-
-            if result["reranked"]:
-                print(
-                    f"Reranking top {args.limit} results using {result['rerank_method']} method..."
+    with span(f"hybrid_cli.{args.command}"):
+        match args.command:
+            case "normalize":
+                normalized = normalize_scores(args.scores)
+                for score in normalized:
+                    print(f"* {score:.4f}")
+            case "weighted-search":
+                result = weighted_search_command(
+                    args.query, args.alpha, args.limit, args.server, args.cache
                 )
 
-            if result["enhanced_query"]:
                 print(
-                    f"Enhanced query ({result['enhance_method']}): '{result['original_query']}' -> '{result['enhanced_query']}'\n"
+                    f"Weighted Hybrid Search Results for '{result['query']}' (alpha={result['alpha']}):"
+                )
+                print(
+                    f"  Alpha {result['alpha']}: {int(result['alpha'] * 100)}% Keyword, {int((1 - result['alpha']) * 100)}% Semantic"
+                )
+                for i, res in enumerate(result["results"], 1):
+                    print(f"{i}. {res['title']}")
+                    print(f"   Hybrid Score: {res.get('score', 0):.3f}")
+                    metadata = res.get("metadata", {})
+                    if "bm25_score" in metadata and "semantic_score" in metadata:
+                        print(
+                            f"   BM25: {metadata['bm25_score']:.3f}, Semantic: {metadata['semantic_score']:.3f}"
+                        )
+                    print(f"   {res['document'][:100]}...")
+                    print()
+            case "rrf-search":
+                multi_query = args.multi_query
+                if multi_query is not None and args.enhance:
+                    parser.error("--multi-query and --enhance are exclusive")
+                if multi_query == []:
+                    multi_query = MULTI_QUERY_METHODS
+                result = rrf_search_command(
+                    args.query,
+                    args.k,
+                    args.enhance,
+                    args.limit,
+                    args.rerank_method,
+                    args.latency_budget,
+                    args.speculative,
+                    args.enhance_timeout,
+                    multi_query,
+                    args.server,
+                    args.cache,
+                    args.deadline,
                 )
 
-            print(
-                f"Reciprocal Rank Fusion Results for '{result['query']}' (k={result['k']}):"
-            )
-
-            for i, res in enumerate(result["results"], 1):
-                print(f"{i}. {res['title']}")
-                if "individual_score" in res:
-                    print(f"   Rerank Score: {res.get('individual_score', 0):.3f}/10")
-                if "batch_rank" in res:
-                    print(f"   Rerank Rank: {res.get('batch_rank', 0)}")
-                if "cross_encode_score" in res:
+                if degraded := degraded_summaries(result.get("deadline")):
+                    print(f"Degraded to meet the {args.deadline:g} s deadline:")
+                    for line in degraded:
+                        print(f"  {line}")
+
+                if result["reranked"]:
+                    print(
+                        f"Reranking top {args.limit} results using {result['rerank_method']} method..."
+                    )
+                    for stage in result["rerank_stages"]:
+                        print(f"  {stage.summary()}")
+
+                if result["variants"]:
+                    print("Query variants:")
+                    for method, variant in result["variants"]:
+                        print(f"  {method}: {variant}")
+                    print()
+
+                if speculation := result["speculation"]:
                     print(
-                        f"   Cross Encoder Score: {res.get('cross_encode_score', 0):.3f}"
+                        f"Speculative retrieval: {speculation['outcome']} "
+                        f"(original results after {speculation['original_retrieval_seconds'] * 1000:.0f} ms)"
                     )
 
-                print(f"   RRF Score: {res.get('score', 0):.3f}")
-                metadata = res.get("metadata", {})
-                ranks = []
-                if metadata.get("bm25_rank"):
-                    ranks.append(f"BM25 Rank: {metadata['bm25_rank']}")
-                if metadata.get("semantic_rank"):
-                    ranks.append(f"Semantic Rank: {metadata['semantic_rank']}")
-                if ranks:
-                    print(f"   {', '.join(ranks)}")
-                print(f"   {res['document'][:100]}...")
-                print()
-        case _:
-            parser.print_help()
+                if result["enhanced_query"]:
+                    print(
+                        f"Enhanced query ({result['enhance_method']}): '{result['original_query']}' -> '{result['enhanced_query']}'\n"
+                    )
+
+                print(
+                    f"Reciprocal Rank Fusion Results for '{result['query']}' (k={result['k']}):"
+                )
+
+                for i, res in enumerate(result["results"], 1):
+                    print(f"{i}. {res['title']}")
+                    if "individual_score" in res:
+                        print(
+                            f"   Rerank Score: {res.get('individual_score', 0):.3f}/10"
+                        )
+                    if "batch_rank" in res:
+                        print(f"   Rerank Rank: {res.get('batch_rank', 0)}")
+                    if "cross_encode_score" in res:
+                        print(
+                            f"   Cross Encoder Score: {res.get('cross_encode_score', 0):.3f}"
+                        )
+
+                    print(f"   RRF Score: {res.get('score', 0):.3f}")
+                    metadata = res.get("metadata", {})
+                    ranks = []
+                    if metadata.get("bm25_rank"):
+                        ranks.append(f"BM25 Rank: {metadata['bm25_rank']}")
+                    if metadata.get("semantic_rank"):
+                        ranks.append(f"Semantic Rank: {metadata['semantic_rank']}")
+                    if ranks:
+                        print(f"   {', '.join(ranks)}")
+                    print(f"   {res['document'][:100]}...")
+                    print()
+            case "verify-listwise":
+                verify_listwise_command()
+            case "cache-stats":
+                cache = ResultCache(path=RESULT_CACHE_PATH)
+                if args.clear:
+                    cache.clear()
+                    cache.save()
+                    print("Result cache cleared")
+                else:
+                    print(
+                        f"Result cache: {len(cache)}/{cache.max_entries} entries, TTL {cache.ttl:.0f} s"
+                    )
+                    for kind, stats in cache.stats().items():
+                        print(f"  {kind}: {stats.summary()}")
+            case "batch":
+                batch_command(
+                    args.input,
+                    args.output,
+                    args.mode,
+                    args.k,
+                    args.alpha,
+                    args.limit,
+                    args.enhance,
+                    args.rerank_method,
+                    args.latency_budget,
+                    args.workers,
+                    args.batch_size,
+                )
+            case _:
+                parser.print_help()
+    report()
+    if is_enabled() and (stats := llm_stats_summary()):
+        print(stats, file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 import argparse
 
-from lib.keyword_search import BM25_B, BM25_K1, bm25_idf_command, bm25_tf_command, bm25search_command, search_command, build_command, tf_command, idf_command, tfidf_command
+from lib.keyword_search import BATCH_MODES, BM25_B, BM25_K1, batch_command, bm25_idf_command, bm25_tf_command, bm25search_command, search_command, build_command, phrase_command, tf_command, idf_command, tfidf_command
+from lib.boolean_query import BooleanQueryError
+from lib.search_utils import DEFAULT_BATCH_WORKERS, SEARCH_SERVER_URL
+from lib.tracing import add_trace_arguments, configure_from_args, report, span
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
+    parser.add_argument("--server", type=str, default=SEARCH_SERVER_URL, help="Send searches to a running search_server_cli.py, at http://host:port or unix:/path (default: $RAG_SEARCH_SERVER); used by search, bm25search and phrase")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-    subparsers.add_parser("build", help="Build and save the inverted index")
+    build_parser = subparsers.add_parser("build", help="Build and save the inverted index")
+    build_parser.add_argument("--no-positions", action="store_true", help="Skip the positional index used by phrase queries")
     
     tf_parser = subparsers.add_parser("tf", help="Get term frequency in document")
     tf_parser.add_argument("document_id", type=int, help="Document ID")
@@ -29,52 +34,82 @@ def main() -> None:
     bm25_tf_parser.add_argument("k1", type=float, nargs='?', default=BM25_K1, help="Tunable BM25 K1 parameter")
     bm25_tf_parser.add_argument("b", type=float, nargs='?', default=BM25_B, help="Tunable BM25 b parameter")
 
-    bm25search_parser = subparsers.add_parser("bm25search", help="Search movies using full BM25 scoring")
+    bm25search_parser = subparsers.add_parser("bm25search", help='Search movies using full BM25 scoring ("quoted phrases" get a boost)')
     bm25search_parser.add_argument("query", type=str, help="Search query")
     bm25search_parser.add_argument("--limit", type=int, default=5, help="Limit the number of results")
         
+    phrase_parser = subparsers.add_parser("phrase", help="Find movies containing an exact phrase")
+    phrase_parser.add_argument("phrase", type=str, help="Phrase to match")
+    phrase_parser.add_argument("--slop", type=int, default=0, help="Allow the words this many extra positions apart, in any order")
+    phrase_parser.add_argument("--limit", type=int, default=5, help="Limit the number of results")
+
     search_parser = subparsers.add_parser("search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
+    search_parser.add_argument("--boolean", action="store_true", help='Treat the query as AND/OR/NOT with parentheses and "quoted phrases"')
+    search_parser.add_argument("--limit", type=int, default=5, help="Limit the number of results")
+
+    batch_parser = subparsers.add_parser("batch", help="Answer a JSONL file of queries with one loaded index, streaming JSONL results")
+    batch_parser.add_argument("input", type=str, help='JSONL queries, "query" strings or {"query": ...} objects (- for stdin)')
+    batch_parser.add_argument("--output", type=str, default=None, help="Where to write JSONL results (default: stdout)")
+    batch_parser.add_argument("--mode", type=str, choices=BATCH_MODES, default="bm25", help="How each query is run (default=bm25)")
+    batch_parser.add_argument("--limit", type=int, default=5, help="Limit the number of results")
+    batch_parser.add_argument("--slop", type=int, default=0, help="Phrase mode slop")
+    batch_parser.add_argument("--workers", type=int, default=DEFAULT_BATCH_WORKERS, help=f"Worker threads (default={DEFAULT_BATCH_WORKERS})")
+
+    add_trace_arguments(parser)
 
     args = parser.parse_args()
+    configure_from_args(args)
 
-    match args.command:
-        case "search":
-            print("Searching for:", args.query)
-            results = search_command(args.query)
-            for i, res in enumerate(results, 1):
-                print(f"{i}. {res['title']}")
-        case "build":
-            print("Building inverted index...")
-            build_command()
-            print("Index built and saved successfully!")
-        case "tf":
-            print("Getting term frequency...")
-            tf = tf_command(args.document_id, args.term)
-            print(f"Term frequency: {tf}")
-        case "idf":
-            print("Getting inverse document frequency...")
-            idf = idf_command(args.term)
-            print(f"Inverse document frequency of '{args.term}': {idf:.2f}")
-        case "tfidf":
-            print("Getting TF-IDF score...")
-            tfidf = tfidf_command(args.document_id, args.term)
-            print(f"TF-IDF score: {tfidf:.2f}")
-        case "bm25idf":
-            print("Getting BM25 score...")
-            bm25 = bm25_idf_command(args.term)
-            print(f"BM25 IDF score of '{args.term}': {bm25:.2f}")
-        case "bm25tf":
-            print("Getting BM25 TF score...")
-            bm25tf = bm25_tf_command(args.document_id, args.term, args.k1)
-            print(f"BM25 TF score of '{args.term}' in document '{args.document_id}': {bm25tf:.2f}")
-        case "bm25search":
-            print("Searching using BM25...")
-            results = bm25search_command(args.query, args.limit)
-            for i, (doc_id, title, score) in enumerate(results, 1):
-                    print(f"{i}. ({doc_id}) {title} - Score: {score:.2f}")
-        case _:
-            parser.print_help()
+    with span(f"keyword_cli.{args.command}"):
+        match args.command:
+            case "search":
+                print("Searching for:", args.query)
+                try:
+                    results = search_command(args.query, args.limit, args.boolean, args.server)
+                except BooleanQueryError as e:
+                    parser.error(f"invalid boolean query: {e}")
+                for i, res in enumerate(results, 1):
+                    print(f"{i}. {res['title']}")
+            case "build":
+                print("Building inverted index...")
+                build_command(positional=not args.no_positions)
+                print("Index built and saved successfully!")
+            case "tf":
+                print("Getting term frequency...")
+                tf = tf_command(args.document_id, args.term)
+                print(f"Term frequency: {tf}")
+            case "idf":
+                print("Getting inverse document frequency...")
+                idf = idf_command(args.term)
+                print(f"Inverse document frequency of '{args.term}': {idf:.2f}")
+            case "tfidf":
+                print("Getting TF-IDF score...")
+                tfidf = tfidf_command(args.document_id, args.term)
+                print(f"TF-IDF score: {tfidf:.2f}")
+            case "bm25idf":
+                print("Getting BM25 score...")
+                bm25 = bm25_idf_command(args.term)
+                print(f"BM25 IDF score of '{args.term}': {bm25:.2f}")
+            case "bm25tf":
+                print("Getting BM25 TF score...")
+                bm25tf = bm25_tf_command(args.document_id, args.term, args.k1)
+                print(f"BM25 TF score of '{args.term}' in document '{args.document_id}': {bm25tf:.2f}")
+            case "bm25search":
+                print("Searching using BM25...")
+                results = bm25search_command(args.query, args.limit, args.server)
+                for i, res in enumerate(results, 1):
+                    print(f"{i}. ({res['id']}) {res['title']} - Score: {res['score']:.2f}")
+            case "phrase":
+                print(f"Searching for phrase: {args.phrase}")
+                results = phrase_command(args.phrase, args.slop, args.limit, args.server)
+                for i, res in enumerate(results, 1):
+                    print(f"{i}. ({res['id']}) {res['title']}")
+            case "batch":
+                batch_command(args.input, args.output, args.mode, args.limit, args.slop, args.workers)
+            case _:
+                parser.print_help()
+    report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+from .search_utils import DATA_PATH, MANIFEST_PATH
+from .tracing import span
+
+# cache/manifest.json records what produced each group of cache files:
+#
+#   {"format_version": 1,
+#    "sources": {path: {"sha256", "size", "mtime_ns"}},
+#    "artifacts": {name: {"version", "params", "corpus_sha256", "build_id",
+#                         "files": {path: size}}}}
+#
+# A group is fresh when its format version and params match, it was built
+# from the current corpus, and every file still has its recorded size. All
+# of that is answered from stat() calls; the corpus is only re-hashed when
+# its size or mtime moved, so checking at startup costs well under a
+# millisecond. Paths are stored relative to the manifest's directory.
+MANIFEST_FORMAT_VERSION = 1
+
+# Bump when an artifact's on-disk layout changes.
+ARTIFACT_VERSIONS = {
+    "keyword_index": 3,
+    "movie_embeddings": 1,
+    "chunk_embeddings": 1,
+    "expansions": 1,
+}
+
+_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "wb") -> Iterator:
+    """Write to a temp file next to `path` and rename it over `path` on success
+
+    Readers see either the old file or the complete new one, never a
+    partial write; on an exception the temp file is removed.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path: str = MANIFEST_PATH) -> None:
+        self.path = path
+        self.root = os.path.dirname(path)
+        self.data = {"format_version": MANIFEST_FORMAT_VERSION}
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = None
+        if data and data.get("format_version") == MANIFEST_FORMAT_VERSION:
+            self.data = data
+        self.sources: dict = self.data.setdefault("sources", {})
+        self.artifacts: dict = self.data.setdefault("artifacts", {})
+        # Keys this process changed; only these are written back on save,
+        # so entries another process saved meanwhile survive.
+        self._changed_sources: set[str] = set()
+        self._changed_artifacts: set[str] = set()
+
+    def _relative(self, path: str) -> str:
+        return os.path.relpath(path, self.root)
+
+    def source_sha256(self, path: str = DATA_PATH) -> str:
+        """Content hash of a source file, reusing the recorded one if unchanged"""
+        st = os.stat(path)
+        key = self._relative(path)
+        recorded = self.sources.get(key)
+        if (
+            recorded
+            and recorded["size"] == st.st_size
+            and recorded["mtime_ns"] == st.st_mtime_ns
+        ):
+            return recorded["sha256"]
+        with span("artifacts.hash_source", bytes=st.st_size):
+            sha = file_sha256(path)
+        self.sources[key] = {
+            "sha256": sha,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        self._changed_sources.add(key)
+        if recorded and recorded["sha256"] == sha:
+            # Touched but unchanged: remember the new stat so the next
+            # check is cheap again.
+            self.save()
+        return sha
+
+    def stale_reason(self, name: str, params: dict) -> Optional[str]:
+        """Why artifact group `name` must be rebuilt, or None if it is fresh"""
+        entry = self.artifacts.get(name)
+        if entry is None:
+            return "not in manifest"
+        if entry["version"] != ARTIFACT_VERSIONS[name]:
+            return f"format version {entry['version']} != {ARTIFACT_VERSIONS[name]}"
+        if entry["params"] != _normalize(params):
+            return "parameters changed"
+        if entry["corpus_sha256"] != self.source_sha256():
+            return "corpus changed"
+        for relative, size in entry["files"].items():
+            try:
+                if os.path.getsize(os.path.join(self.root, relative)) != size:
+                    return f"{relative} was modified"
+            except FileNotFoundError:
+                return f"{relative} is missing"
+        return None
+
+    def is_fresh(self, name: str, params: dict) -> bool:
+        return self.stale_reason(name, params) is None
+
+    def build_id(self, name: str) -> Optional[str]:
+        entry = self.artifacts.get(name)
+        return entry["build_id"] if entry else None
+
+    def record(self, name: str, files: list[str], params: dict) -> None:
+        """Register freshly written files for `name` and save the manifest"""
+        self.artifacts[name] = {
+            "version": ARTIFACT_VERSIONS[name],
+            "params": _normalize(params),
+            "corpus_sha256": self.source_sha256(),
+            "build_id": f"{time.time_ns():x}",
+            "files": {self._relative(p): os.path.getsize(p) for p in files},
+        }
+        self._changed_artifacts.add(name)
+        self.save()
+
+    def forget(self, name: str) -> None:
+        """Drop `name` before its files are rewritten, so a crash leaves it stale"""
+        self.artifacts.pop(name, None)
+        self._changed_artifacts.add(name)
+        self.save()
+
+    def save(self) -> None:
+        with _lock:
+            # Apply our changes to what is on disk now: entries we only
+            # loaded may since have been replaced by another process.
+            current = Manifest(self.path)
+            for key in self._changed_sources:
+                current.sources[key] = self.sources[key]
+            for name in self._changed_artifacts:
+                if name in self.artifacts:
+                    current.artifacts[name] = self.artifacts[name]
+                else:
+                    current.artifacts.pop(name, None)
+            with atomic_write(self.path, "w") as f:
+                json.dump(current.data, f, indent=2, sort_keys=True)
+            self.data = current.data
+            self.sources = current.sources
+            self.artifacts = current.artifacts
+            self._changed_sources.clear()
+            self._changed_artifacts.clear()
+
+
+def _normalize(params: dict) -> dict:
+    # What the params look like after a JSON round trip (tuples -> lists).
+    return json.loads(json.dumps(params, sort_keys=True))
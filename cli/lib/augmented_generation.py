@@ -1,43 +1,93 @@
-import os
-
-from dotenv import load_dotenv
-from google import genai
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
+from .deadline import Deadline
 from .hybrid_search import HybridSearch
-from .search_utils import load_movies
-
-load_dotenv()
-api_key = os.getenv("gemini_api_key")
-client = genai.Client(api_key=api_key)
-model = "gemini-2.0-flash"
-
-
-def get_results(query, limit):
-    movies = load_movies()
-    searcher = HybridSearch(movies)
-    results = searcher.rrf_search(query, k=60, limit=5)
+from .llm_gateway import LLMResponse
+from .resources import get_llm_gateway
+from .search_client import SearchClient
+from .search_utils import (
+    DEADLINE_LLM_SECONDS,
+    DEADLINE_SECONDS_PER_CONTEXT_DOC,
+    load_movies,
+)
+from .tracing import span
+
+
+def get_results(query, limit, searcher=None):
+    with span("rag.retrieve"):
+        if searcher is None:
+            searcher = HybridSearch(load_movies())
+        results = searcher.rrf_search(query, k=60, limit=limit)
     return results
 
 
-def rag_command(query, limit=5):
-    results = get_results(query, limit)
+def fit_context(results, deadline=None):
+    """The retrieved documents the prompt has time for, best first
+
+    Each document in the context makes generation slower; with little of
+    the deadline left, only the top ones go in (always at least one).
+    """
+    if deadline is None or not results:
+        return results
+    affordable = (
+        int(
+            (deadline.remaining() - DEADLINE_LLM_SECONDS)
+            / DEADLINE_SECONDS_PER_CONTEXT_DOC
+        )
+        + 1
+    )
+    keep = max(1, min(len(results), affordable))
+    if keep < len(results):
+        deadline.degrade(
+            "generation",
+            "shortened",
+            f"{keep} of {len(results)} documents in the context",
+        )
+    return results[:keep]
+
+
+def generate(prompt, stage, deadline=None):
+    """The LLM's answer, or an empty one if it isn't back by the deadline"""
+    if deadline is None:
+        return get_llm_gateway().generate(prompt, stage=stage)
+    try:
+        return deadline.run(get_llm_gateway().generate, prompt, stage)
+    except FutureTimeoutError:
+        deadline.degrade(
+            "generation", "timeout", "answered with the retrieved documents only"
+        )
+        return LLMResponse(text="")
+
+
+def _answer(results, response, deadline):
+    return {
+        "docs": results,
+        "response": response,
+        "deadline": deadline.report() if deadline else None,
+    }
+
+
+def rag_command(query, limit=5, searcher=None, deadline=None):
+    results = get_results(query, limit, searcher)
+    context = fit_context(results, deadline)
 
     prompt = f"""Answer the question or provide information based on the provided documents. This should be tailored to Hoopla users. Hoopla is a movie streaming service.
 
     Query: {query}
 
     Documents:
-    {results}
+    {context}
 
     Provide a comprehensive answer that addresses the query:"""
 
-    response = client.models.generate_content(model=model, contents=prompt)
+    response = generate(prompt, "rag", deadline)
 
-    return {"docs": results, "response": response}
+    return _answer(results, response, deadline)
 
 
-def sumarize_command(query, limit=5):
-    results = get_results(query, limit)
+def sumarize_command(query, limit=5, searcher=None, deadline=None):
+    results = get_results(query, limit, searcher)
+    context = fit_context(results, deadline)
 
     prompt = f"""
     Provide information useful to this query by synthesizing information from multiple search results in detail.
@@ -46,16 +96,17 @@ def sumarize_command(query, limit=5):
     This should be tailored to Hoopla users. Hoopla is a movie streaming service.
     Query: {query}
     Search Results:
-    {results}
+    {context}
     Provide a comprehensive 3–4 sentence answer that combines information from multiple sources:
     """
 
-    response = client.models.generate_content(model=model, contents=prompt)
-    return {"docs": results, "response": response}
+    response = generate(prompt, "summarize", deadline)
+    return _answer(results, response, deadline)
 
 
-def citations_command(query, limit):
-    results = get_results(query, limit)
+def citations_command(query, limit, searcher=None, deadline=None):
+    results = get_results(query, limit, searcher)
+    context = fit_context(results, deadline)
 
     prompt = f"""Answer the question or provide information based on the provided documents.
 
@@ -66,7 +117,7 @@ def citations_command(query, limit):
     Query: {query}
 
     Documents:
-    {results}
+    {context}
 
     Instructions:
     - Provide a comprehensive answer that addresses the query
@@ -77,13 +128,14 @@ def citations_command(query, limit):
 
     Answer:"""
 
-    response = client.models.generate_content(model=model, contents=prompt)
+    response = generate(prompt, "citations", deadline)
 
-    return {"docs": results, "response": response}
+    return _answer(results, response, deadline)
 
 
-def question_command(query, limit):
-    results = get_results(query, limit)
+def question_command(query, limit, searcher=None, deadline=None):
+    results = get_results(query, limit, searcher)
+    context = fit_context(results, deadline)
 
     prompt = f"""Answer the user's question based on the provided movies that are available on Hoopla.
 
@@ -92,7 +144,7 @@ def question_command(query, limit):
     Question: {query}
 
     Documents:
-    {results}
+    {context}
 
     Instructions:
     - Answer questions directly and concisely
@@ -102,18 +154,28 @@ def question_command(query, limit):
 
     Answer:"""
 
-    response = client.models.generate_content(model=model, contents=prompt)
+    response = generate(prompt, "question", deadline)
 
-    return {"docs": results, "response": response}
+    return _answer(results, response, deadline)
 
 
-def rag(query, command, limit=5):
+def rag(query, command, limit=5, searcher=None, server=None, deadline=None):
+    """Run a RAG command, retrieving with `searcher` if one is already loaded
+
+    With `server`, the whole command runs in the search server instead. With
+    a `deadline` in seconds, the context is shortened to what generation has
+    time for, and an answer that isn't back in time is left empty; the
+    result's "deadline" report says which.
+    """
+    if server:
+        return SearchClient(server).rag(query, command, limit, deadline)
+    request_deadline = Deadline.after(deadline)
     match command:
         case "rag":
-            return rag_command(query, limit)
+            return rag_command(query, limit, searcher, request_deadline)
         case "summarize":
-            return sumarize_command(query, limit)
+            return sumarize_command(query, limit, searcher, request_deadline)
         case "citations":
-            return citations_command(query, limit)
+            return citations_command(query, limit, searcher, request_deadline)
         case "question":
-            return question_command(query, limit)
+            return question_command(query, limit, searcher, request_deadline)
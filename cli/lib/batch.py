@@ -0,0 +1,195 @@
+import dataclasses
+import itertools
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, Optional, TextIO
+
+import numpy as np
+
+from .search_utils import DEFAULT_BATCH_SIZE, DEFAULT_BATCH_WORKERS
+from .tracing import propagate, span
+
+# Batch mode for the search CLIs. Requests are JSONL, one per line: either
+# a bare JSON string (the query) or an object with a "query" and optional
+# "id" plus per-request overrides of the command-line options, e.g.
+#
+#   "space adventure"
+#   {"id": "q7", "query": "dark crime family", "limit": 10}
+#
+# Every engine is loaded once. Queries are embedded a batch at a time and
+# searched on a thread pool while the next batch is being embedded; one
+# result line per request is streamed out in input order.
+
+
+@dataclass
+class BatchStats:
+    queries: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    latencies: list[float] = field(default_factory=list)
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def summary(self) -> str:
+        qps = self.queries / self.seconds if self.seconds else 0.0
+        return (
+            f"{self.queries} queries ({self.errors} failed) in {self.seconds:.2f} s: "
+            f"{qps:.1f} queries/s, latency p50 {self.percentile(50) * 1000:.1f} ms, "
+            f"p95 {self.percentile(95) * 1000:.1f} ms, "
+            f"p99 {self.percentile(99) * 1000:.1f} ms"
+        )
+
+
+def read_requests(source: TextIO) -> Iterator[dict]:
+    """Requests from JSONL; malformed lines come back with an "error" key"""
+    for line_number, line in enumerate(source, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"id": line_number, "error": f"invalid JSON: {e}"}
+            continue
+        if isinstance(request, str):
+            request = {"query": request}
+        if not isinstance(request, dict):
+            yield {"id": line_number, "error": "expected a string or an object"}
+            continue
+        request.setdefault("id", line_number)
+        query = request.get("query")
+        if not isinstance(query, str) or not query.strip():
+            request["error"] = "missing or empty query"
+        yield request
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def to_json(value: Any) -> str:
+    return json.dumps(value, default=_json_default)
+
+
+def run_batch(
+    requests: Iterable[dict],
+    search: Callable[[dict, Optional[np.ndarray]], dict],
+    out: TextIO,
+    workers: int = DEFAULT_BATCH_WORKERS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    encode: Optional[Callable[[list[str]], np.ndarray]] = None,
+) -> BatchStats:
+    """Run `search(request, query_embedding)` for every request
+
+    Args:
+        search: Answers one request; query_embedding is None unless `encode`
+            is given. The fields of the dict it returns are added to the
+            request's output line, and an exception it raises becomes the
+            line's "error" field.
+        encode: Batch query encoder; each batch of queries is embedded in
+            one call
+    """
+    stats = BatchStats()
+    start = time.perf_counter()
+    # (request, future, share of the batch's encode time) for lines not yet written
+    pending: deque[tuple[dict, Optional[Future], float]] = deque()
+
+    def timed(request: dict, embedding: Optional[np.ndarray]):
+        started = time.perf_counter()
+        fields = search(request, embedding)
+        return fields, time.perf_counter() - started
+
+    def write(request: dict, future: Optional[Future], encode_share: float) -> None:
+        line = {"id": request["id"], "query": request.get("query")}
+        error = request.get("error")
+        if future is not None:
+            try:
+                fields, seconds = future.result()
+                line.update(fields)
+                line["latency_ms"] = round((seconds + encode_share) * 1000, 3)
+                stats.latencies.append(seconds + encode_share)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        if error is not None:
+            line["error"] = error
+            stats.errors += 1
+        stats.queries += 1
+        out.write(to_json(line) + "\n")
+        out.flush()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        iterator = iter(requests)
+        while batch := list(itertools.islice(iterator, batch_size)):
+            valid = [request for request in batch if "error" not in request]
+            embeddings, encode_share = [None] * len(valid), 0.0
+            if encode is not None and valid:
+                encode_start = time.perf_counter()
+                with span("batch.encode", queries=len(valid)):
+                    embeddings = encode([request["query"] for request in valid])
+                encode_share = (time.perf_counter() - encode_start) / len(valid)
+            # Lines from earlier batches were searched while this one was
+            # being embedded; write them before queueing more work.
+            written_before = len(pending)
+            embedding_iter = iter(embeddings)
+            for request in batch:
+                if "error" in request:
+                    pending.append((request, None, 0.0))
+                else:
+                    future = pool.submit(
+                        propagate(timed), request, next(embedding_iter)
+                    )
+                    pending.append((request, future, encode_share))
+            for _ in range(written_before):
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def open_requests(path: str) -> TextIO:
+    return sys.stdin if path == "-" else open(path, "r")
+
+
+def open_output(path: Optional[str]) -> TextIO:
+    return sys.stdout if path in (None, "-") else open(path, "w")
+
+
+def batch_main(
+    input_path: str,
+    output_path: Optional[str],
+    search: Callable[[dict, Optional[np.ndarray]], dict],
+    workers: int = DEFAULT_BATCH_WORKERS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    encode: Optional[Callable[[list[str]], np.ndarray]] = None,
+) -> BatchStats:
+    """run_batch between files ("-" for stdin/stdout), summary on stderr"""
+    source = open_requests(input_path)
+    out = open_output(output_path)
+    try:
+        with span("batch.run", workers=workers, batch_size=batch_size):
+            stats = run_batch(
+                read_requests(source), search, out, workers, batch_size, encode
+            )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    print(stats.summary(), file=sys.stderr)
+    return stats
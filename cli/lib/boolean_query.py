@@ -0,0 +1,226 @@
+import heapq
+import re
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Sequence, Union
+
+from .phrase_query import Phrase
+
+# Boolean syntax for the keyword `search` command:
+#
+#   bear AND (forest OR mountain) NOT "teddy bear"
+#
+# AND, OR and NOT are upper case; adjacent operands without an operator are
+# ANDed. AND binds tighter than OR, and NOT applies to the operand after it.
+_TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"(?:~\d+)?|[^\s()"]+')
+_PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+
+
+@dataclass(frozen=True)
+class Term:
+    text: str
+
+
+@dataclass(frozen=True)
+class PhraseTerm:
+    phrase: Phrase
+
+
+@dataclass(frozen=True)
+class And:
+    children: tuple
+
+
+@dataclass(frozen=True)
+class Or:
+    children: tuple
+
+
+@dataclass(frozen=True)
+class Not:
+    child: object
+
+
+Node = Union[Term, PhraseTerm, And, Or, Not]
+
+
+class BooleanQueryError(ValueError):
+    pass
+
+
+def parse_boolean_query(query: str) -> Node:
+    tokens = _TOKEN_PATTERN.findall(query)
+    parser = _Parser(tokens)
+    node = parser.parse_or()
+    if parser.pos != len(tokens):
+        raise BooleanQueryError(f"Unexpected '{tokens[parser.pos]}' in query")
+    return node
+
+
+class _Parser:
+    def __init__(self, tokens: list[str]) -> None:
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse_or(self) -> Node:
+        children = [self.parse_and()]
+        while self.peek() == "OR":
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def parse_and(self) -> Node:
+        children = [self.parse_not()]
+        while self.peek() not in (None, "OR", ")"):
+            if self.peek() == "AND":
+                self.take()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def parse_not(self) -> Node:
+        if self.peek() == "NOT":
+            self.take()
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self) -> Node:
+        token = self.peek()
+        if token is None:
+            raise BooleanQueryError("Query ends where a term was expected")
+        if token in ("AND", "OR", ")"):
+            raise BooleanQueryError(f"Expected a term before '{token}'")
+        self.take()
+        if token == "(":
+            node = self.parse_or()
+            if self.peek() != ")":
+                raise BooleanQueryError("Missing closing parenthesis")
+            self.take()
+            return node
+        phrase = _PHRASE_PATTERN.fullmatch(token)
+        if phrase:
+            return PhraseTerm(Phrase(phrase.group(1), int(phrase.group(2) or 0)))
+        return Term(token)
+
+
+def gallop_to(postings: Sequence[int], target: int, lo: int) -> int:
+    """Index of the first posting >= target at or after `lo`
+
+    Probes lo, lo+1, lo+3, lo+7, ... before binary searching the last gap,
+    so skipping ahead by d positions costs O(log d) rather than O(log n).
+    """
+    n = len(postings)
+    step = 1
+    hi = lo
+    while hi < n and postings[hi] < target:
+        lo = hi + 1
+        hi += step
+        step <<= 1
+    return bisect_left(postings, target, lo, min(hi + 1, n))
+
+
+def intersect(small: Sequence[int], large: Sequence[int]) -> list[int]:
+    result = []
+    lo = 0
+    n = len(large)
+    for doc_id in small:
+        lo = gallop_to(large, doc_id, lo)
+        if lo >= n:
+            break
+        if large[lo] == doc_id:
+            result.append(doc_id)
+            lo += 1
+    return result
+
+
+def difference(postings: Sequence[int], excluded: Sequence[int]) -> list[int]:
+    result = []
+    lo = 0
+    n = len(excluded)
+    for doc_id in postings:
+        lo = gallop_to(excluded, doc_id, lo)
+        if lo >= n or excluded[lo] != doc_id:
+            result.append(doc_id)
+    return result
+
+
+def union(lists: list[Sequence[int]]) -> list[int]:
+    result = []
+    for doc_id in heapq.merge(*lists):
+        if not result or result[-1] != doc_id:
+            result.append(doc_id)
+    return result
+
+
+def evaluate(node: Node, index) -> list[int]:
+    """Sorted ids of documents in `index` (an InvertedIndex) matching `node`"""
+    postings = _evaluate(node, index)
+    return list(index.all_documents()) if postings is None else list(postings)
+
+
+def _evaluate(node: Node, index) -> Sequence[int] | None:
+    # None means the operand is absent, e.g. a term that is only stopwords:
+    # every operator drops it, and a query of nothing else matches everything.
+    match node:
+        case Term(text):
+            tokens = index.tokenize(text)
+            if not tokens:
+                return None
+            return _intersect_all([index.get_postings(token) for token in tokens])
+        case PhraseTerm(phrase):
+            return index.phrase_documents(phrase)
+        case Not(child):
+            excluded = _evaluate(child, index)
+            if excluded is None:
+                return None
+            return difference(index.all_documents(), excluded)
+        case Or(children):
+            lists = [
+                postings
+                for postings in (_evaluate(child, index) for child in children)
+                if postings is not None
+            ]
+            return union(lists) if lists else None
+        case And(children):
+            return _evaluate_and(children, index)
+    raise BooleanQueryError(f"Unknown query node {node!r}")
+
+
+def _evaluate_and(children: tuple, index) -> Sequence[int] | None:
+    required, excluded = [], []
+    for child in children:
+        target = excluded if isinstance(child, Not) else required
+        postings = _evaluate(child.child if isinstance(child, Not) else child, index)
+        if postings is not None:
+            target.append(postings)
+
+    if required:
+        result = _intersect_all(required)
+    elif excluded:
+        result = index.all_documents()
+    else:
+        return None
+    for postings in excluded:
+        if not result:
+            break
+        result = difference(result, postings)
+    return result
+
+
+def _intersect_all(lists: list[Sequence[int]]) -> Sequence[int]:
+    # Rarest first: the running result can only shrink, and each galloping
+    # pass costs O(len(result) * log(gap)) against the next, longer list.
+    lists = sorted(lists, key=len)
+    result = lists[0]
+    for postings in lists[1:]:
+        if not result:
+            break
+        result = intersect(result, postings)
+    return result
@@ -0,0 +1,171 @@
+import itertools
+import json
+import os
+import sys
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+
+from .tracing import span
+
+# A build in progress keeps three files next to the final artifacts:
+#
+#   <embeddings>.partial       preallocated .npy, memory-mapped, rows filled
+#                              batch by batch
+#   <metadata>l.partial        one JSON object per chunk (row-oriented sidecar)
+#   <embeddings>.checkpoint    rows completed, sidecar byte size, and the
+#                              build parameters they were produced with
+#
+# The checkpoint is replaced atomically after the vectors and sidecar rows of
+# a batch are flushed, so anything past it is just rewritten on resume.
+
+
+def _partial_paths(embeddings_path: str, metadata_path: str) -> tuple[str, str, str]:
+    return (
+        f"{embeddings_path}.partial",
+        f"{metadata_path}l.partial",
+        f"{embeddings_path}.checkpoint",
+    )
+
+
+def _read_checkpoint(checkpoint_path: str) -> dict | None:
+    try:
+        with open(checkpoint_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_checkpoint(checkpoint_path: str, checkpoint: dict) -> None:
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def discard_partial_build(embeddings_path: str, metadata_path: str) -> None:
+    for partial in _partial_paths(embeddings_path, metadata_path):
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def build_streaming(
+    rows: Iterable[tuple[dict, str]],
+    total: int,
+    dim: int,
+    encode: Callable[[list[str]], np.ndarray],
+    embeddings_path: str,
+    metadata_path: str,
+    params: dict,
+    batch_size: int,
+) -> int:
+    """Encode `rows` in fixed-size batches straight into a memory-mapped file
+
+    Peak memory is one batch of texts and vectors regardless of corpus size.
+    A build interrupted part-way resumes from the last completed batch when
+    called again with the same `params`, `total` and `dim`.
+
+    Args:
+        rows: (metadata, text) pairs in output order; only iterated once
+        total: Number of rows `rows` will yield
+        dim: Embedding dimension
+        encode: Turns a list of texts into a (len(texts), dim) array
+        embeddings_path: Final .npy path, written only when the build completes
+        metadata_path: Final metadata JSON path
+        params: Build parameters (model, chunking, corpus hash, ...) a resume
+            must match
+        batch_size: Texts per encode call
+
+    Returns:
+        Number of rows that were already done and skipped by resuming
+    """
+    vectors_path, sidecar_path, checkpoint_path = _partial_paths(
+        embeddings_path, metadata_path
+    )
+    os.makedirs(os.path.dirname(embeddings_path), exist_ok=True)
+
+    expected = {"params": params, "total": total, "dim": dim}
+    checkpoint = _read_checkpoint(checkpoint_path)
+    resumable = (
+        checkpoint is not None
+        and {k: checkpoint.get(k) for k in expected} == expected
+        and os.path.exists(vectors_path)
+        and os.path.exists(sidecar_path)
+    )
+
+    if resumable:
+        completed = checkpoint["completed"]
+        sidecar_bytes = checkpoint["sidecar_bytes"]
+        vectors = np.lib.format.open_memmap(vectors_path, mode="r+")
+        sidecar = open(sidecar_path, "r+b")
+        sidecar.truncate(sidecar_bytes)
+        sidecar.seek(sidecar_bytes)
+    else:
+        discard_partial_build(embeddings_path, metadata_path)
+        completed = 0
+        vectors = np.lib.format.open_memmap(
+            vectors_path, mode="w+", dtype=np.float32, shape=(total, dim)
+        )
+        sidecar = open(sidecar_path, "wb")
+        _write_checkpoint(
+            checkpoint_path, {**expected, "completed": 0, "sidecar_bytes": 0}
+        )
+    skipped = completed
+
+    with sidecar, span("chunks.stream_encode", total=total, resumed_at=skipped):
+        remaining = itertools.islice(rows, completed, None)
+        for batch in _batched(remaining, batch_size):
+            texts = [text for _, text in batch]
+            vectors[completed : completed + len(batch)] = encode(texts)
+            vectors.flush()
+
+            for metadata, _ in batch:
+                sidecar.write(json.dumps(metadata).encode() + b"\n")
+            sidecar.flush()
+            os.fsync(sidecar.fileno())
+
+            completed += len(batch)
+            _write_checkpoint(
+                checkpoint_path,
+                {**expected, "completed": completed, "sidecar_bytes": sidecar.tell()},
+            )
+            # Build chatter goes to stderr: batch mode streams results on stdout.
+            print(
+                f"Encoded {completed}/{total} chunks",
+                end="\r",
+                flush=True,
+                file=sys.stderr,
+            )
+    print(file=sys.stderr)
+
+    if completed != total:
+        raise ValueError(f"Expected {total} chunks but only {completed} were produced")
+
+    del vectors
+    with span("chunks.finalize"):
+        _write_metadata_json(sidecar_path, metadata_path, total)
+        os.replace(vectors_path, embeddings_path)
+        discard_partial_build(embeddings_path, metadata_path)
+    return skipped
+
+
+def _write_metadata_json(sidecar_path: str, metadata_path: str, total: int) -> None:
+    # Stream the sidecar into the {"chunks": [...], "total_chunks": n} layout
+    # the loader expects without holding every row in memory.
+    tmp_path = f"{metadata_path}.tmp"
+    with open(sidecar_path, "r") as src, open(tmp_path, "w") as dst:
+        dst.write('{"chunks": [')
+        for i, line in enumerate(src):
+            if i:
+                dst.write(", ")
+            dst.write(line.rstrip("\n"))
+        dst.write(f'], "total_chunks": {total}}}')
+    os.replace(tmp_path, metadata_path)
+
+
+def _batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
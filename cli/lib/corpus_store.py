@@ -0,0 +1,250 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+from collections.abc import Mapping, Sequence
+from typing import Any, Iterator, Optional
+
+# Binary layout (little endian), every section 8-byte aligned:
+#
+#   header       magic, version, flags, doc count, source size, source mtime
+#   sections     (offset, length) for each entry of SECTIONS
+#   ids          int64[n]
+#   title_offs   uint64[n + 1] into the titles blob
+#   titles       utf-8 blob
+#   desc_offs    uint64[n + 1] into the descriptions blob
+#   descs        utf-8 blob
+#   meta_offs    uint64[n + 1] into the metadata blob (empty if no metadata)
+#   meta         one JSON object per document holding every key other than
+#                id/title/description
+MAGIC = b"RAGCORP\x00"
+FORMAT_VERSION = 1
+SECTIONS = ("ids", "title_offs", "titles", "desc_offs", "descs", "meta_offs", "meta")
+
+FLAG_IDS_SORTED = 1
+FLAG_HAS_METADATA = 2
+
+_HEADER = struct.Struct("<8sIIQQq")
+_SECTION = struct.Struct("<QQ")
+_CORE_FIELDS = ("id", "title", "description")
+
+
+class CorpusStore(Sequence):
+    """Read-only, memory-mapped view of the compiled movie corpus.
+
+    Indexing and iteration yield the same movie dicts as the `movies` list in
+    movies.json, decoded from the mapped file on access.
+
+    This is the one copy of the documents every engine shares. A document's
+    position in the store is its dense internal index (what chunk metadata
+    calls `movie_idx`); `by_id` is the same documents keyed by movie id.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mm)
+
+        magic, version, flags, count, source_size, source_mtime = _HEADER.unpack_from(
+            view, 0
+        )
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a corpus store (version {FORMAT_VERSION})")
+        self.flags = flags
+        self.source_size = source_size
+        self.source_mtime_ns = source_mtime
+        self._count = count
+
+        sections = {}
+        for i, name in enumerate(SECTIONS):
+            offset, length = _SECTION.unpack_from(
+                view, _HEADER.size + i * _SECTION.size
+            )
+            sections[name] = view[offset : offset + length]
+
+        self.ids = sections["ids"].cast("q")
+        self._title_offs = sections["title_offs"].cast("Q")
+        self._titles = sections["titles"]
+        self._desc_offs = sections["desc_offs"].cast("Q")
+        self._descs = sections["descs"]
+        self._meta_offs = sections["meta_offs"].cast("Q")
+        self._meta = sections["meta"]
+        self._id_to_index: Optional[dict[int, int]] = None
+        self.by_id = DocumentsById(self)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.document(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("corpus index out of range")
+        return self.document(index)
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(self._count):
+            yield self.document(i)
+
+    def title(self, index: int) -> str:
+        return _decode(self._titles, self._title_offs, index)
+
+    def description(self, index: int) -> str:
+        return _decode(self._descs, self._desc_offs, index)
+
+    def metadata(self, index: int) -> dict[str, Any]:
+        if not self.flags & FLAG_HAS_METADATA:
+            return {}
+        raw = _decode(self._meta, self._meta_offs, index)
+        return json.loads(raw) if raw else {}
+
+    def document(self, index: int) -> dict:
+        doc = {
+            "id": self.ids[index],
+            "title": self.title(index),
+            "description": self.description(index),
+        }
+        doc.update(self.metadata(index))
+        return doc
+
+    def index_of(self, doc_id: int) -> int:
+        if self.flags & FLAG_IDS_SORTED:
+            i = bisect.bisect_left(self.ids, doc_id)
+            if i < self._count and self.ids[i] == doc_id:
+                return i
+            raise KeyError(doc_id)
+        if self._id_to_index is None:
+            self._id_to_index = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        return self._id_to_index[doc_id]
+
+    def get_by_id(self, doc_id: int) -> dict:
+        return self.document(self.index_of(doc_id))
+
+    def id_of(self, index: int) -> int:
+        return self.ids[index]
+
+    def is_stale(self, source_path: str) -> bool:
+        return _source_signature(source_path) != (
+            self.source_size,
+            self.source_mtime_ns,
+        )
+
+
+class DocumentsById(Mapping):
+    """Movie id -> movie dict view of a CorpusStore, iterated in store order"""
+
+    def __init__(self, store: CorpusStore) -> None:
+        self._store = store
+
+    def __getitem__(self, doc_id: int) -> dict:
+        return self._store.get_by_id(doc_id)
+
+    def __contains__(self, doc_id: object) -> bool:
+        try:
+            self._store.index_of(doc_id)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._store.ids)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+
+def _decode(blob: memoryview, offsets: memoryview, index: int) -> str:
+    return str(blob[offsets[index] : offsets[index + 1]], "utf-8")
+
+
+def _source_signature(source_path: str) -> tuple[int, int]:
+    st = os.stat(source_path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _pack_strings(values: list[bytes]) -> tuple[bytes, bytes]:
+    offsets = [0]
+    for value in values:
+        offsets.append(offsets[-1] + len(value))
+    return struct.pack(f"<{len(offsets)}Q", *offsets), b"".join(values)
+
+
+def compile_corpus(source_path: str, store_path: str) -> None:
+    """Compile movies.json into the binary corpus store at `store_path`."""
+    size, mtime_ns = _source_signature(source_path)
+    with open(source_path, "r") as f:
+        movies = json.load(f)["movies"]
+
+    ids = [int(m["id"]) for m in movies]
+    flags = FLAG_IDS_SORTED if all(a < b for a, b in zip(ids, ids[1:])) else 0
+
+    metas = []
+    for m in movies:
+        extra = {k: v for k, v in m.items() if k not in _CORE_FIELDS}
+        metas.append(json.dumps(extra).encode() if extra else b"")
+    if any(metas):
+        flags |= FLAG_HAS_METADATA
+        meta_offs, meta = _pack_strings(metas)
+    else:
+        meta_offs, meta = b"", b""
+
+    title_offs, titles = _pack_strings([m["title"].encode() for m in movies])
+    desc_offs, descs = _pack_strings([m["description"].encode() for m in movies])
+    payloads = {
+        "ids": struct.pack(f"<{len(ids)}q", *ids),
+        "title_offs": title_offs,
+        "titles": titles,
+        "desc_offs": desc_offs,
+        "descs": descs,
+        "meta_offs": meta_offs,
+        "meta": meta,
+    }
+
+    offset = _align(_HEADER.size + len(SECTIONS) * _SECTION.size)
+    table, body = [], bytearray()
+    for name in SECTIONS:
+        data = payloads[name]
+        table.append(_SECTION.pack(offset, len(data)))
+        body += data + b"\0" * (_align(len(data)) - len(data))
+        offset += _align(len(data))
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(ids), size, mtime_ns)
+    head = header + b"".join(table)
+    head += b"\0" * (_align(len(head)) - len(head))
+
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    tmp_path = f"{store_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(head)
+        f.write(body)
+    os.replace(tmp_path, store_path)
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+_lock = threading.Lock()
+_stores: dict[str, CorpusStore] = {}
+
+
+def open_corpus_store(source_path: str, store_path: str) -> CorpusStore:
+    """Open the compiled store, recompiling it first if the JSON changed."""
+    with _lock:
+        store = _stores.get(store_path)
+        if store is not None and not store.is_stale(source_path):
+            return store
+        try:
+            store = CorpusStore(store_path)
+        except (FileNotFoundError, ValueError, struct.error):
+            store = None
+        if store is None or store.is_stale(source_path):
+            compile_corpus(source_path, store_path)
+            store = CorpusStore(store_path)
+        _stores[store_path] = store
+        return store
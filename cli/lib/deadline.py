@@ -0,0 +1,113 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional, TypeVar
+
+from .search_utils import (
+    CASCADE_LLM_BASE_SECONDS,
+    CASCADE_LLM_SECONDS_PER_CANDIDATE,
+    DEADLINE_RETRIEVAL_SECONDS,
+)
+from .tracing import propagate, span
+
+# A request's deadline is handed to every stage: enhancement, retrieval,
+# reranking and generation. Retrieval always runs; each other stage checks
+# what the remaining time can afford and, when it can't afford its full
+# work, does less (skips enhancement, reranks with the cross-encoder
+# instead of the LLM, puts fewer documents in the prompt) and records what
+# it gave up, so the response says which stages were degraded.
+T = TypeVar("T")
+
+
+@dataclass
+class Degradation:
+    stage: str
+    # "skipped", "timeout", "cross_encoder" (instead of an LLM) or "shortened"
+    action: str
+    detail: str
+
+    def summary(self) -> str:
+        return f"{self.stage}: {self.action} ({self.detail})"
+
+
+class Deadline:
+    """Seconds a request may take, counted from construction"""
+
+    def __init__(self, seconds: float) -> None:
+        if seconds <= 0:
+            raise ValueError(f"deadline must be positive, got {seconds}")
+        self.seconds = seconds
+        self.start = time.perf_counter()
+        self.expires = self.start + seconds
+        self.degraded: list[Degradation] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def after(cls, seconds: Optional[float]) -> Optional["Deadline"]:
+        return cls(seconds) if seconds is not None else None
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.perf_counter())
+
+    def affords(self, seconds: float, reserve: float = 0.0) -> bool:
+        """Whether `seconds` of work still fits, keeping `reserve` for later stages"""
+        return self.remaining() - reserve >= seconds
+
+    def degrade(self, stage: str, action: str, detail: str) -> None:
+        with span("deadline.degrade", stage=stage, action=action):
+            with self._lock:
+                self.degraded.append(Degradation(stage, action, detail))
+
+    def run(self, func: Callable[..., T], *args, reserve: float = 0.0) -> T:
+        """`func(*args)`, or FutureTimeoutError once only `reserve` seconds are left
+
+        A call that times out keeps running in the background; its result
+        is dropped.
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(propagate(func), *args)
+            return future.result(timeout=max(0.0, self.remaining() - reserve))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def report(self) -> dict:
+        with self._lock:
+            degraded = [asdict(d) for d in self.degraded]
+        elapsed = time.perf_counter() - self.start
+        return {
+            "budget_seconds": self.seconds,
+            "elapsed_seconds": round(elapsed, 3),
+            "met": elapsed <= self.seconds,
+            "degraded": degraded,
+        }
+
+
+def llm_rerank_seconds(candidates: int) -> float:
+    """Expected time for an LLM to rerank `candidates` results"""
+    return CASCADE_LLM_BASE_SECONDS + CASCADE_LLM_SECONDS_PER_CANDIDATE * candidates
+
+
+def within(
+    deadline: Deadline,
+    stage: str,
+    func: Callable[..., T],
+    *args,
+    reserve: float = DEADLINE_RETRIEVAL_SECONDS,
+) -> Optional[T]:
+    """Run an optional stage on the deadline; None (recorded) if it ran out of time"""
+    try:
+        return deadline.run(func, *args, reserve=reserve)
+    except FutureTimeoutError:
+        elapsed = time.perf_counter() - deadline.start
+        deadline.degrade(stage, "timeout", f"gave up {elapsed:.2f} s into the request")
+        return None
+
+
+def degraded_summaries(report: Optional[dict]) -> list[str]:
+    """One line per degraded stage of a result's "deadline" report"""
+    if not report:
+        return []
+    return [Degradation(**d).summary() for d in report["degraded"]]
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+
+from .tracing import span
+
+DEFAULT_TOKENS_PER_BATCH = 8192
+DEFAULT_MAX_BATCH_SIZE = 256
+# Largest share of a batch's padded tokens that may be padding, and the
+# size below which a batch is never cut for padding alone (so a sparse
+# stretch of lengths still gets batches worth a forward pass).
+DEFAULT_MAX_PADDING = 0.01
+DEFAULT_MIN_BATCH_SIZE = 16
+DEFAULT_CACHE_SIZE = 4096
+# SentenceTransformer.encode's own default batch size, used for the baseline.
+NAIVE_BATCH_SIZE = 32
+
+
+@dataclass
+class EncodeStats:
+    texts: int = 0
+    encoded: int = 0
+    duplicates: int = 0
+    cache_hits: int = 0
+    batches: int = 0
+    # Tokens actually encoded, and the same after padding each batch.
+    real_tokens: int = 0
+    padded_tokens: int = 0
+    # The baseline is one SentenceTransformer.encode call over every text,
+    # duplicates included: it sorts by length and cuts fixed-size batches.
+    naive_real_tokens: int = 0
+    naive_padded_tokens: int = 0
+
+    @property
+    def padding_saved(self) -> int:
+        naive_padding = self.naive_padded_tokens - self.naive_real_tokens
+        return naive_padding - (self.padded_tokens - self.real_tokens)
+
+    @property
+    def duplicate_tokens_saved(self) -> int:
+        return self.naive_real_tokens - self.real_tokens
+
+    def summary(self) -> str:
+        change = (
+            self.padded_tokens / self.naive_padded_tokens - 1
+            if self.naive_padded_tokens
+            else 0.0
+        )
+        return (
+            f"{self.texts} texts, {self.encoded} encoded in {self.batches} batches "
+            f"({self.duplicates} duplicates and {self.cache_hits} cache hits skipped). "
+            f"{self.padded_tokens - self.real_tokens} padding tokens vs "
+            f"{self.naive_padded_tokens - self.naive_real_tokens} in length-sorted "
+            f"batches of {NAIVE_BATCH_SIZE}, {self.duplicate_tokens_saved} duplicate "
+            f"tokens skipped: {self.padded_tokens} vs {self.naive_padded_tokens} "
+            f"tokens ({change:+.1%})"
+        )
+
+
+class EncodeScheduler:
+    """Dedupe, length-bucket and batch texts in front of `model.encode`
+
+    Identical texts are encoded once, within a call and through a small LRU
+    of recent vectors across calls. Unique texts are sorted by token length
+    and cut into batches that stay under a token budget and whose padding
+    stays under `max_padding` of their tokens: where lengths are dense a
+    batch grows up to the budget, where they spread out batches get
+    smaller. Results are scattered back into input order.
+    """
+
+    def __init__(
+        self,
+        model,
+        encode_batches: Optional[Callable[[list[list[str]]], list[np.ndarray]]] = None,
+        tokens_per_batch: int = DEFAULT_TOKENS_PER_BATCH,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_padding: float = DEFAULT_MAX_PADDING,
+        min_batch_size: int = DEFAULT_MIN_BATCH_SIZE,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ) -> None:
+        self.model = model
+        self.encode_batches = encode_batches or self._encode_batches_locally
+        self.tokens_per_batch = tokens_per_batch
+        self.max_batch_size = max_batch_size
+        self.max_padding = max_padding
+        self.min_batch_size = min_batch_size
+        self.cache_size = cache_size
+        # Each text's vector and token length, the latter for the stats.
+        self._cache: OrderedDict[str, tuple[np.ndarray, int]] = OrderedDict()
+        self.stats = EncodeStats()
+
+    def _encode_batches_locally(self, batches: list[list[str]]) -> list[np.ndarray]:
+        return [self.model.encode(batch, batch_size=len(batch)) for batch in batches]
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        encoded = self.model.tokenizer(
+            texts,
+            add_special_tokens=True,
+            truncation=True,
+            max_length=self.model.max_seq_length,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def plan(self, lengths: list[int]) -> list[list[int]]:
+        """Group positions into length-sorted batches under the token and padding caps."""
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        batches, current, real = [], [], 0
+        for i in order:
+            # Sorted ascending, so the text being added is the batch's longest.
+            padded = (len(current) + 1) * lengths[i]
+            padding = padded - real - lengths[i]
+            too_padded = (
+                len(current) >= self.min_batch_size
+                and padding > self.max_padding * padded
+            )
+            if current and (
+                padded > self.tokens_per_batch
+                or len(current) >= self.max_batch_size
+                or too_padded
+            ):
+                batches.append(current)
+                current, real = [], 0
+            current.append(i)
+            real += lengths[i]
+        if current:
+            batches.append(current)
+        return batches
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        with span("encode_scheduler.encode", texts=len(texts)) as s:
+            positions: dict[str, list[int]] = {}
+            for i, text in enumerate(texts):
+                positions.setdefault(text, []).append(i)
+
+            vectors: dict[str, np.ndarray] = {}
+            length_of: dict[str, int] = {}
+            for text in positions:
+                cached = self._cache.get(text)
+                if cached is not None:
+                    self._cache.move_to_end(text)
+                    vectors[text], length_of[text] = cached
+            pending = [text for text in positions if text not in vectors]
+
+            lengths = self.token_lengths(pending) if pending else []
+            length_of.update(zip(pending, lengths))
+            plan = self.plan(lengths)
+            batches = [[pending[i] for i in batch] for batch in plan]
+            for batch, embeddings in zip(batches, self.encode_batches(batches)):
+                for text, embedding in zip(batch, embeddings):
+                    vectors[text] = embedding
+                    self._remember(text, embedding, length_of[text])
+
+            self._record(texts, positions, pending, lengths, plan, length_of)
+            s.set(unique=len(positions), encoded=len(pending), batches=len(plan))
+
+            if not texts:
+                return np.empty((0, 0), dtype=np.float32)
+            dim = len(next(iter(vectors.values())))
+            out = np.empty((len(texts), dim), dtype=np.float32)
+            for text, indices in positions.items():
+                out[indices] = vectors[text]
+            return out
+
+    def _remember(self, text: str, embedding: np.ndarray, length: int) -> None:
+        if self.cache_size <= 0:
+            return
+        self._cache[text] = (embedding, length)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _record(self, texts, positions, pending, lengths, plan, length_of) -> None:
+        stats = self.stats
+        stats.texts += len(texts)
+        stats.encoded += len(pending)
+        stats.duplicates += len(texts) - len(positions)
+        stats.cache_hits += len(positions) - len(pending)
+        stats.batches += len(plan)
+        stats.real_tokens += sum(lengths)
+        stats.padded_tokens += sum(
+            len(batch) * max(lengths[i] for i in batch) for batch in plan
+        )
+
+        # What the same texts would have cost passed to model.encode in one
+        # call, as before: every duplicate encoded again, in fixed-size
+        # batches of length-sorted texts. Cache hits carry their length, so
+        # nothing is tokenized again for this.
+        all_lengths = sorted((length_of[text] for text in texts), reverse=True)
+        stats.naive_real_tokens += sum(all_lengths)
+        for start in range(0, len(all_lengths), NAIVE_BATCH_SIZE):
+            window = all_lengths[start : start + NAIVE_BATCH_SIZE]
+            stats.naive_padded_tokens += len(window) * max(window)
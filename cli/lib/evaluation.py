@@ -1,8 +1,12 @@
 import json
+import random
+import time
 
 from .hybrid_search import HybridSearch
+from .query_enhancement import local_spell_correct, spell_correct
 from .search_utils import GOLDEN_SET_PATH, load_movies
 from .semantic_search import SemanticSearch
+from .spell import make_typo_queries
 
 
 def check_precision(limit):
@@ -33,3 +37,47 @@ def check_precision(limit):
         print(f"    - Precision@{limit}: {precision:.4f}")
         print(f"    - Retrieved: {', '.join(actual_titles)}")
         print(f"    - Relevant: {', '.join(expected_results)}")
+
+
+def check_spelling(num_cases: int = 50, seed: int = 0, use_llm: bool = True):
+    """Compare the local and LLM spell correctors on generated typos
+
+    The test set is the golden queries plus sampled movie titles, each with
+    one random edit in a word of four or more letters. A correction counts
+    when it restores the original query (ignoring case). Untouched queries
+    are run too, to catch correctors that "fix" correct words.
+    """
+    with open(GOLDEN_SET_PATH, "r") as f:
+        golden_dataset = json.load(f)
+
+    rng = random.Random(seed)
+    movies = load_movies()
+    titles = [movies[i]["title"] for i in rng.sample(range(len(movies)), num_cases)]
+    queries = [entry["query"] for entry in golden_dataset["test_cases"]] + titles
+    cases = make_typo_queries(queries[:num_cases], rng)
+
+    correctors = {"local_spell": local_spell_correct}
+    if use_llm:
+        correctors["spell"] = spell_correct
+
+    print(f"{len(cases)} misspelled queries\n")
+    for name, correct in correctors.items():
+        fixed = preserved = 0
+        start = time.perf_counter()
+        for misspelled, original in cases:
+            fixed += _same_query(correct(misspelled), original)
+        elapsed = time.perf_counter() - start
+        for _, original in cases:
+            preserved += _same_query(correct(original), original)
+
+        print(f"- Corrector: {name}")
+        print(f"    - Typos fixed: {fixed}/{len(cases)} ({fixed / len(cases):.1%})")
+        print(
+            f"    - Correct queries left alone: {preserved}/{len(cases)} "
+            f"({preserved / len(cases):.1%})"
+        )
+        print(f"    - Mean latency: {elapsed / len(cases) * 1e3:.3f} ms")
+
+
+def _same_query(a: str, b: str) -> bool:
+    return a.lower().split() == b.lower().split()
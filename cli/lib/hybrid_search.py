@@ -1,50 +1,456 @@
 from __future__ import annotations
 
-import os
-from typing import Optional
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Callable, Optional
 
-from .keyword_search import InvertedIndex
-from .query_enhancement import enhance_query
-from .rerank import rerank
+import numpy as np
+
+from .artifacts import Manifest
+from .corpus_store import CorpusStore
+from .deadline import Deadline, llm_rerank_seconds, within
+from .keyword_search import INDEX_ARTIFACT, InvertedIndex
+from .query_enhancement import enhance_query, local_expansion_terms
+from .rerank import cascade_rerank, cross_encode, rerank
+from .resources import get_encoder_backend, get_expansion_table, get_spell_corrector
+from .result_cache import ResultCache, normalize_query
+from .search_client import SearchClient
 from .search_utils import (
+    DEADLINE_CROSS_ENCODER_SECONDS,
+    DEADLINE_LLM_SECONDS,
+    DEADLINE_LOCAL_ENHANCE_SECONDS,
+    DEADLINE_RETRIEVAL_SECONDS,
     DEFAULT_ALPHA,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_BATCH_WORKERS,
+    DEFAULT_RERANK_BUDGET,
     DEFAULT_SEARCH_LIMIT,
+    EMBEDDING_MODEL,
+    RESULT_CACHE_PATH,
     RRF_K,
+    MULTI_QUERY_METHODS,
+    MULTI_QUERY_WEIGHTS,
     SEARCH_MULTIPLIER,
+    SPECULATIVE_ENHANCE_TIMEOUT,
     format_search_result,
     load_movies,
+    top_k_indices,
+)
+from .semantic_search import (
+    CHUNK_EMBEDDINGS_ARTIFACT,
+    ChunkedSemanticSearch,
+    chunk_params,
 )
-from .semantic_search import ChunkedSemanticSearch
+from .tracing import propagate, span
+
+
+class SnapshotError(ValueError):
+    """A reloaded snapshot failed to load or validate; the old one stays in service"""
+
+
+@dataclass(frozen=True)
+class SearchSnapshot:
+    """One generation of everything queries read, loaded and swapped as a unit
+
+    `version` is the build ids of the keyword index and chunk embeddings
+    it was loaded from.
+    """
+
+    documents: CorpusStore
+    idx: InvertedIndex
+    semantic_search: ChunkedSemanticSearch
+    version: str
+    loaded_at: float
+
+    @property
+    def cache_version(self) -> str:
+        """What cached results from this snapshot depend on"""
+        return _cache_version(
+            self.version, self.semantic_search.model_name, self.semantic_search.backend
+        )
+
+
+def _cache_version(version: str, model_name: str, backend: str) -> str:
+    return f"{version}/{model_name}/{backend}"
+
+
+def snapshot_version() -> str:
+    """Version of the index and embeddings currently on disk"""
+    manifest = Manifest()
+    return "/".join(
+        str(manifest.build_id(name))
+        for name in (INDEX_ARTIFACT, CHUNK_EMBEDDINGS_ARTIFACT)
+    )
+
+
+def current_cache_version(
+    model_name: str = EMBEDDING_MODEL, backend: Optional[str] = None
+) -> Optional[str]:
+    """The cache_version a HybridSearch created now would have
+
+    None if it would have to rebuild the index or embeddings first. Cheap:
+    reads the manifest and stats the corpus, loads nothing.
+    """
+    backend = backend or get_encoder_backend()
+    with span("hybrid.cache_version"):
+        manifest = Manifest()
+        if InvertedIndex().stale_reason() or manifest.stale_reason(
+            CHUNK_EMBEDDINGS_ARTIFACT, chunk_params(model_name, backend, load_movies())
+        ):
+            return None
+        return _cache_version(snapshot_version(), model_name, backend)
+
+
+def load_snapshot(model_source: ChunkedSemanticSearch) -> SearchSnapshot:
+    """Load the saved index and chunk embeddings, never rebuilding them
+
+    The embedding model is shared with `model_source`.
+    """
+    with span("snapshot.load"):
+        version = snapshot_version()
+        idx = InvertedIndex()
+        stale = idx.stale_reason()
+        if stale:
+            raise SnapshotError(f"keyword index is stale: {stale}")
+        idx.load()
+        documents = idx.corpus
+        semantic_search = ChunkedSemanticSearch(
+            model_source.model_name, model_source.backend, model=model_source.model
+        )
+        stale = semantic_search.stale_reason(documents)
+        if stale:
+            raise SnapshotError(f"chunk embeddings are stale: {stale}")
+        semantic_search.load_chunk_embeddings(documents)
+        if snapshot_version() != version:
+            raise SnapshotError("the cache was rebuilt while loading, reload again")
+        return SearchSnapshot(documents, idx, semantic_search, version, time.time())
+
+
+def validate_snapshot(snapshot: SearchSnapshot) -> None:
+    """Check the parts of a snapshot agree with each other and answer a query"""
+    with span("snapshot.validate"):
+        num_docs = len(snapshot.documents)
+        if num_docs == 0:
+            raise SnapshotError("the corpus is empty")
+        if len(snapshot.idx.docmap) != num_docs:
+            raise SnapshotError(
+                f"keyword index covers {len(snapshot.idx.docmap)} documents, corpus has {num_docs}"
+            )
+        semantic = snapshot.semantic_search
+        if len(semantic.chunk_embeddings) != len(semantic.chunk_metadata):
+            raise SnapshotError(
+                f"{len(semantic.chunk_embeddings)} chunk embeddings for {len(semantic.chunk_metadata)} chunks"
+            )
+        if len(semantic.chunk_movie_idx) and semantic.chunk_movie_idx.max() >= num_docs:
+            raise SnapshotError("chunk metadata refers to documents past the corpus")
+        dimension = semantic.model.get_sentence_embedding_dimension()
+        if semantic.chunk_embeddings.shape[1] != dimension:
+            raise SnapshotError(
+                f"chunk embeddings have {semantic.chunk_embeddings.shape[1]} dimensions, the model {dimension}"
+            )
+        # A document's own title should find it.
+        probe = snapshot.documents.title(0)
+        if not snapshot.idx.bm25_search(probe, 1) or not semantic.search_chunks(
+            probe, 1
+        ):
+            raise SnapshotError(f"probe query {probe!r} returned nothing")
 
 
 class HybridSearch:
-    def __init__(self, documents: list[dict]) -> None:
-        self.documents = documents
-        self.semantic_search = ChunkedSemanticSearch()
-        self.semantic_search.load_or_create_chunk_embeddings(documents)
+    """BM25 and chunked semantic retrieval over one loaded corpus
+
+    Queries only read the current SearchSnapshot: the keyword index and
+    chunk embeddings are immutable once loaded, and every query builds its
+    own score arrays and result dicts. One instance can serve any number
+    of concurrent queries from a thread pool, and `reload` swaps in a new
+    snapshot without stopping them.
+
+    With a `result_cache`, repeated searches are answered from it until
+    the snapshot they were computed on is replaced.
+    """
+
+    def __init__(
+        self,
+        documents: list[dict],
+        semantic_search: Optional[ChunkedSemanticSearch] = None,
+        result_cache: Optional[ResultCache] = None,
+    ) -> None:
+        with span("hybrid.setup"):
+            semantic_search = semantic_search or ChunkedSemanticSearch()
+            semantic_search.load_or_create_chunk_embeddings(documents)
+
+            idx = InvertedIndex()
+            stale = idx.stale_reason()
+            if stale:
+                print(f"Rebuilding keyword index: {stale}", file=sys.stderr)
+                idx.build()
+                idx.save()
+            else:
+                idx.load()
+            self._snapshot = SearchSnapshot(
+                documents, idx, semantic_search, snapshot_version(), time.time()
+            )
+        self.result_cache = result_cache
+        self._reload_lock = threading.Lock()
+        # Swapped-out snapshots, for as long as in-flight queries hold them.
+        self._retired: weakref.WeakSet[SearchSnapshot] = weakref.WeakSet()
+
+    @property
+    def snapshot(self) -> SearchSnapshot:
+        return self._snapshot
+
+    @property
+    def documents(self) -> CorpusStore:
+        return self._snapshot.documents
 
-        self.idx = InvertedIndex()
-        if not os.path.exists(self.idx.index_path):
-            self.idx.build()
-            self.idx.save()
+    @property
+    def idx(self) -> InvertedIndex:
+        return self._snapshot.idx
 
-    def _bm25_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
-        self.idx.load()
-        return self.idx.bm25_search(query, limit)
+    @property
+    def semantic_search(self) -> ChunkedSemanticSearch:
+        return self._snapshot.semantic_search
 
-    def weighted_search(self, query: str, alpha: float, limit: int = 5) -> list[dict]:
-        bm25_results = self._bm25_search(query, limit * 500)
-        semantic_results = self.semantic_search.search_chunks(query, limit * 500)
+    def pinned(self) -> HybridSearch:
+        """A searcher fixed to the current snapshot, unaffected by reloads
 
-        combined = combine_search_results(bm25_results, semantic_results, alpha)
-        return combined[:limit]
+        Run a multi-step request (enhance, retrieve again, rerank) against
+        it so every step sees the same corpus and index.
+        """
+        view = object.__new__(HybridSearch)
+        view._snapshot = self._snapshot
+        view.result_cache = self.result_cache
+        view._reload_lock = self._reload_lock
+        view._retired = self._retired
+        return view
 
-    def rrf_search(self, query: str, k: int, limit: int = 10) -> list[dict]:
-        bm25_results = self._bm25_search(query, limit * 500)
-        semantic_results = self.semantic_search.search_chunks(query, limit * 500)
+    def reload(self) -> SearchSnapshot:
+        """Load the saved index and embeddings as a new snapshot and swap it in
 
-        fused = reciprocal_rank_fusion(bm25_results, semantic_results, k)
-        return fused[:limit]
+        Queries keep running on the current snapshot while the new one is
+        loaded and validated, and ones already in flight finish on it; its
+        memory is released when the last of them returns. Nothing is
+        rebuilt: stale or inconsistent files raise SnapshotError and the
+        current snapshot stays in service.
+        """
+        with self._reload_lock, span("hybrid.reload") as s:
+            current = self._snapshot
+            snapshot = load_snapshot(current.semantic_search)
+            validate_snapshot(snapshot)
+            self._snapshot = snapshot
+            self._retired.add(current)
+            s.set(version=snapshot.version)
+        # Loaded from the previous build's files on first use.
+        get_spell_corrector.cache_clear()
+        get_expansion_table.cache_clear()
+        return snapshot
+
+    def reload_in_background(self) -> Future:
+        """Run `reload` on its own thread; the future holds the new snapshot"""
+        future: Future = Future()
+
+        def run() -> None:
+            try:
+                future.set_result(self.reload())
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(
+            target=propagate(run), name="hybrid-reload", daemon=True
+        ).start()
+        return future
+
+    def retired_snapshots(self) -> int:
+        """Swapped-out snapshots not yet released by in-flight queries"""
+        return len(self._retired)
+
+    def cached(
+        self,
+        key: tuple,
+        compute: Callable[[], object],
+        snapshot: SearchSnapshot,
+        cacheable: Optional[Callable[[object], bool]] = None,
+    ):
+        """`compute()`, or its result for `key` on `snapshot` from the result cache"""
+        if self.result_cache is None:
+            return compute()
+        return self.result_cache.get_or_compute(
+            key, snapshot.cache_version, compute, cacheable
+        )
+
+    def _bm25_search(
+        self,
+        snapshot: SearchSnapshot,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        expansions: Optional[dict[str, float]] = None,
+    ) -> list[dict]:
+        with span("hybrid.bm25"):
+            return snapshot.idx.bm25_search(query, limit, expansions=expansions)
+
+    def _semantic_search(
+        self,
+        snapshot: SearchSnapshot,
+        query: str,
+        limit: int,
+        query_embedding: Optional[np.ndarray] = None,
+    ) -> list[dict]:
+        with span("hybrid.semantic"):
+            return snapshot.semantic_search.search_chunks(query, limit, query_embedding)
+
+    def weighted_search(
+        self,
+        query: str,
+        alpha: float,
+        limit: int = 5,
+        query_embedding: Optional[np.ndarray] = None,
+    ) -> list[dict]:
+        snapshot = self._snapshot
+        return self.cached(
+            ("weighted", normalize_query(query), alpha, limit),
+            lambda: self._weighted_search(
+                snapshot, query, alpha, limit, query_embedding
+            ),
+            snapshot,
+        )
+
+    def _weighted_search(
+        self,
+        snapshot: SearchSnapshot,
+        query: str,
+        alpha: float,
+        limit: int,
+        query_embedding: Optional[np.ndarray],
+    ) -> list[dict]:
+        with span("hybrid.weighted_search", limit=limit):
+            bm25_results = self._bm25_search(snapshot, query, limit * 500)
+            semantic_results = self._semantic_search(
+                snapshot, query, limit * 500, query_embedding
+            )
+
+            with span("hybrid.fusion"):
+                combined = combine_search_results(bm25_results, semantic_results, alpha)
+            return combined[:limit]
+
+    def rrf_search(
+        self,
+        query: str,
+        k: int,
+        limit: int = 10,
+        expansions: Optional[dict[str, float]] = None,
+        query_embedding: Optional[np.ndarray] = None,
+    ) -> list[dict]:
+        snapshot = self._snapshot
+        return self.cached(
+            (
+                "rrf",
+                normalize_query(query),
+                k,
+                limit,
+                tuple(sorted(expansions.items())) if expansions else None,
+            ),
+            lambda: self._rrf_search(
+                snapshot, query, k, limit, expansions, query_embedding
+            ),
+            snapshot,
+        )
+
+    def _rrf_search(
+        self,
+        snapshot: SearchSnapshot,
+        query: str,
+        k: int,
+        limit: int,
+        expansions: Optional[dict[str, float]],
+        query_embedding: Optional[np.ndarray],
+    ) -> list[dict]:
+        with span("hybrid.rrf_search", limit=limit):
+            bm25_results = self._bm25_search(snapshot, query, limit * 500, expansions)
+            semantic_results = self._semantic_search(
+                snapshot, query, limit * 500, query_embedding
+            )
+
+            with span("hybrid.fusion"):
+                return reciprocal_rank_fusion(bm25_results, semantic_results, k, limit)
+
+    def multi_query_rrf_search(
+        self, variants: list[tuple[str, str]], k: int, limit: int = 10
+    ) -> list[dict]:
+        """Hybrid retrieval for every (method, query) variant, fused N-way
+
+        The variants are embedded in one batch and retrieved concurrently;
+        each contributes a BM25 and a semantic list, weighted by its method.
+        """
+        snapshot = self._snapshot
+        names = [name for name, _ in variants]
+        queries = [query for _, query in variants]
+        with span("hybrid.multi_query", variants=len(variants), limit=limit):
+            embeddings = snapshot.semantic_search.embed_queries(queries)
+
+            def retrieve(i: int) -> tuple[list[dict], list[dict]]:
+                bm25 = snapshot.idx.bm25_search(queries[i], limit * 500)
+                semantic = snapshot.semantic_search.search_chunks(
+                    queries[i], limit * 500, query_embedding=embeddings[i]
+                )
+                return bm25, semantic
+
+            with ThreadPoolExecutor(max_workers=len(variants)) as pool:
+                retrieved = list(pool.map(propagate(retrieve), range(len(variants))))
+
+            result_lists, weights, labels = [], [], []
+            for name, (bm25, semantic) in zip(names, retrieved):
+                prefix = "" if name == "original" else f"{name}_"
+                result_lists += [bm25, semantic]
+                weights += [MULTI_QUERY_WEIGHTS.get(name, 1.0)] * 2
+                labels += [f"{prefix}bm25", f"{prefix}semantic"]
+            with span("hybrid.fusion", lists=len(result_lists)):
+                return weighted_rank_fusion(result_lists, weights, k, labels, limit)
+
+
+def generate_query_variants(
+    query: str,
+    methods: tuple[str, ...] = MULTI_QUERY_METHODS,
+    deadline: Optional[Deadline] = None,
+) -> list[tuple[str, str]]:
+    """(method, query) pairs: the original plus each distinct enhancement
+
+    The enhancements run concurrently; any that fail, or are still running
+    when only retrieval's share of the `deadline` is left, are left out.
+    """
+    pool = ThreadPoolExecutor(max_workers=max(1, len(methods)))
+    with span("multi_query.variants", methods=len(methods)):
+        futures = {
+            method: pool.submit(propagate(enhance_query), query, method)
+            for method in methods
+        }
+        timeout = (
+            max(0.0, deadline.remaining() - DEADLINE_RETRIEVAL_SECONDS)
+            if deadline
+            else None
+        )
+        wait(futures.values(), timeout=timeout)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    variants = [("original", query)]
+    seen = {" ".join(query.lower().split())}
+    for method, future in futures.items():
+        if not future.done():
+            deadline.degrade("multi_query", "timeout", f"dropped the {method} variant")
+            continue
+        try:
+            variant = future.result()
+        except Exception:
+            continue
+        key = " ".join((variant or "").lower().split())
+        if key and key not in seen:
+            seen.add(key)
+            variants.append((method, variant))
+    return variants
 
 
 def normalize_scores(scores: list[float]) -> list[float]:
@@ -64,15 +470,16 @@ def normalize_scores(scores: list[float]) -> list[float]:
 
 
 def normalize_search_results(results: list[dict]) -> list[dict]:
+    """Copies of `results` with a `normalized_score`; the inputs are not modified"""
     scores: list[float] = []
     for result in results:
         scores.append(result["score"])
 
     normalized: list[float] = normalize_scores(scores)
-    for i, result in enumerate(results):
-        result["normalized_score"] = normalized[i]
-
-    return results
+    return [
+        {**result, "normalized_score": normalized[i]}
+        for i, result in enumerate(results)
+    ]
 
 
 def hybrid_score(
@@ -133,97 +540,433 @@ def rrf_score(rank: int, k: int = RRF_K) -> float:
     return 1 / (k + rank)
 
 
-def reciprocal_rank_fusion(
-    bm25_results: list[dict], semantic_results: list[dict], k: int = RRF_K
+def weighted_rank_fusion(
+    result_lists: list[list[dict]],
+    weights: Optional[list[float]] = None,
+    k: int = RRF_K,
+    labels: Optional[list[str]] = None,
+    limit: Optional[int] = None,
 ) -> list[dict]:
-    rrf_scores = {}
+    """Fuse any number of ranked lists: score(d) = sum_i w_i / (k + rank_i(d))
 
-    for rank, result in enumerate(bm25_results, start=1):
-        doc_id = result["id"]
-        if doc_id not in rrf_scores:
-            rrf_scores[doc_id] = {
-                "title": result["title"],
-                "document": result["document"],
-                "rrf_score": 0.0,
-                "bm25_rank": None,
-                "semantic_rank": None,
-            }
-        if rrf_scores[doc_id]["bm25_rank"] is None:
-            rrf_scores[doc_id]["bm25_rank"] = rank
-            rrf_scores[doc_id]["rrf_score"] += rrf_score(rank, k)
+    Only a document's first appearance in each list counts. Ties keep the
+    order in which documents were first seen.
 
-    for rank, result in enumerate(semantic_results, start=1):
-        doc_id = result["id"]
-        if doc_id not in rrf_scores:
-            rrf_scores[doc_id] = {
-                "title": result["title"],
-                "document": result["document"],
-                "rrf_score": 0.0,
-                "bm25_rank": None,
-                "semantic_rank": None,
-            }
-        if rrf_scores[doc_id]["semantic_rank"] is None:
-            rrf_scores[doc_id]["semantic_rank"] = rank
-            rrf_scores[doc_id]["rrf_score"] += rrf_score(rank, k)
+    Args:
+        weights: One per list, default 1.0 each
+        labels: One per list; each result then records its rank in every
+            list as `<label>_rank` metadata (None where absent). Without
+            labels, the metadata of a document's first appearance is kept.
+        limit: Only build results for this many top documents
+    """
+    weights = np.ones(len(result_lists)) if weights is None else np.asarray(weights)
+    column_of: dict = {}
+    first_seen: list[dict] = []
+    columns, ranks, list_ids = [], [], []
+    for list_id, results in enumerate(result_lists):
+        seen = set()
+        for rank, result in enumerate(results, start=1):
+            doc_id = result["id"]
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            if doc_id not in column_of:
+                column_of[doc_id] = len(first_seen)
+                first_seen.append(result)
+            columns.append(column_of[doc_id])
+            ranks.append(rank)
+            list_ids.append(list_id)
+    if not first_seen:
+        return []
 
-    rrf_results = []
-    for doc_id, data in rrf_scores.items():
-        result = format_search_result(
-            doc_id=doc_id,
-            title=data["title"],
-            document=data["document"],
-            score=data["rrf_score"],
-            rrf_score=data["rrf_score"],
-            bm25_rank=data["bm25_rank"],
-            semantic_rank=data["semantic_rank"],
+    columns = np.asarray(columns)
+    ranks = np.asarray(ranks, dtype=np.float64)
+    list_ids = np.asarray(list_ids)
+    scores = np.bincount(
+        columns, weights=weights[list_ids] / (k + ranks), minlength=len(first_seen)
+    )
+    if labels is not None:
+        rank_table = np.zeros((len(result_lists), len(first_seen)), dtype=np.int64)
+        rank_table[list_ids, columns] = ranks
+
+    if limit is None:
+        limit = len(first_seen)
+    fused = []
+    for column in top_k_indices(scores, limit).tolist():
+        result = first_seen[column]
+        score = float(scores[column])
+        if labels is None:
+            metadata = {**result.get("metadata", {}), "rrf_score": score}
+        else:
+            metadata = {"rrf_score": score}
+            for label, rank in zip(labels, rank_table[:, column].tolist()):
+                metadata[f"{label}_rank"] = rank or None
+        fused.append(
+            format_search_result(
+                doc_id=result["id"],
+                title=result["title"],
+                document=result["document"],
+                score=score,
+                **metadata,
+            )
         )
-        rrf_results.append(result)
+    return fused
 
-    return sorted(rrf_results, key=lambda x: x["score"], reverse=True)
+
+def reciprocal_rank_fusion(
+    bm25_results: list[dict],
+    semantic_results: list[dict],
+    k: int = RRF_K,
+    limit: Optional[int] = None,
+) -> list[dict]:
+    return weighted_rank_fusion(
+        [bm25_results, semantic_results],
+        k=k,
+        labels=["bm25", "semantic"],
+        limit=limit,
+    )
 
 
 def weighted_search_command(
-    query: str, alpha: float = DEFAULT_ALPHA, limit: int = DEFAULT_SEARCH_LIMIT
+    query: str,
+    alpha: float = DEFAULT_ALPHA,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    server: Optional[str] = None,
+    result_cache: bool = False,
 ) -> dict:
-    movies = load_movies()
-    searcher = HybridSearch(movies)
+    if server:
+        return SearchClient(server).hybrid(query, "weighted", alpha=alpha, limit=limit)
+    if not result_cache:
+        return run_weighted_search(HybridSearch(load_movies()), query, alpha, limit)
+    # Checked before loading anything, so a hit skips the model and index.
+    cache = ResultCache(path=RESULT_CACHE_PATH)
+    results = cache.get_or_compute(
+        ("weighted", normalize_query(query), alpha, limit),
+        current_cache_version(),
+        lambda: HybridSearch(load_movies()).weighted_search(query, alpha, limit),
+    )
+    cache.save()
+    return _weighted_result(query, alpha, results)
 
-    original_query = query
 
-    search_limit = limit
-    results = searcher.weighted_search(query, alpha, search_limit)
+def run_weighted_search(
+    searcher: HybridSearch,
+    query: str,
+    alpha: float = DEFAULT_ALPHA,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    query_embedding: Optional[np.ndarray] = None,
+) -> dict:
+    results = searcher.weighted_search(query, alpha, limit, query_embedding)
+    return _weighted_result(query, alpha, results)
 
+
+def _weighted_result(query: str, alpha: float, results: list[dict]) -> dict:
     return {
-        "original_query": original_query,
+        "original_query": query,
         "query": query,
         "alpha": alpha,
         "results": results,
     }
 
 
+def _enhance(query: str, enhance: str) -> tuple[str, str, Optional[dict[str, float]]]:
+    """Returns (enhanced query to show, query to search, BM25 expansions)"""
+    with span("enhance", method=enhance):
+        if enhance == "local_expand":
+            # Expansion terms only go to BM25, down-weighted; the semantic
+            # side and the reranker see the original query.
+            expansions = local_expansion_terms(query)
+            return " ".join([query, *expansions]), query, expansions
+        enhanced_query = enhance_query(query, method=enhance)
+        return enhanced_query, enhanced_query, None
+
+
+def speculative_rrf_search(
+    searcher: HybridSearch,
+    query: str,
+    enhance: str,
+    k: int,
+    limit: int,
+    enhance_timeout: float = SPECULATIVE_ENHANCE_TIMEOUT,
+) -> tuple[list[dict], Optional[str], str, dict]:
+    """Retrieve for the original query while the enhancement is still running
+
+    If the enhanced query arrives within `enhance_timeout` seconds (counted
+    from the start) and differs from the original, it is retrieved too and
+    both result lists are fused. Otherwise the original query's results,
+    already in hand, are returned.
+
+    Returns:
+        (results, enhanced query or None, query used downstream, report)
+    """
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(propagate(_enhance), query, enhance)
+    try:
+        with span("speculative.original_retrieval"):
+            results = searcher.rrf_search(query, k, limit)
+        retrieved_at = time.perf_counter() - start
+
+        with span("speculative.await_enhance") as s:
+            try:
+                shown, search_query, expansions = future.result(
+                    timeout=max(0.0, enhance_timeout - (time.perf_counter() - start))
+                )
+                outcome = "fused"
+            except FutureTimeoutError:
+                outcome = "enhance_timeout"
+            except Exception as e:
+                outcome = f"enhance_failed ({type(e).__name__})"
+            s.set(outcome=outcome)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    report = {
+        "outcome": outcome,
+        "original_retrieval_seconds": retrieved_at,
+        "enhance_seconds": time.perf_counter() - start if outcome == "fused" else None,
+    }
+    if outcome != "fused":
+        return results, None, query, report
+    if search_query == query and not expansions:
+        report["outcome"] = "unchanged"
+        return results, shown, query, report
+
+    with span("speculative.enhanced_retrieval"):
+        enhanced_results = searcher.rrf_search(search_query, k, limit, expansions)
+    with span("speculative.fusion"):
+        fused = weighted_rank_fusion([enhanced_results, results], k=k)
+    return fused[:limit], shown, search_query, report
+
+
 def rrf_search_command(
     query: str,
     k: int = RRF_K,
     enhance: Optional[str] = None,
     limit: int = DEFAULT_SEARCH_LIMIT,
     rerank_method: Optional[str] = None,
+    latency_budget: float = DEFAULT_RERANK_BUDGET,
+    speculative: bool = False,
+    enhance_timeout: float = SPECULATIVE_ENHANCE_TIMEOUT,
+    multi_query: Optional[tuple[str, ...]] = None,
+    server: Optional[str] = None,
+    result_cache: bool = False,
+    deadline: Optional[float] = None,
+) -> dict:
+    """Run an rrf-search request, in `deadline` seconds if given (see run_rrf_search)"""
+    if server:
+        return SearchClient(server).hybrid(
+            query,
+            "rrf",
+            k=k,
+            enhance=enhance,
+            limit=limit,
+            rerank_method=rerank_method,
+            latency_budget=latency_budget,
+            speculative=speculative,
+            enhance_timeout=enhance_timeout,
+            multi_query=multi_query,
+            deadline=deadline,
+        )
+    # Started before anything loads: the caller waits for that too.
+    request_deadline = Deadline.after(deadline)
+
+    def search() -> dict:
+        return _run_rrf_search(
+            HybridSearch(load_movies()),
+            query,
+            k,
+            enhance,
+            limit,
+            rerank_method,
+            latency_budget,
+            speculative,
+            enhance_timeout,
+            multi_query,
+            deadline=request_deadline,
+        )
+
+    if not result_cache or speculative:
+        return search()
+    # Checked before loading anything, so a hit skips the model and index.
+    cache = ResultCache(path=RESULT_CACHE_PATH)
+    result = cache.get_or_compute(
+        rrf_request_key(
+            query, k, enhance, limit, rerank_method, latency_budget, multi_query
+        ),
+        current_cache_version(),
+        search,
+        _undegraded,
+    )
+    cache.save()
+    return _for_query(result, query, request_deadline)
+
+
+def rrf_request_key(
+    query: str,
+    k: int,
+    enhance: Optional[str],
+    limit: int,
+    rerank_method: Optional[str],
+    latency_budget: float,
+    multi_query: Optional[tuple[str, ...]],
+) -> tuple:
+    """Result cache key of a whole rrf-search request"""
+    return (
+        "rrf_request",
+        normalize_query(query),
+        k,
+        enhance,
+        limit,
+        rerank_method,
+        # Only the cascade's output depends on its budget.
+        latency_budget if rerank_method == "cascade" else None,
+        tuple(multi_query) if multi_query else None,
+    )
+
+
+def _for_query(result: dict, query: str, deadline: Optional[Deadline]) -> dict:
+    """A cached request's result, as answered for this spelling of its query"""
+    if result["query"] == result["original_query"]:
+        result["query"] = query
+    result["original_query"] = query
+    result["deadline"] = deadline.report() if deadline else None
+    return result
+
+
+def _undegraded(result: dict) -> bool:
+    # A result cut short by one request's deadline must not answer the next.
+    return not (result["deadline"] and result["deadline"]["degraded"])
+
+
+def run_rrf_search(
+    searcher: HybridSearch,
+    query: str,
+    k: int = RRF_K,
+    enhance: Optional[str] = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    rerank_method: Optional[str] = None,
+    latency_budget: float = DEFAULT_RERANK_BUDGET,
+    speculative: bool = False,
+    enhance_timeout: float = SPECULATIVE_ENHANCE_TIMEOUT,
+    multi_query: Optional[tuple[str, ...]] = None,
+    query_embedding: Optional[np.ndarray] = None,
+    deadline: Optional[Deadline] = None,
 ) -> dict:
-    movies = load_movies()
-    searcher = HybridSearch(movies)
+    """rrf_search_command against an already loaded searcher
+
+    `query_embedding`, if given, is the original query's embedding and is
+    used when the query reaches retrieval unchanged. With a result cache on
+    the searcher, whole requests are cached, except speculative ones (their
+    outcome depends on timing).
 
+    With a `deadline`, retrieval always runs but enhancement and reranking
+    only do what the time left affords: enhancements are skipped or
+    abandoned, LLM reranking falls back to the cross-encoder, then to the
+    fusion order. The result's "deadline" report lists what was degraded.
+    """
+    args = (
+        searcher,
+        query,
+        k,
+        enhance,
+        limit,
+        rerank_method,
+        latency_budget,
+        speculative,
+        enhance_timeout,
+        multi_query,
+        query_embedding,
+        deadline,
+    )
+    if searcher.result_cache is None or speculative:
+        return _run_rrf_search(*args)
+    snapshot = searcher.snapshot
+    result = searcher.cached(
+        rrf_request_key(
+            query, k, enhance, limit, rerank_method, latency_budget, multi_query
+        ),
+        lambda: _run_rrf_search(*args),
+        snapshot,
+        _undegraded,
+    )
+    return _for_query(result, query, deadline)
+
+
+def _run_rrf_search(
+    searcher: HybridSearch,
+    query: str,
+    k: int = RRF_K,
+    enhance: Optional[str] = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    rerank_method: Optional[str] = None,
+    latency_budget: float = DEFAULT_RERANK_BUDGET,
+    speculative: bool = False,
+    enhance_timeout: float = SPECULATIVE_ENHANCE_TIMEOUT,
+    multi_query: Optional[tuple[str, ...]] = None,
+    query_embedding: Optional[np.ndarray] = None,
+    deadline: Optional[Deadline] = None,
+) -> dict:
     original_query = query
     enhanced_query = None
-    if enhance:
-        enhanced_query = enhance_query(query, method=enhance)
-        query = enhanced_query
-
+    expansions = None
+    speculation = None
+    variants = None
     search_limit = limit * SEARCH_MULTIPLIER if rerank_method else limit
-    results = searcher.rrf_search(query, k, search_limit)
+
+    can_enhance = (
+        bool(enhance) and not multi_query and _affords_enhance(deadline, enhance)
+    )
+    if multi_query:
+        if deadline:
+            multi_query = tuple(
+                method
+                for method in multi_query
+                if _affords_enhance(deadline, method, "multi_query")
+            )
+        variants = generate_query_variants(query, multi_query, deadline)
+        results = searcher.multi_query_rrf_search(variants, k, search_limit)
+    elif can_enhance and speculative:
+        if deadline:
+            enhance_timeout = min(
+                enhance_timeout,
+                max(0.0, deadline.remaining() - DEADLINE_RETRIEVAL_SECONDS),
+            )
+        results, enhanced_query, query, speculation = speculative_rrf_search(
+            searcher, query, enhance, k, search_limit, enhance_timeout
+        )
+        if deadline and speculation["outcome"] == "enhance_timeout":
+            deadline.degrade("enhance", "timeout", "kept the original query's results")
+    else:
+        if can_enhance:
+            enhanced = (
+                within(deadline, "enhance", _enhance, query, enhance)
+                if deadline
+                else _enhance(query, enhance)
+            )
+            if enhanced is not None:
+                enhanced_query, query, expansions = enhanced
+        if query != original_query:
+            query_embedding = None
+        results = searcher.rrf_search(
+            query, k, search_limit, expansions, query_embedding
+        )
 
     reranked = False
+    rerank_stages = []
     if rerank_method:
-        reranked = True
-        results = rerank(query, results, rerank_method)[:limit]
+        with span("rerank", method=rerank_method, candidates=len(results)):
+            if deadline:
+                results, rerank_stages, reranked = _rerank_within(
+                    deadline, query, results, rerank_method, latency_budget
+                )
+            elif rerank_method == "cascade":
+                results, rerank_stages = cascade_rerank(query, results, latency_budget)
+                reranked = True
+            else:
+                results = rerank(query, results, rerank_method)
+                reranked = True
+        results = results[:limit]
 
     return {
         "original_query": original_query,
@@ -233,5 +976,138 @@ def rrf_search_command(
         "k": k,
         "reranked": reranked,
         "rerank_method": rerank_method,
+        "rerank_stages": rerank_stages,
+        "speculation": speculation,
+        "variants": variants,
         "results": results,
+        "deadline": deadline.report() if deadline else None,
     }
+
+
+def _affords_enhance(
+    deadline: Optional[Deadline], method: str, stage: str = "enhance"
+) -> bool:
+    """Whether `method` fits in the deadline before retrieval; records it if not"""
+    if deadline is None:
+        return True
+    needs = (
+        DEADLINE_LOCAL_ENHANCE_SECONDS
+        if method.startswith("local_")
+        else DEADLINE_LLM_SECONDS
+    )
+    if deadline.affords(needs, reserve=DEADLINE_RETRIEVAL_SECONDS):
+        return True
+    deadline.degrade(
+        stage,
+        "skipped",
+        f"{method} needs ~{needs:.1f} s before retrieval, {deadline.remaining():.2f} s left",
+    )
+    return False
+
+
+def _rerank_within(
+    deadline: Deadline,
+    query: str,
+    results: list[dict],
+    rerank_method: str,
+    latency_budget: float,
+) -> tuple[list[dict], list, bool]:
+    """Rerank as far as the deadline allows: (results, cascade stages, reranked)
+
+    An LLM reranking that doesn't fit falls back to the cross-encoder, and
+    one that doesn't finish in time keeps the fusion order.
+    """
+    llm_methods = ("individual", "batch", "listwise")
+    if rerank_method in llm_methods:
+        needs = llm_rerank_seconds(len(results))
+        if deadline.affords(needs):
+            reranked = within(
+                deadline, "rerank", rerank, query, results, rerank_method, reserve=0.0
+            )
+            if reranked is None:
+                return results, [], False
+            return reranked, [], True
+        deadline.degrade(
+            "rerank",
+            "cross_encoder",
+            f"{rerank_method} needs ~{needs:.1f} s, {deadline.remaining():.2f} s left",
+        )
+    if not deadline.affords(DEADLINE_CROSS_ENCODER_SECONDS):
+        deadline.degrade(
+            "rerank", "skipped", f"{deadline.remaining():.2f} s left, kept fusion order"
+        )
+        return results, [], False
+    if rerank_method == "cascade":
+        # The cascade fits its LLM stage into whatever budget it is given.
+        ranked, stages = cascade_rerank(
+            query, results, min(latency_budget, deadline.remaining())
+        )
+        if stages[-1].status != "ok":
+            deadline.degrade(
+                "rerank", "cross_encoder", f"cascade LLM stage {stages[-1].status}"
+            )
+        return ranked, stages, True
+    reranked = within(deadline, "rerank", cross_encode, query, results, reserve=0.0)
+    if reranked is None:
+        return results, [], False
+    return reranked, [], True
+
+
+def batch_command(
+    input_path: str,
+    output_path: Optional[str] = None,
+    mode: str = "rrf",
+    k: int = RRF_K,
+    alpha: float = DEFAULT_ALPHA,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    enhance: Optional[str] = None,
+    rerank_method: Optional[str] = None,
+    latency_budget: float = DEFAULT_RERANK_BUDGET,
+    workers: int = DEFAULT_BATCH_WORKERS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+):
+    """Answer a JSONL file of queries with one loaded HybridSearch
+
+    Requests may override "mode", "k", "alpha", "limit", "enhance",
+    "rerank_method" and "latency_budget".
+    """
+    from .batch import batch_main
+
+    searcher = HybridSearch(load_movies())
+
+    def search(request: dict, embedding: np.ndarray) -> dict:
+        query = request["query"]
+        request_limit = request.get("limit", limit)
+        match request.get("mode", mode):
+            case "rrf":
+                result = run_rrf_search(
+                    searcher,
+                    query,
+                    request.get("k", k),
+                    request.get("enhance", enhance),
+                    request_limit,
+                    request.get("rerank_method", rerank_method),
+                    request.get("latency_budget", latency_budget),
+                    query_embedding=embedding,
+                )
+            case "weighted":
+                result = run_weighted_search(
+                    searcher,
+                    query,
+                    request.get("alpha", alpha),
+                    request_limit,
+                    embedding,
+                )
+            case other:
+                raise ValueError(f"unknown mode {other!r}, expected rrf or weighted")
+        result.pop("original_query")
+        return result
+
+    return batch_main(
+        input_path,
+        output_path,
+        search,
+        workers,
+        batch_size,
+        searcher.semantic_search.embed_queries,
+    )
@@ -2,64 +2,273 @@ import math
 import os
 import pickle
 import string
+import threading
+from array import array
 from collections import Counter, defaultdict
-
-from nltk.stem import PorterStemmer
-
+from collections.abc import Mapping
+
+import numpy as np
+
+from .artifacts import Manifest, atomic_write
+from .boolean_query import evaluate, parse_boolean_query
+from .corpus_store import CorpusStore
+from .phrase_query import (
+    Phrase,
+    compact_positions,
+    has_phrase,
+    parse_phrases,
+    within_window,
+)
+from .resources import get_stemmer
+from .spell import SpellCorrector
+from .search_client import SearchClient
 from .search_utils import (
     BM25_B,
     BM25_K1,
     CACHE_DIR,
+    DEFAULT_BATCH_WORKERS,
     DEFAULT_SEARCH_LIMIT,
+    PHRASE_BOOST,
+    SPELL_DICTIONARY_PATH,
+    STOPWORDS_PATH,
     format_search_result,
     load_movies,
     load_stopwords,
+    top_k_indices,
 )
+from .tracing import span
+
+INDEX_ARTIFACT = "keyword_index"
 
 
 class InvertedIndex:
-    def __init__(self) -> None:
+    def __init__(self, positional: bool = True) -> None:
+        self.positional = positional
+        # term -> sorted array of doc ids. Sets while building, converted by
+        # _freeze_postings so boolean queries can gallop through them.
         self.index = defaultdict(set)
-        self.docmap: dict[int, dict] = {}
+        # Movie id -> movie, a view of the shared corpus store.
+        self.docmap: Mapping[int, dict] = {}
+        self.corpus: CorpusStore | None = None
         self.index_path = os.path.join(CACHE_DIR, "index.pkl")
+        # Written by indexes before the corpus store was shared; removed on save.
         self.docmap_path = os.path.join(CACHE_DIR, "docmap.pkl")
         self.tf_path = os.path.join(CACHE_DIR, "term_frequencies.pkl")
         self.doc_lengths_path = os.path.join(CACHE_DIR, "doc_lengths.pkl")
+        self.positions_path = os.path.join(CACHE_DIR, "positions.pkl")
+        self.spell_path = SPELL_DICTIONARY_PATH
         self.term_frequencies = defaultdict(Counter)
         self.doc_lengths = {}
+        # term -> doc_id -> positions in the doc's token stream (stopwords
+        # removed). Loaded on the first phrase query, not by load().
+        self.positions: dict[str, dict[int, array]] | None = None
+        self._positions_lock = threading.Lock()
+        self._all_documents: array | None = None
+        self.spelling: SpellCorrector | None = None
+        # BM25 scoring state, derived once the index is complete (see
+        # _prepare_scoring) and never modified while queries run.
+        self._doc_ids = np.empty(0, dtype=np.int64)
+        self._id_order = np.empty(0, dtype=np.intp)
+        self._length_norm = np.empty(0)
+        self._avg_doc_length = 0.0
+        # token -> (score rows, term frequencies) as read-only arrays,
+        # filled on a term's first query.
+        self._term_arrays: dict[str, tuple[np.ndarray, np.ndarray]] = {}
 
     def build(self) -> None:
-        movies = load_movies()
-        for m in movies:
-            doc_id = m["id"]
-            doc_description = f"{m['title']} {m['description']}"
-            self.docmap[doc_id] = m
-            self.__add_document(doc_id, doc_description)
+        with span("index.build") as s:
+            if self.positional:
+                self.positions = defaultdict(dict)
+            movies = load_movies()
+            self.corpus = movies
+            self.docmap = movies.by_id
+            for m in movies:
+                doc_id = m["id"]
+                doc_description = f"{m['title']} {m['description']}"
+                self.__add_document(doc_id, doc_description)
+            self._freeze_postings()
+            self._prepare_scoring()
+            s.set(docs=len(self.docmap), terms=len(self.index))
+        with span("index.build_spelling"):
+            # Titles are counted a second time: they are what people type.
+            self.spelling = SpellCorrector.from_texts(
+                text
+                for m in movies
+                for text in (m["title"], m["description"], m["title"])
+            )
+
+    def _freeze_postings(self) -> None:
+        self.index = {
+            term: (
+                postings if isinstance(postings, array) else _sorted_postings(postings)
+            )
+            for term, postings in self.index.items()
+        }
+        self._all_documents = None
+
+    def _prepare_scoring(self) -> None:
+        """Per-document arrays BM25 scores from, in corpus (docmap) order
+
+        Everything here is computed once and only read afterwards, so any
+        number of threads can score against the same index.
+        """
+        doc_ids = np.fromiter(self.docmap, dtype=np.int64, count=len(self.docmap))
+        lengths = np.fromiter(
+            (self.doc_lengths.get(doc_id, 0) for doc_id in doc_ids.tolist()),
+            dtype=np.float64,
+            count=len(doc_ids),
+        )
+        avg_doc_length = self.__get_avg_doc_length()
+        if avg_doc_length > 0:
+            length_norm = 1 - BM25_B + BM25_B * (lengths / avg_doc_length)
+        else:
+            length_norm = np.ones(len(doc_ids))
+        id_order = np.argsort(doc_ids, kind="stable")
+        for value in (doc_ids, id_order, length_norm):
+            value.flags.writeable = False
+        self._doc_ids = doc_ids
+        self._id_order = id_order
+        self._length_norm = length_norm
+        self._avg_doc_length = avg_doc_length
+        self._term_arrays = {}
+
+    def _rows_of(self, doc_ids: np.ndarray) -> np.ndarray:
+        """Score-array rows of the given (indexed) doc ids"""
+        positions = np.searchsorted(self._doc_ids[self._id_order], doc_ids)
+        return self._id_order[positions]
+
+    def _term_columns(self, token: str) -> tuple[np.ndarray, np.ndarray]:
+        arrays = self._term_arrays.get(token)
+        if arrays is None:
+            postings = self.get_postings(token)
+            rows = self._rows_of(np.frombuffer(postings, dtype=np.int64))
+            tf = np.fromiter(
+                (self.term_frequencies[doc_id][token] for doc_id in postings),
+                dtype=np.float64,
+                count=len(postings),
+            )
+            rows.flags.writeable = False
+            tf.flags.writeable = False
+            arrays = (rows, tf)
+            # Racing threads compute identical arrays; either may win.
+            self._term_arrays[token] = arrays
+        return arrays
+
+    def _artifact_params(self, manifest: Manifest) -> dict:
+        return {"stopwords_sha256": manifest.source_sha256(STOPWORDS_PATH)}
+
+    def stale_reason(self) -> str | None:
+        """Why the saved index must be rebuilt, or None if it is current"""
+        manifest = Manifest()
+        return manifest.stale_reason(INDEX_ARTIFACT, self._artifact_params(manifest))
 
     def save(self) -> None:
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index, f)
-        with open(self.docmap_path, "wb") as f:
-            pickle.dump(self.docmap, f)
-        with open(self.tf_path, "wb") as f:
-            pickle.dump(self.term_frequencies, f)
-        with open(self.doc_lengths_path, "wb") as f:
-            pickle.dump(self.doc_lengths, f)
+        with span("index.save"):
+            manifest = Manifest()
+            manifest.forget(INDEX_ARTIFACT)
+            files = {
+                self.index_path: self.index,
+                self.tf_path: self.term_frequencies,
+                self.doc_lengths_path: self.doc_lengths,
+            }
+            if self.positions is not None:
+                files[self.positions_path] = dict(self.positions)
+            elif os.path.exists(self.positions_path):
+                os.remove(self.positions_path)
+            if os.path.exists(self.docmap_path):
+                os.remove(self.docmap_path)
+            for path, value in files.items():
+                with atomic_write(path) as f:
+                    pickle.dump(value, f)
+            if self.spelling is not None:
+                self.spelling.save(self.spell_path)
+                files[self.spell_path] = self.spelling
+            manifest.record(
+                INDEX_ARTIFACT, list(files), self._artifact_params(manifest)
+            )
 
     def load(self) -> None:
-        with open(self.index_path, "rb") as f:
-            self.index = pickle.load(f)
-        with open(self.docmap_path, "rb") as f:
-            self.docmap = pickle.load(f)
-        with open(self.tf_path, "rb") as f:
-            self.term_frequencies = pickle.load(f)
-        with open(self.doc_lengths_path, "rb") as f:
-            self.doc_lengths = pickle.load(f)
+        with span("index.load_pickles") as s:
+            with open(self.index_path, "rb") as f:
+                self.index = pickle.load(f)
+            with open(self.tf_path, "rb") as f:
+                self.term_frequencies = pickle.load(f)
+            with open(self.doc_lengths_path, "rb") as f:
+                self.doc_lengths = pickle.load(f)
+            self.corpus = load_movies()
+            self.docmap = self.corpus.by_id
+            # Indexes saved before postings were sorted hold sets.
+            self._freeze_postings()
+            self._prepare_scoring()
+            s.set(docs=len(self.docmap))
+
+    def has_positions(self) -> bool:
+        return self.positions is not None or os.path.exists(self.positions_path)
+
+    def load_positions(self) -> dict[str, dict[int, array]]:
+        if self.positions is None:
+            with self._positions_lock:
+                if self.positions is None:
+                    if not os.path.exists(self.positions_path):
+                        raise ValueError(
+                            "No positional index found. Rebuild the index with positions enabled."
+                        )
+                    with span("index.load_positions"):
+                        with open(self.positions_path, "rb") as f:
+                            self.positions = pickle.load(f)
+        return self.positions
+
+    def phrase_documents(self, phrase: Phrase) -> list[int]:
+        """Documents containing the phrase, or its words within `slop` extra positions"""
+        tokens = tokenize_text(phrase.text)
+        if not tokens:
+            return []
+        positions = self.load_positions()
+        postings = [positions.get(token, {}) for token in tokens]
+        with span("index.phrase_match", tokens=len(tokens), slop=phrase.slop):
+            # Intersect doc sets rarest first, then check positions.
+            rarest = min(postings, key=len)
+            candidates = [
+                doc_id
+                for doc_id in rarest
+                if all(doc_id in posting for posting in postings)
+            ]
+            matches = []
+            for doc_id in candidates:
+                lists = [posting[doc_id] for posting in postings]
+                if len(tokens) == 1:
+                    matched = True
+                elif phrase.slop == 0:
+                    matched = has_phrase(lists)
+                else:
+                    matched = within_window(lists, phrase.slop)
+                if matched:
+                    matches.append(doc_id)
+            return sorted(matches)
 
     def get_documents(self, term: str) -> list[int]:
-        doc_ids = self.index.get(term, set())
-        return sorted(list(doc_ids))
+        return list(self.get_postings(term))
+
+    def get_postings(self, token: str) -> array:
+        """Sorted doc ids containing an already-tokenized term"""
+        return self.index.get(token, _EMPTY_POSTINGS)
+
+    def all_documents(self) -> array:
+        if self._all_documents is None:
+            self._all_documents = _sorted_postings(self.docmap)
+        return self._all_documents
+
+    def tokenize(self, text: str) -> list[str]:
+        return tokenize_text(text)
+
+    def boolean_search(self, query: str) -> list[int]:
+        """Sorted ids of documents matching an AND/OR/NOT query"""
+        with span("boolean.parse"):
+            node = parse_boolean_query(query)
+        with span("boolean.evaluate") as s:
+            doc_ids = evaluate(node, self)
+            s.set(matches=len(doc_ids))
+        return doc_ids
 
     def __add_document(self, doc_id: int, text: str) -> None:
         tokens = tokenize_text(text)
@@ -67,6 +276,12 @@ class InvertedIndex:
             self.index[token].add(doc_id)
         self.term_frequencies[doc_id].update(tokens)
         self.doc_lengths[doc_id] = len(tokens)
+        if self.positions is not None:
+            token_positions = defaultdict(list)
+            for position, token in enumerate(tokens):
+                token_positions[token].append(position)
+            for token, token_position_list in token_positions.items():
+                self.positions[token][doc_id] = compact_positions(token_position_list)
 
     def get_tf(self, doc_id: int, term: str) -> int:
         tokens = tokenize_text(term)
@@ -81,24 +296,35 @@ class InvertedIndex:
             raise ValueError("term must be a single token")
         token = tokens[0]
         doc_count = len(self.docmap)
-        term_doc_count = len(self.index[token])
+        term_doc_count = len(self.get_postings(token))
         return math.log((doc_count + 1) / (term_doc_count + 1))
 
     def get_bm25_idf(self, term: str) -> float:
         tokens = tokenize_text(term)
         if len(tokens) != 1:
             raise ValueError("term must be a single token")
-        token = tokens[0]
+        return self._bm25_idf_token(tokens[0])
+
+    def _bm25_idf_token(self, token: str) -> float:
         doc_count = len(self.docmap)
-        term_doc_count = len(self.index[token])
+        term_doc_count = len(self.get_postings(token))
         return math.log((doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1)
 
     def get_bm25_tf(
         self, doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B
     ) -> float:
         tf = self.get_tf(doc_id, term)
+        return self._bm25_tf_token(tf, doc_id, self._avg_doc_length, k1, b)
+
+    def _bm25_tf_token(
+        self,
+        tf: int,
+        doc_id: int,
+        avg_doc_length: float,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> float:
         doc_length = self.doc_lengths.get(doc_id, 0)
-        avg_doc_length = self.__get_avg_doc_length()
         if avg_doc_length > 0:
             length_norm = 1 - b + b * (doc_length / avg_doc_length)
         else:
@@ -123,57 +349,190 @@ class InvertedIndex:
         idf_component = self.get_bm25_idf(term)
         return tf_component * idf_component
 
-    def bm25_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
-        query_tokens = tokenize_text(query)
-
-        scores = {}
-        for doc_id in self.docmap:
-            score = 0.0
+    def _add_bm25_scores(self, scores: np.ndarray, token: str, weight: float) -> None:
+        # The same arithmetic as _bm25_tf_token, one posting per element.
+        rows, tf = self._term_columns(token)
+        if not len(rows):
+            return
+        idf = self._bm25_idf_token(token)
+        k1 = BM25_K1
+        scores[rows] += (
+            weight * idf * ((tf * (k1 + 1)) / (tf + k1 * self._length_norm[rows]))
+        )
+
+    def bm25_search(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        phrase_boost: float = PHRASE_BOOST,
+        expansions: dict[str, float] | None = None,
+    ) -> list[dict]:
+        """BM25 over the query's tokens
+
+        Args:
+            expansions: Extra index tokens scored at a fraction of a query
+                token's weight, e.g. from local query expansion
+        """
+        phrases, query = parse_phrases(query)
+        with span("bm25.tokenize"):
+            query_tokens = tokenize_text(query)
+
+        with span("bm25.score", docs=len(self.docmap), tokens=len(query_tokens)):
+            # Every document is ranked (most at 0.0), but only the postings
+            # of the query's tokens contribute. The scores array belongs to
+            # this query alone; the index is only read.
+            scores = np.zeros(len(self._doc_ids))
             for token in query_tokens:
-                score += self.bm25(doc_id, token)
-            scores[doc_id] = score
-
-        sorted_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-
+                self._add_bm25_scores(scores, token, 1.0)
+
+        if phrases and phrase_boost and self.has_positions():
+            with span("bm25.phrase_boost", phrases=len(phrases)):
+                for phrase in phrases:
+                    boost = phrase_boost * sum(
+                        self._bm25_idf_token(token)
+                        for token in tokenize_text(phrase.text)
+                    )
+                    doc_ids = self.phrase_documents(phrase)
+                    if doc_ids:
+                        scores[self._rows_of(np.asarray(doc_ids))] += boost
+
+        if expansions:
+            with span("bm25.expansions", tokens=len(expansions)):
+                for token, weight in expansions.items():
+                    self._add_bm25_scores(scores, token, weight)
+
+        with span("bm25.sort"):
+            top_rows = top_k_indices(scores, limit)
+
+        # Rows are corpus store positions, so only the two fields shown are
+        # decoded.
         results = []
-        for doc_id, score in sorted_docs[:limit]:
-            doc = self.docmap[doc_id]
+        for row in top_rows.tolist():
             formatted_result = format_search_result(
-                doc_id=doc["id"],
-                title=doc["title"],
-                document=doc["description"],
-                score=score,
+                doc_id=self.corpus.id_of(row),
+                title=self.corpus.title(row),
+                document=self.corpus.description(row),
+                score=float(scores[row]),
             )
             results.append(formatted_result)
 
         return results
 
 
-def build_command() -> None:
-    idx = InvertedIndex()
+def build_command(positional: bool = True) -> None:
+    idx = InvertedIndex(positional)
     idx.build()
     idx.save()
 
 
-def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+def phrase_command(
+    phrase: str,
+    slop: int = 0,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    server: str | None = None,
+) -> list[dict]:
+    if server:
+        return SearchClient(server).keyword(phrase, "phrase", limit, slop)
     idx = InvertedIndex()
     idx.load()
-    query_tokens = tokenize_text(query)
+    return _phrase_search(idx, phrase, slop, limit)
+
+
+def _phrase_search(
+    idx: InvertedIndex, phrase: str, slop: int, limit: int
+) -> list[dict]:
+    doc_ids = idx.phrase_documents(Phrase(phrase, slop))
+    return [idx.docmap[doc_id] for doc_id in doc_ids[:limit]]
+
+
+def search_command(
+    query: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    boolean: bool = False,
+    server: str | None = None,
+) -> list[dict]:
+    if server:
+        mode = "boolean" if boolean else "search"
+        return SearchClient(server).keyword(query, mode, limit)
+    idx = InvertedIndex()
+    idx.load()
+    return _keyword_search(idx, query, limit, boolean)
+
+
+def _keyword_search(
+    idx: InvertedIndex, query: str, limit: int, boolean: bool = False
+) -> list[dict]:
+    if boolean:
+        doc_ids = idx.boolean_search(query)
+        return [idx.docmap[doc_id] for doc_id in doc_ids[:limit]]
+    with span("keyword.tokenize"):
+        query_tokens = tokenize_text(query)
     seen, results = set(), []
-    for query_token in query_tokens:
-        matching_doc_ids = idx.get_documents(query_token)
-        for doc_id in matching_doc_ids:
-            if doc_id in seen:
-                continue
-            seen.add(doc_id)
-            doc = idx.docmap[doc_id]
-            results.append(doc)
-            if len(results) >= limit:
-                return results
+    with span("keyword.lookup", tokens=len(query_tokens)):
+        for query_token in query_tokens:
+            matching_doc_ids = idx.get_documents(query_token)
+            for doc_id in matching_doc_ids:
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                doc = idx.docmap[doc_id]
+                results.append(doc)
+                if len(results) >= limit:
+                    return results
 
     return results
 
 
+BATCH_MODES = ("bm25", "search", "boolean", "phrase")
+
+
+def batch_command(
+    input_path: str,
+    output_path: str | None = None,
+    mode: str = "bm25",
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    slop: int = 0,
+    workers: int = DEFAULT_BATCH_WORKERS,
+):
+    """Answer a JSONL file of queries with one loaded index
+
+    Requests may override "mode", "limit" and "slop".
+    """
+    from .batch import batch_main
+
+    idx = InvertedIndex()
+    idx.load()
+
+    def search(request: dict, _embedding) -> dict:
+        query = request["query"]
+        request_limit = request.get("limit", limit)
+        match request.get("mode", mode):
+            case "bm25":
+                results = idx.bm25_search(query, request_limit)
+            case "search":
+                results = _keyword_search(idx, query, request_limit)
+            case "boolean":
+                results = _keyword_search(idx, query, request_limit, boolean=True)
+            case "phrase":
+                results = _phrase_search(
+                    idx, query, request.get("slop", slop), request_limit
+                )
+            case other:
+                raise ValueError(
+                    f"unknown mode {other!r}, expected one of {BATCH_MODES}"
+                )
+        return {"results": results}
+
+    return batch_main(input_path, output_path, search, workers)
+
+
+_EMPTY_POSTINGS = array("q")
+
+
+def _sorted_postings(doc_ids) -> array:
+    return array("q", sorted(doc_ids))
+
+
 def preprocess_text(text: str) -> str:
     text = text.lower()
     text = text.translate(str.maketrans("", "", string.punctuation))
@@ -192,7 +551,7 @@ def tokenize_text(text: str) -> list[str]:
     for word in valid_tokens:
         if word not in stop_words:
             filtered_words.append(word)
-    stemmer = PorterStemmer()
+    stemmer = get_stemmer()
     stemmed_words = []
     for word in filtered_words:
         stemmed_words.append(stemmer.stem(word))
@@ -231,7 +590,11 @@ def tfidf_command(doc_id: int, term: str) -> float:
     return idx.get_tf_idf(doc_id, term)
 
 
-def bm25search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+def bm25search_command(
+    query: str, limit: int = DEFAULT_SEARCH_LIMIT, server: str | None = None
+) -> list[dict]:
+    if server:
+        return SearchClient(server).keyword(query, "bm25", limit)
     idx = InvertedIndex()
     idx.load()
     return idx.bm25_search(query, limit)
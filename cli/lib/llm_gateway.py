@@ -0,0 +1,321 @@
+import asyncio
+import http.client
+import json
+import queue
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import urlsplit
+
+from .tracing import span
+
+# Every LLM call in lib goes through one LLMGateway. It owns a private event
+# loop on a daemon thread, so synchronous callers (and the thread pools in
+# rerank) share one set of connections, one concurrency limit and one set
+# of stats. Backends are async: Gemini through the SDK's aio client, or any
+# HTTP endpoint speaking the small JSON protocol of llm_stub_server.py.
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+# Percentiles cover the most recent calls only, so a long-running server
+# keeps a bounded window instead of every latency it ever saw.
+LATENCY_WINDOW = 4096
+
+
+class LLMError(RuntimeError):
+    def __init__(self, message: str, retryable: bool = False) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    latency: float = 0.0
+    attempts: int = 1
+    hedged: bool = False
+
+
+@dataclass
+class GatewayStats:
+    calls: int = 0
+    failures: int = 0
+    retries: int = 0
+    timeouts: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    latencies: deque[float] = field(
+        default_factory=lambda: deque(maxlen=LATENCY_WINDOW)
+    )
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        # copy() is atomic, where iterating could race a call being recorded.
+        ordered = sorted(self.latencies.copy())
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def summary(self) -> str:
+        return (
+            f"LLM: {self.calls} calls, {self.failures} failed, {self.retries} retries, "
+            f"{self.timeouts} timeouts, {self.hedge_wins}/{self.hedges} hedges won, "
+            f"{self.prompt_tokens} prompt + {self.response_tokens} response tokens, "
+            f"p50 {self.percentile(50) * 1000:.0f} ms, "
+            f"p95 {self.percentile(95) * 1000:.0f} ms"
+        )
+
+
+class GeminiBackend:
+    def __init__(self, client, model: str) -> None:
+        self.client = client
+        self.model = model
+
+    async def generate(self, prompt: str, timeout: float) -> LLMResponse:
+        from google.genai import errors
+
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=self.model, contents=prompt
+            )
+        except errors.APIError as e:
+            raise LLMError(str(e), e.code in RETRYABLE_STATUS_CODES) from e
+        usage = response.usage_metadata
+        return LLMResponse(
+            text=response.text or "",
+            prompt_tokens=(usage and usage.prompt_token_count) or 0,
+            response_tokens=(usage and usage.candidates_token_count) or 0,
+        )
+
+
+class HTTPBackend:
+    """POST {"model", "prompt"} to a URL and read {"text", "prompt_tokens", "response_tokens"}
+
+    Keep-alive connections are pooled and reused across calls; each request
+    runs on a worker thread so the gateway's loop stays free.
+    """
+
+    def __init__(self, url: str, model: str) -> None:
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.path = parts.path or "/"
+        self.model = model
+        self._pool: queue.SimpleQueue = queue.SimpleQueue()
+
+    def _connection(self, timeout: float) -> http.client.HTTPConnection:
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            cls = (
+                http.client.HTTPSConnection
+                if self.scheme == "https"
+                else http.client.HTTPConnection
+            )
+            connection = cls(self.netloc, timeout=timeout)
+            connection.connect()
+            # http.client writes headers and body separately.
+            connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return connection
+
+    def _post(self, prompt: str, timeout: float) -> LLMResponse:
+        body = json.dumps({"model": self.model, "prompt": prompt})
+        connection = None
+        try:
+            connection = self._connection(timeout)
+            connection.request(
+                "POST", self.path, body, {"Content-Type": "application/json"}
+            )
+            response = connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            if connection is not None:
+                connection.close()
+            raise LLMError(f"{type(e).__name__}: {e}", retryable=True) from e
+        self._pool.put(connection)
+        if response.status != 200:
+            raise LLMError(
+                f"HTTP {response.status}: {payload[:200]!r}",
+                response.status in RETRYABLE_STATUS_CODES,
+            )
+        try:
+            data = json.loads(payload)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            # A truncated or garbled body is worth another attempt.
+            raise LLMError(
+                f"Invalid JSON response: {payload[:200]!r}", retryable=True
+            ) from e
+        if not isinstance(data, dict):
+            raise LLMError(f"Unexpected response: {payload[:200]!r}", retryable=True)
+        return LLMResponse(
+            text=data.get("text", ""),
+            prompt_tokens=data.get("prompt_tokens", 0),
+            response_tokens=data.get("response_tokens", 0),
+        )
+
+    async def generate(self, prompt: str, timeout: float) -> LLMResponse:
+        return await asyncio.to_thread(self._post, prompt, timeout)
+
+
+class LLMGateway:
+    """Timeouts, retries with backoff, a concurrency limit and hedging around a backend
+
+    Args:
+        max_concurrency: Calls in flight at once; the rest wait their turn
+        timeout: Seconds allowed per attempt
+        retries: Extra attempts after a timeout or retryable error, with
+            exponential backoff and full jitter between them
+        hedge_after: If set, a call still running after this many seconds
+            is raced against a duplicate, and the first answer wins
+    """
+
+    def __init__(
+        self,
+        backend,
+        max_concurrency: int = 8,
+        timeout: float = 30.0,
+        retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge_after: Optional[float] = None,
+    ) -> None:
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.stats = GatewayStats()
+        self._stats_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                # Thread-backed backends need a thread per call in flight,
+                # hedges included.
+                loop.set_default_executor(
+                    ThreadPoolExecutor(
+                        max_workers=2 * self.max_concurrency,
+                        thread_name_prefix="llm-gateway-io",
+                    )
+                )
+                threading.Thread(
+                    target=loop.run_forever, name="llm-gateway", daemon=True
+                ).start()
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._loop = loop
+            return self._loop
+
+    def generate(self, prompt: str, stage: Optional[str] = None) -> LLMResponse:
+        """Blocking call, safe from any thread."""
+        loop = self._ensure_loop()
+        with span("llm.generate", stage=stage) as s:
+            response = asyncio.run_coroutine_threadsafe(
+                self.agenerate(prompt), loop
+            ).result()
+            s.set(
+                attempts=response.attempts,
+                hedged=response.hedged,
+                tokens=response.prompt_tokens + response.response_tokens,
+            )
+        return response
+
+    def generate_many(
+        self, prompts: list[str], stage: Optional[str] = None
+    ) -> list[LLMResponse]:
+        """Run prompts concurrently (up to max_concurrency), results in order."""
+        loop = self._ensure_loop()
+
+        async def run_all():
+            return await asyncio.gather(*(self.agenerate(p) for p in prompts))
+
+        with span("llm.generate_many", stage=stage, prompts=len(prompts)):
+            return asyncio.run_coroutine_threadsafe(run_all(), loop).result()
+
+    async def agenerate(self, prompt: str) -> LLMResponse:
+        async with self._semaphore:
+            start = time.perf_counter()
+            for attempt in range(1, self.retries + 2):
+                try:
+                    response, hedged = await asyncio.wait_for(
+                        self._hedged(prompt), self.timeout
+                    )
+                except (asyncio.TimeoutError, LLMError) as e:
+                    timed_out = isinstance(e, asyncio.TimeoutError)
+                    retryable = timed_out or e.retryable
+                    with self._stats_lock:
+                        self.stats.timeouts += timed_out
+                        if not retryable or attempt > self.retries:
+                            self.stats.calls += 1
+                            self.stats.failures += 1
+                        else:
+                            self.stats.retries += 1
+                    if not retryable or attempt > self.retries:
+                        if timed_out:
+                            raise LLMError(
+                                f"LLM call timed out after {attempt} attempts"
+                            ) from e
+                        raise
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+
+                response.latency = time.perf_counter() - start
+                response.attempts = attempt
+                response.hedged = hedged
+                self._record(response)
+                return response
+
+    async def _hedged(self, prompt: str) -> tuple[LLMResponse, bool]:
+        primary = asyncio.ensure_future(self.backend.generate(prompt, self.timeout))
+        if self.hedge_after is None:
+            return await primary, False
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result(), False
+
+        hedge = asyncio.ensure_future(self.backend.generate(prompt, self.timeout))
+        with self._stats_lock:
+            self.stats.hedges += 1
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with self._stats_lock:
+                                self.stats.hedge_wins += 1
+                        return task.result(), task is hedge
+            # Both failed: surface the primary's error.
+            return primary.result(), False
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _backoff(self, attempt: int) -> float:
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def _record(self, response: LLMResponse) -> None:
+        with self._stats_lock:
+            stats = self.stats
+            stats.calls += 1
+            stats.prompt_tokens += response.prompt_tokens
+            stats.response_tokens += response.response_tokens
+            stats.latencies.append(response.latency)
@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from .tracing import span
+
+# Set in each worker process by _init_worker.
+_worker_model = None
+
+
+def _init_worker(model_name: str, backend: str, torch_threads: int) -> None:
+    global _worker_model
+    # Must be set before torch is imported to bound its intra-op pools.
+    os.environ["OMP_NUM_THREADS"] = str(torch_threads)
+    os.environ["MKL_NUM_THREADS"] = str(torch_threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    import torch
+
+    from .resources import get_sentence_transformer
+
+    torch.set_num_threads(torch_threads)
+    _worker_model = get_sentence_transformer(model_name, backend)
+
+
+def _encode_batch(texts: list[str]) -> np.ndarray:
+    return _worker_model.encode(texts, batch_size=len(texts))
+
+
+def default_torch_threads(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+class ParallelEncoder:
+    """Encode text across a pool of worker processes, one model per worker.
+
+    `encode_batches` takes batches already planned by an EncodeScheduler
+    and runs each one as a single task, results in batch order.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        backend: str,
+        workers: int,
+        torch_threads: Optional[int] = None,
+    ) -> None:
+        self.workers = workers
+        self.torch_threads = torch_threads or default_torch_threads(workers)
+        with span("parallel_encode.start_pool", workers=workers):
+            # spawn, not fork: forking a process that already holds torch
+            # thread pools can deadlock.
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, backend, self.torch_threads),
+            )
+
+    def encode_batches(self, batches: list[list[str]]) -> list[np.ndarray]:
+        """Encode pre-planned batches as-is, one task per batch."""
+        with span("parallel_encode.encode_batches", batches=len(batches)):
+            return list(self._pool.map(_encode_batch, batches))
+
+    def close(self) -> None:
+        self._pool.shutdown()
+
+    def __enter__(self) -> "ParallelEncoder":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.close()
+        return False
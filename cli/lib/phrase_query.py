@@ -0,0 +1,92 @@
+import re
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+
+# "exact phrase" or "terms near each other"~N
+_PHRASE_PATTERN = re.compile(r'"([^"]+)"(?:~(\d+))?')
+
+
+@dataclass(frozen=True)
+class Phrase:
+    text: str
+    slop: int = 0
+
+
+def parse_phrases(query: str) -> tuple[list[Phrase], str]:
+    """Split quoted phrases out of a query
+
+    Returns:
+        The phrases, and the query with quotes and ~N operators removed so
+        the phrase words still count as ordinary terms.
+    """
+    phrases = [
+        Phrase(match.group(1), int(match.group(2) or 0))
+        for match in _PHRASE_PATTERN.finditer(query)
+    ]
+    plain = _PHRASE_PATTERN.sub(lambda match: match.group(1), query)
+    return phrases, plain
+
+
+def compact_positions(positions: list[int]) -> array:
+    """Store a position list in the smallest array type that fits it."""
+    typecode = "H" if positions[-1] < 1 << 16 else "I"
+    return array(typecode, positions)
+
+
+def has_phrase(position_lists: list[array]) -> bool:
+    """True if the tokens occur at consecutive positions."""
+    # Walk the rarest list and binary-search the others (positions are sorted).
+    anchor = min(range(len(position_lists)), key=lambda i: len(position_lists[i]))
+    others = [
+        (offset - anchor, positions)
+        for offset, positions in enumerate(position_lists)
+        if offset != anchor
+    ]
+    for p in position_lists[anchor]:
+        if all(_contains(positions, p + delta) for delta, positions in others):
+            return True
+    return False
+
+
+def _contains(positions: array, value: int) -> bool:
+    i = bisect_left(positions, value)
+    return i < len(positions) and positions[i] == value
+
+
+def within_window(position_lists: list[array], slop: int) -> bool:
+    """True if every token occurs, in any order, within len(tokens) + slop positions."""
+    # A repeated token has to occur that many times in the window: one
+    # position can't fill two slots. Two tokens never share a position, so
+    # equal lists mean the same token.
+    distinct: list[array] = []
+    needed: list[int] = []
+    for positions in position_lists:
+        for i, seen in enumerate(distinct):
+            if seen is positions or seen == positions:
+                needed[i] += 1
+                break
+        else:
+            distinct.append(positions)
+            needed.append(1)
+
+    events = sorted(
+        (p, token) for token, positions in enumerate(distinct) for p in positions
+    )
+    window = len(position_lists) - 1 + slop
+    counts = [0] * len(distinct)
+    covered = 0
+    left = 0
+    for right_pos, token in events:
+        counts[token] += 1
+        if counts[token] == needed[token]:
+            covered += 1
+        while covered == len(distinct):
+            left_pos, left_token = events[left]
+            if right_pos - left_pos <= window:
+                return True
+            if counts[left_token] == needed[left_token]:
+                covered -= 1
+            counts[left_token] -= 1
+            left += 1
+    return False
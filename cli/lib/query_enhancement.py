@@ -1,13 +1,9 @@
-import os
 from typing import Optional
 
-from dotenv import load_dotenv
-from google import genai
-
-load_dotenv()
-api_key = os.getenv("gemini_api_key")
-client = genai.Client(api_key=api_key)
-model = "gemini-2.0-flash"
+from .keyword_search import tokenize_text
+from .resources import get_expansion_table, get_llm_gateway, get_spell_corrector
+from .search_utils import EXPANSION_WEIGHT
+from .tracing import span
 
 
 def spell_correct(query: str) -> str:
@@ -20,11 +16,18 @@ Query: "{query}"
 If no errors, return the original query.
 Corrected:"""
 
-    response = client.models.generate_content(model=model, contents=prompt)
+    response = get_llm_gateway().generate(prompt, stage="spell")
     corrected = (response.text or "").strip().strip('"')
     return corrected if corrected else query
 
 
+def local_spell_correct(query: str) -> str:
+    """Offline spell correction against the keyword index vocabulary"""
+    corrector = get_spell_corrector()
+    with span("spell.correct"):
+        return corrector.correct(query)
+
+
 def rewrite_query(query: str) -> str:
     promt = f"""Rewrite this movie search query to be more specific and searchable.
 
@@ -45,7 +48,7 @@ def rewrite_query(query: str) -> str:
 
     Rewritten query:"""
 
-    response = client.models.generate_content(model=model, contents=promt)
+    response = get_llm_gateway().generate(promt, stage="rewrite")
     rewritten = (response.text or "").strip().strip('"')
     return rewritten if rewritten else query
 
@@ -65,19 +68,31 @@ def expand_query(query: str) -> str:
 
     Query: "{query}"
     """
-    response = client.models.generate_content(model=model, contents=prompt)
+    response = get_llm_gateway().generate(prompt, stage="expand")
     expanded = (response.text or "").strip().strip('"')
     expanded_query = f"{query} {expanded}"
     return expanded_query if expanded_query else query
 
 
+def local_expansion_terms(query: str) -> dict[str, float]:
+    """Related index tokens for the query, weighted for BM25, without an LLM"""
+    table = get_expansion_table()
+    with span("expansion.lookup"):
+        expansions = table.expand(tokenize_text(query))
+        return {token: EXPANSION_WEIGHT * score for token, score in expansions.items()}
+
+
 def enhance_query(query: str, method: Optional[str] = None) -> str:
     match method:
         case "spell":
             return spell_correct(query)
+        case "local_spell":
+            return local_spell_correct(query)
         case "rewrite":
             return rewrite_query(query)
         case "expand":
             return expand_query(query)
+        case "local_expand":
+            return " ".join([query, *local_expansion_terms(query)])
         case _:
             return query
@@ -0,0 +1,227 @@
+import pickle
+from collections import Counter
+from typing import Callable, Optional
+
+import numpy as np
+
+from .artifacts import Manifest, atomic_write
+from .search_utils import EMBEDDING_MODEL, EXPANSIONS_PATH
+from .tracing import span
+
+# Offline replacement for the LLM `expand_query`: every index term maps to a
+# few related terms, found once from the corpus and stored as
+#
+#   {"params": {...}, "table": {term: ((expansion, weight), ...)}}
+#
+# Terms and expansions are stemmed index tokens, so a lookup is one dict hit
+# per query token and the expansions go straight into BM25.
+EXPANSIONS_PER_TERM = 3
+# Terms in fewer documents than this have unreliable co-occurrence counts,
+# and terms in more than MAX_DOC_FRACTION of them co-occur with everything.
+MIN_DOC_FREQUENCY = 3
+MAX_DOC_FRACTION = 0.3
+MIN_COOCCURRENCE = 2
+# Candidates come from both sources; each is scored as a blend of its
+# normalized PMI and its embedding cosine similarity.
+PMI_WEIGHT = 0.5
+MIN_EXPANSION_SCORE = 0.35
+EMBED_BLOCK_SIZE = 1024
+
+EXPANSIONS_ARTIFACT = "expansions"
+
+
+class ExpansionTable:
+    def __init__(self, table: dict[str, tuple], params: dict) -> None:
+        self.table = table
+        self.params = params
+
+    def expand(self, tokens: list[str]) -> dict[str, float]:
+        """Weighted expansion tokens for a tokenized query, excluding its own tokens"""
+        expansions: dict[str, float] = {}
+        for token in tokens:
+            for expansion, weight in self.table.get(token, ()):
+                if expansion not in tokens and weight > expansions.get(expansion, 0):
+                    expansions[expansion] = weight
+        return expansions
+
+    def save(self, path: str) -> None:
+        with atomic_write(path) as f:
+            pickle.dump({"params": self.params, "table": self.table}, f)
+
+    @staticmethod
+    def load(path: str) -> "ExpansionTable":
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return ExpansionTable(data["table"], data["params"])
+
+
+def build_expansion_table(
+    doc_terms: list[list[str]],
+    surface_forms: dict[str, str],
+    encode: Optional[Callable[[list[str]], np.ndarray]],
+    params: dict,
+    expansions_per_term: int = EXPANSIONS_PER_TERM,
+) -> ExpansionTable:
+    """Build the table from each document's distinct terms
+
+    Args:
+        doc_terms: Distinct index tokens of every document
+        surface_forms: A readable word for each token, which is what gets
+            embedded ("movi" is embedded as "movie")
+        encode: Sentence embedding function, or None for PMI only
+        params: Recorded with the table so a stale one can be detected
+    """
+    num_docs = len(doc_terms)
+    with span("expansion.vocabulary"):
+        doc_frequency = Counter(term for terms in doc_terms for term in terms)
+        max_df = max(MIN_DOC_FREQUENCY, MAX_DOC_FRACTION * num_docs)
+        vocabulary = sorted(
+            term
+            for term, df in doc_frequency.items()
+            if MIN_DOC_FREQUENCY <= df <= max_df and term in surface_forms
+        )
+        term_ids = {term: i for i, term in enumerate(vocabulary)}
+        df = np.array([doc_frequency[term] for term in vocabulary], dtype=np.float64)
+
+    with span("expansion.cooccurrence", terms=len(vocabulary)):
+        pairs, counts = _cooccurrence_counts(doc_terms, term_ids)
+
+    candidates: list[dict[int, float]] = [{} for _ in vocabulary]
+    with span("expansion.pmi", pairs=len(pairs)):
+        keep = counts >= MIN_COOCCURRENCE
+        pairs, counts = pairs[keep], counts[keep]
+        a, b = pairs // len(vocabulary), pairs % len(vocabulary)
+        p_ab = counts / num_docs
+        p_a_p_b = (df[a] / num_docs) * (df[b] / num_docs)
+        # Normalized PMI lies in [-1, 1], so it blends with cosine similarity.
+        # A pair in every document (p_ab == 1, common in small corpora) makes
+        # the formula 0 / 0; it co-occurs perfectly, so it scores the limit, 1.
+        npmi = np.ones_like(p_ab)
+        partial = p_ab < 1
+        npmi[partial] = np.log(p_ab[partial] / p_a_p_b[partial]) / -np.log(
+            p_ab[partial]
+        )
+        for i, j, score in zip(a.tolist(), b.tolist(), npmi.tolist()):
+            if score > 0:
+                candidates[i][j] = score
+                candidates[j][i] = score
+        for i, row in enumerate(candidates):
+            if len(row) > expansions_per_term:
+                top = sorted(row.items(), key=lambda x: x[1], reverse=True)
+                candidates[i] = dict(top[:expansions_per_term])
+
+    embeddings = None
+    if encode is not None and vocabulary:
+        with span("expansion.embed", terms=len(vocabulary)):
+            embeddings = encode([surface_forms[term] for term in vocabulary])
+            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        with span("expansion.neighbours"):
+            for start in range(0, len(vocabulary), EMBED_BLOCK_SIZE):
+                block = embeddings[start : start + EMBED_BLOCK_SIZE] @ embeddings.T
+                for offset, row in enumerate(block):
+                    i = start + offset
+                    row[i] = -1
+                    top = np.argpartition(row, -expansions_per_term)[
+                        -expansions_per_term:
+                    ]
+                    for j in top.tolist():
+                        candidates[i].setdefault(j, 0.0)
+
+    with span("expansion.score"):
+        table = {}
+        for i, row in enumerate(candidates):
+            scored = []
+            for j, npmi_score in row.items():
+                if embeddings is None:
+                    score = npmi_score
+                else:
+                    cosine = float(embeddings[i] @ embeddings[j])
+                    score = PMI_WEIGHT * npmi_score + (1 - PMI_WEIGHT) * cosine
+                if score >= MIN_EXPANSION_SCORE:
+                    scored.append((vocabulary[j], round(score, 3)))
+            if scored:
+                scored.sort(key=lambda x: x[1], reverse=True)
+                table[vocabulary[i]] = tuple(scored[:expansions_per_term])
+    return ExpansionTable(table, params)
+
+
+def _cooccurrence_counts(
+    doc_terms: list[list[str]], term_ids: dict[str, int]
+) -> tuple[np.ndarray, np.ndarray]:
+    # Document-level co-occurrence of every unordered pair (a < b), encoded
+    # as a * V + b and counted with np.unique in batches to bound memory.
+    vocab_size = len(term_ids)
+    batch_pairs, partial_pairs, partial_counts = [], [], []
+    pending = 0
+    for terms in doc_terms:
+        ids = np.array(sorted(term_ids[t] for t in terms if t in term_ids), np.int64)
+        if len(ids) < 2:
+            continue
+        a, b = np.triu_indices(len(ids), k=1)
+        batch_pairs.append(ids[a] * vocab_size + ids[b])
+        pending += len(a)
+        if pending >= 1 << 22:
+            _flush_pairs(batch_pairs, partial_pairs, partial_counts)
+            pending = 0
+    _flush_pairs(batch_pairs, partial_pairs, partial_counts)
+    if not partial_pairs:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    pairs, inverse = np.unique(np.concatenate(partial_pairs), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate(partial_counts))
+    return pairs, counts.astype(np.int64)
+
+
+def _flush_pairs(batch_pairs, partial_pairs, partial_counts) -> None:
+    if batch_pairs:
+        pairs, counts = np.unique(np.concatenate(batch_pairs), return_counts=True)
+        partial_pairs.append(pairs)
+        partial_counts.append(counts)
+        batch_pairs.clear()
+
+
+def surface_forms_for(
+    word_counts: dict[str, int], tokenize: Callable[[str], list[str]]
+) -> dict[str, str]:
+    """The most frequent corpus word for each index token"""
+    best: dict[str, tuple[int, str]] = {}
+    for word, count in word_counts.items():
+        tokens = tokenize(word)
+        if len(tokens) == 1 and count > best.get(tokens[0], (0, ""))[0]:
+            best[tokens[0]] = (count, word)
+    return {token: word for token, (_, word) in best.items()}
+
+
+def load_or_build_expansions(model_name: str = EMBEDDING_MODEL) -> ExpansionTable:
+    """Load the expansion table, rebuilding it if the keyword index was rebuilt"""
+    from .keyword_search import INDEX_ARTIFACT, InvertedIndex, tokenize_text
+    from .resources import (
+        get_encoder_backend,
+        get_sentence_transformer,
+        get_spell_corrector,
+    )
+
+    manifest = Manifest()
+    params = {
+        "model": model_name,
+        "backend": get_encoder_backend(),
+        "expansions_per_term": EXPANSIONS_PER_TERM,
+        "pmi_weight": PMI_WEIGHT,
+        "index_build": manifest.build_id(INDEX_ARTIFACT),
+    }
+    if manifest.is_fresh(EXPANSIONS_ARTIFACT, params):
+        with span("expansion.load"):
+            return ExpansionTable.load(EXPANSIONS_PATH)
+
+    with span("expansion.build"):
+        idx = InvertedIndex()
+        idx.load()
+        doc_terms = [list(counts) for counts in idx.term_frequencies.values()]
+        surface_forms = surface_forms_for(
+            get_spell_corrector().word_counts, tokenize_text
+        )
+        model = get_sentence_transformer(model_name)
+        table = build_expansion_table(doc_terms, surface_forms, model.encode, params)
+        manifest.forget(EXPANSIONS_ARTIFACT)
+        table.save(EXPANSIONS_PATH)
+        manifest.record(EXPANSIONS_ARTIFACT, [EXPANSIONS_PATH], params)
+    return table
@@ -1,21 +1,27 @@
 import json
-import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Callable, Optional
 
-from dotenv import load_dotenv
-from google import genai
-from sentence_transformers import CrossEncoder
-
-load_dotenv()
-api_key = os.getenv("gemini_api_key")
-client = genai.Client(api_key=api_key)
-model = "gemini-2.0-flash"
+from .resources import get_cross_encoder, get_llm_gateway
+from .search_utils import (
+    CASCADE_LLM_BASE_SECONDS,
+    CASCADE_LLM_SECONDS_PER_CANDIDATE,
+    CASCADE_MAX_LLM_CANDIDATES,
+    DEFAULT_RERANK_BUDGET,
+    RERANK_MAX_CONCURRENCY,
+    RERANK_PARSE_RETRIES,
+    RERANK_WINDOW_SIZE,
+    RERANK_WINDOW_STRIDE,
+)
+from .tracing import propagate, span
 
 
 def rerank_individual(query: str, results: list[dict]) -> list[dict]:
-    for res in results:
-        time.sleep(3)  # To avoid rate limiting
-        prompt = f"""Rate how well this movie matches the search query.
+    prompts = [f"""Rate how well this movie matches the search query.
 
         Query: "{query}"
         Movie: {res.get("title", "")} - {res.get("document", "")}
@@ -28,20 +34,25 @@ def rerank_individual(query: str, results: list[dict]) -> list[dict]:
         Rate 0-10 (10 = perfect match).
         Give me ONLY the number in your response, no other text or explanation.
 
-        Score:"""
-
-        response = client.models.generate_content(model=model, contents=prompt)
+        Score:""" for res in results]
+    # The gateway bounds concurrency and backs off on rate limits, which the
+    # old fixed sleep between calls only approximated.
+    responses = get_llm_gateway().generate_many(prompts, stage="rerank_individual")
+    scored = []
+    for res, response in zip(results, responses):
         score_text = (response.text or "").strip()
         try:
             score = float(score_text)
         except ValueError:
             score = 0.0  # Default to 0 if parsing fails
-        res["individual_score"] = score
-    reranked = sorted(results, key=lambda x: x.get("individual_score", 0), reverse=True)
+        scored.append({**res, "individual_score": score})
+    reranked = sorted(scored, key=lambda x: x.get("individual_score", 0), reverse=True)
     return reranked
 
 
 def rerank_batch(query: str, results: list[dict]) -> list[dict]:
+    # Ranks go on copies, so the caller's results are never modified.
+    results = [dict(res) for res in results]
     doc_map = {res["id"]: res for res in results}
     doc_list_str = "\n\n".join(
         [
@@ -63,47 +74,325 @@ def rerank_batch(query: str, results: list[dict]) -> list[dict]:
     Do not include any text other than the JSON list. Do not include the word "json", or any quotes.
     """
 
-    response = client.models.generate_content(model=model, contents=prompt)
-    ranked_ids_text = (response.text or "").strip()
-    print(f"Rerank response: {ranked_ids_text}")
-    try:
-        ranked_ids = json.loads(ranked_ids_text)
-        # ranked_ids = [str(i) for i in ranked_ids]  # Normalize to strings
-    except (json.JSONDecodeError, ValueError):
-        print("Failed to parse rerank response as JSON.")
-        ranked_ids = []  # Default to empty if parsing fails
-    for rank, doc_id in enumerate(ranked_ids, 1):
-        if doc_id in doc_map:
-            doc_map[doc_id]["batch_rank"] = rank
-            print(f"Doc ID {doc_id} assigned rerank score {rank}")
+    # What the LLM said goes on the span, not stdout, where batch mode
+    # streams its JSONL results.
+    with span("rerank.batch", candidates=len(results)) as s:
+        response = get_llm_gateway().generate(prompt, stage="rerank_batch")
+        ranked_ids_text = (response.text or "").strip()
+        s.set(response=ranked_ids_text)
+        try:
+            ranked_ids = json.loads(ranked_ids_text)
+        except (json.JSONDecodeError, ValueError):
+            s.set(outcome="unparsable response, input order kept")
+            ranked_ids = []  # Default to empty if parsing fails
+        ranked = 0
+        for rank, doc_id in enumerate(ranked_ids, 1):
+            if doc_id in doc_map:
+                doc_map[doc_id]["batch_rank"] = rank
+                ranked += 1
+        s.set(ranked=ranked)
     reranked = sorted(results, key=lambda x: x.get("batch_rank", float("inf")))
     return reranked
 
 
+_JSON_LIST_PATTERN = re.compile(r"\[[^\[\]]*\]")
+
+
+def llm_generate(prompt: str) -> str:
+    return get_llm_gateway().generate(prompt, stage="rerank_listwise").text
+
+
+def _listwise_prompt(query: str, window: list[dict], strict: bool) -> str:
+    doc_list_str = "\n\n".join(
+        f"{res['id']}: {res.get('title', '')} - {res.get('document', '')}"
+        for res in window
+    )
+    reminder = (
+        "\nYour previous answer could not be parsed. Reply with the JSON list "
+        "of IDs only, for example [3, 1, 2].\n"
+        if strict
+        else ""
+    )
+    return f"""Rank these movies by relevance to the search query.
+
+    Query: "{query}"
+
+    Movies:
+    {doc_list_str}
+
+    Return ONLY the IDs in order of relevance (best match first), as a valid JSON list, nothing else.
+    {reminder}"""
+
+
+def parse_ranking(text: str, ids: list) -> Optional[list]:
+    """The window's ids in the order of the LLM's answer, or None if it doesn't parse
+
+    Unknown ids and repeats are dropped and ids the answer left out are kept
+    after the ranked ones, in their original order. An answer naming fewer
+    than half the window counts as a parse failure.
+    """
+    match = _JSON_LIST_PATTERN.search(text)
+    if not match:
+        return None
+    try:
+        ranked = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    by_text = {str(doc_id): doc_id for doc_id in ids}
+    order = []
+    for item in ranked:
+        doc_id = by_text.get(str(item))
+        if doc_id is not None and doc_id not in order:
+            order.append(doc_id)
+    if len(order) * 2 < len(ids):
+        return None
+    return order + [doc_id for doc_id in ids if doc_id not in order]
+
+
+def _window_starts(n: int, size: int, stride: int) -> list[int]:
+    starts = list(range(0, max(n - size, 0) + 1, stride))
+    if starts[-1] + size < n:
+        starts.append(n - size)
+    return starts
+
+
+def rerank_listwise(
+    query: str,
+    results: list[dict],
+    llm: Optional[Callable[[str], str]] = None,
+    window_size: int = RERANK_WINDOW_SIZE,
+    stride: int = RERANK_WINDOW_STRIDE,
+    max_workers: int = RERANK_MAX_CONCURRENCY,
+    retries: int = RERANK_PARSE_RETRIES,
+) -> list[dict]:
+    """Rank overlapping windows of candidates concurrently and merge them
+
+    Each window is ranked by one short LLM call. A candidate's global
+    position is estimated as window start + its rank within the window,
+    averaged over the windows it appears in, so documents in the overlaps tie
+    neighbouring windows together. Windows whose answer never parses keep
+    their input order, as do windows whose LLM call fails every attempt.
+    Sets `batch_rank` unless every window failed.
+
+    Args:
+        llm: Prompt -> response text; the shared LLM gateway by default. Pass a fake to test
+            without the network.
+    """
+    llm = llm or llm_generate
+    if not results:
+        return results
+    starts = _window_starts(len(results), window_size, stride)
+    windows = [results[start : start + window_size] for start in starts]
+
+    def rank_window(window: list[dict]) -> Optional[list]:
+        ids = [res["id"] for res in window]
+        for attempt in range(retries + 1):
+            try:
+                text = llm(_listwise_prompt(query, window, attempt > 0))
+            except Exception:
+                # A call the gateway gave up on counts as an unparsable
+                # answer: retried, then the window keeps its input order.
+                continue
+            order = parse_ranking(text, ids)
+            if order is not None:
+                return order
+        return None
+
+    with span("rerank.listwise", candidates=len(results), windows=len(windows)) as s:
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(windows)))
+        ) as pool:
+            orders = list(pool.map(propagate(rank_window), windows))
+        failed = sum(order is None for order in orders)
+        s.set(failed=failed)
+
+        if failed == len(windows):
+            s.set(outcome="no window ranked, input order kept")
+            return results
+
+    positions: dict = {}
+    for start, window, order in zip(starts, windows, orders):
+        order = order or [res["id"] for res in window]
+        for rank, doc_id in enumerate(order):
+            positions.setdefault(doc_id, []).append(start + rank)
+    input_rank = {res["id"]: i for i, res in enumerate(results)}
+
+    def estimated_position(res: dict) -> tuple[float, int]:
+        estimates = positions[res["id"]]
+        return sum(estimates) / len(estimates), input_rank[res["id"]]
+
+    reranked = sorted(results, key=estimated_position)
+    return [{**res, "batch_rank": rank} for rank, res in enumerate(reranked, 1)]
+
+
+def verify_listwise_command() -> None:
+    """Check rerank_listwise's fallbacks offline, with fake LLMs"""
+    results = [{"id": i, "title": f"Movie {i}", "document": ""} for i in range(12)]
+
+    def reverse(ids: list[int]) -> str:
+        return json.dumps(sorted(ids, reverse=True))
+
+    def window_ids(prompt: str) -> list[int]:
+        return [
+            int(line.split(":")[0]) for line in re.findall(r"^\s*\d+:", prompt, re.M)
+        ]
+
+    def garbled_first_window(prompt: str) -> str:
+        ids = window_ids(prompt)
+        return "no idea" if 0 in ids else reverse(ids)
+
+    def raising_first_window(prompt: str) -> str:
+        ids = window_ids(prompt)
+        if 0 in ids:
+            raise RuntimeError("LLM call failed")
+        return reverse(ids)
+
+    for name, llm in (
+        ("unparsable window", garbled_first_window),
+        ("raising window", raising_first_window),
+    ):
+        reranked = rerank_listwise("query", results, llm=llm, max_workers=1)
+        ranked = [res["id"] for res in reranked]
+        # The failed first window (0..9) keeps its order; the second
+        # (2..11) is reversed, pulling 11 and 10 ahead of 2..9.
+        assert sorted(ranked) == list(range(12)), ranked
+        assert ranked.index(0) < ranked.index(1) < ranked.index(2), ranked
+        assert all("batch_rank" in res for res in reranked), reranked
+        print(f"{name}: ok, order {ranked}")
+
+    def always_raising(prompt: str) -> str:
+        raise RuntimeError("LLM call failed")
+
+    reranked = rerank_listwise("query", results, llm=always_raising)
+    assert reranked == results, reranked
+    print("every window failing: ok, input order kept")
+
+
 def cross_encode(query, results):
     pairs = []
     for doc in results:
         pairs.append([query, f"{doc.get('title', '')} - {doc.get('document', '')}"])
 
-    cross_encoder = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
-    scores = cross_encoder.predict(pairs)
-
-    for doc, score in zip(results, scores):
-        doc["cross_encode_score"] = score
+    cross_encoder = get_cross_encoder()
+    with span("cross_encoder.predict", pairs=len(pairs)):
+        scores = cross_encoder.predict(pairs)
 
+    scored = [
+        {**doc, "cross_encode_score": score} for doc, score in zip(results, scores)
+    ]
     reranked = sorted(
-        results, key=lambda x: x.get("cross_encode_score", 0), reverse=True
+        scored, key=lambda x: x.get("cross_encode_score", 0), reverse=True
     )
     return reranked
 
 
+@dataclass
+class StageReport:
+    stage: str
+    candidates: int
+    seconds: float
+    # "ok", "skipped" (no budget left), "timeout" or "failed"; on anything
+    # but "ok" the previous stage's order is kept.
+    status: str = "ok"
+    moved: int = 0
+    mean_shift: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.stage}: {self.status}, {self.candidates} candidates in "
+            f"{self.seconds * 1000:.0f} ms, {self.moved} moved "
+            f"(mean shift {self.mean_shift:.1f})"
+        )
+
+
+def _rank_changes(before: list[dict], after: list[dict]) -> tuple[int, float]:
+    old_rank = {res["id"]: i for i, res in enumerate(before)}
+    shifts = [abs(old_rank[res["id"]] - i) for i, res in enumerate(after)]
+    moved = sum(1 for shift in shifts if shift)
+    return moved, (sum(shifts) / len(shifts) if shifts else 0.0)
+
+
+def llm_candidates_for(seconds_left: float) -> int:
+    """How many candidates the LLM stage can rank in the time left"""
+    affordable = (
+        seconds_left - CASCADE_LLM_BASE_SECONDS
+    ) / CASCADE_LLM_SECONDS_PER_CANDIDATE
+    return max(0, min(CASCADE_MAX_LLM_CANDIDATES, int(affordable)))
+
+
+def cascade_rerank(
+    query: str,
+    results: list[dict],
+    latency_budget: float = DEFAULT_RERANK_BUDGET,
+    llm_rerank=None,
+) -> tuple[list[dict], list[StageReport]]:
+    """Cross-encode every candidate, then LLM-rerank as many of the top ones as the budget allows
+
+    The LLM stage gets whatever time the cross-encoder left. If it can't
+    finish in that time, or its answer doesn't parse, the cross-encoder order
+    stands. Candidates below the LLM cut keep their cross-encoder order.
+
+    Returns:
+        The reranked results and a report per stage
+    """
+    llm_rerank = llm_rerank or rerank_listwise
+    deadline = time.perf_counter() + latency_budget
+    reports = []
+
+    start = time.perf_counter()
+    with span("rerank.cascade.cross_encoder", candidates=len(results)):
+        ranked = cross_encode(query, results)
+    report = StageReport("cross_encoder", len(results), time.perf_counter() - start)
+    report.moved, report.mean_shift = _rank_changes(results, ranked)
+    reports.append(report)
+
+    seconds_left = deadline - time.perf_counter()
+    top_n = min(len(ranked), llm_candidates_for(seconds_left))
+    if top_n < 2:
+        reports.append(StageReport("llm", 0, 0.0, status="skipped"))
+        return ranked, reports
+
+    # If the LLM stage times out it keeps running in the background; the
+    # rerankers return new result dicts, so it never touches the results
+    # already returned.
+    head = ranked[:top_n]
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=1)
+    with span("rerank.cascade.llm", candidates=top_n) as s:
+        future = executor.submit(propagate(llm_rerank), query, head)
+        try:
+            reranked_head = future.result(timeout=max(0.0, seconds_left))
+            status = (
+                "ok" if any("batch_rank" in res for res in reranked_head) else "failed"
+            )
+        except FutureTimeoutError:
+            status = "timeout"
+        except Exception:
+            status = "failed"
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        s.set(status=status)
+
+    report = StageReport("llm", top_n, time.perf_counter() - start, status=status)
+    if status == "ok":
+        reranked = reranked_head + ranked[top_n:]
+        report.moved, report.mean_shift = _rank_changes(ranked, reranked)
+        ranked = reranked
+    reports.append(report)
+    return ranked, reports
+
+
 def rerank(query, results, rerank_method):
     match rerank_method:
         case "individual":
             return rerank_individual(query, results)
         case "batch":
             return rerank_batch(query, results)
+        case "listwise":
+            return rerank_listwise(query, results)
         case "cross_encoder":
             return cross_encode(query, results)
+        case "cascade":
+            return cascade_rerank(query, results)[0]
         case _:
             return results
@@ -0,0 +1,197 @@
+import functools
+import inspect
+import os
+import threading
+
+from typing import Optional
+
+from .search_utils import (
+    CACHE_DIR,
+    CROSS_ENCODER_MODEL,
+    DEFAULT_ENCODER_BACKEND,
+    EMBEDDING_MODEL,
+    ENCODER_BACKENDS,
+    GEMINI_MODEL,
+    LLM_HEDGE_AFTER,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_TIMEOUT_SECONDS,
+    LLM_URL,
+    ONNX_QUANTIZATION,
+    SPELL_DICTIONARY_PATH,
+)
+from .tracing import span
+
+# Importing sentence_transformers/torch, nltk or google.genai costs seconds,
+# so nothing in lib imports them at module level. The factories below pay
+# for the import and construction on first use and hand out the cached
+# instance afterwards.
+_lock = threading.RLock()
+_encoder_backend = DEFAULT_ENCODER_BACKEND
+
+# File names of the dynamically quantized int8 exports, per CPU target, as
+# written by sentence_transformers' export_dynamic_quantized_onnx_model.
+_QUANTIZED_ONNX_FILES = {
+    "arm64": "onnx/model_qint8_arm64.onnx",
+    "avx2": "onnx/model_quint8_avx2.onnx",
+    "avx512": "onnx/model_qint8_avx512.onnx",
+    "avx512_vnni": "onnx/model_qint8_avx512_vnni.onnx",
+}
+
+
+def _once(func):
+    """Cache a factory so each distinct set of arguments is built only once."""
+    cache = {}
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = tuple(bound.arguments.items())
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        with _lock:
+            if key not in cache:
+                cache[key] = func(*bound.args, **bound.kwargs)
+            return cache[key]
+
+    wrapper.cache_clear = cache.clear
+    wrapper.is_loaded = lambda: bool(cache)
+    return wrapper
+
+
+@_once
+def get_genai_client():
+    from dotenv import load_dotenv
+    from google import genai
+
+    with span("gemini.create_client"):
+        load_dotenv()
+        return genai.Client(api_key=os.getenv("gemini_api_key"))
+
+
+@_once
+def get_llm_gateway():
+    from .llm_gateway import GeminiBackend, HTTPBackend, LLMGateway
+
+    if LLM_URL:
+        backend = HTTPBackend(LLM_URL, GEMINI_MODEL)
+    else:
+        backend = GeminiBackend(get_genai_client(), GEMINI_MODEL)
+    return LLMGateway(
+        backend,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        timeout=LLM_TIMEOUT_SECONDS,
+        retries=LLM_MAX_RETRIES,
+        hedge_after=LLM_HEDGE_AFTER,
+    )
+
+
+def llm_stats_summary() -> Optional[str]:
+    """Usage and latency of the LLM gateway, if anything used it"""
+    if not get_llm_gateway.is_loaded():
+        return None
+    return get_llm_gateway().stats.summary()
+
+
+def set_encoder_backend(backend: str) -> None:
+    """Choose the inference backend used when callers don't pass one."""
+    global _encoder_backend
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(
+            f"Unknown encoder backend '{backend}', expected one of {ENCODER_BACKENDS}"
+        )
+    _encoder_backend = backend
+
+
+def get_encoder_backend() -> str:
+    return _encoder_backend
+
+
+def get_sentence_transformer(
+    model_name: str = EMBEDDING_MODEL, backend: Optional[str] = None
+):
+    backend = backend or _encoder_backend
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(
+            f"Unknown encoder backend '{backend}', expected one of {ENCODER_BACKENDS}"
+        )
+    return _load_sentence_transformer(model_name, backend)
+
+
+@_once
+def _load_sentence_transformer(model_name: str, backend: str):
+    with span("semantic.load_model", model=model_name, backend=backend):
+        from sentence_transformers import SentenceTransformer
+
+        match backend:
+            case "onnx":
+                return SentenceTransformer(model_name, backend="onnx")
+            case "onnx-int8":
+                return _load_quantized_onnx(model_name)
+            case _:
+                return SentenceTransformer(model_name)
+
+
+def _load_quantized_onnx(model_name: str):
+    from sentence_transformers import SentenceTransformer
+
+    file_name = _QUANTIZED_ONNX_FILES[ONNX_QUANTIZATION]
+    try:
+        # Many hub models, all-MiniLM-L6-v2 included, ship int8 exports.
+        return SentenceTransformer(
+            model_name, backend="onnx", model_kwargs={"file_name": file_name}
+        )
+    except (OSError, ValueError):
+        pass
+
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    local_dir = os.path.join(CACHE_DIR, "models", model_name.replace("/", "__"))
+    if not os.path.exists(os.path.join(local_dir, file_name)):
+        with span("semantic.quantize_model", config=ONNX_QUANTIZATION):
+            onnx_model = SentenceTransformer(model_name, backend="onnx")
+            onnx_model.save(local_dir)
+            export_dynamic_quantized_onnx_model(
+                onnx_model, ONNX_QUANTIZATION, local_dir
+            )
+    return SentenceTransformer(
+        local_dir, backend="onnx", model_kwargs={"file_name": file_name}
+    )
+
+
+@_once
+def get_cross_encoder(model_name: str = CROSS_ENCODER_MODEL):
+    with span("cross_encoder.load_model", model=model_name):
+        from sentence_transformers import CrossEncoder
+
+        return CrossEncoder(model_name)
+
+
+@_once
+def get_stemmer():
+    from nltk.stem import PorterStemmer
+
+    return PorterStemmer()
+
+
+@_once
+def get_spell_corrector():
+    from .spell import SpellCorrector
+
+    if not os.path.exists(SPELL_DICTIONARY_PATH):
+        raise ValueError(
+            "No spelling dictionary found. Rebuild the keyword index to create it."
+        )
+    with span("spell.load_dictionary"):
+        return SpellCorrector.load(SPELL_DICTIONARY_PATH)
+
+
+@_once
+def get_expansion_table():
+    from .query_expansion import load_or_build_expansions
+
+    return load_or_build_expansions()
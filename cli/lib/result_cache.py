@@ -0,0 +1,221 @@
+import copy
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional
+
+from .artifacts import atomic_write
+from .search_utils import RESULT_CACHE_SIZE, RESULT_CACHE_TTL
+from .tracing import span
+
+# Search results keyed on the normalized request, each stored with the
+# snapshot version (index and embedding build ids) it was computed from.
+# An entry whose version no longer matches is dropped on lookup, so a
+# rebuild or reload invalidates the cache without anyone clearing it.
+# Least recently used entries are evicted past `max_entries`, and any
+# entry older than `ttl` seconds counts as a miss.
+RESULT_CACHE_FORMAT_VERSION = 1
+
+
+def normalize_query(query: str) -> str:
+    """Case and whitespace don't change what BM25 or the (uncased) encoder see"""
+    return " ".join(query.lower().split())
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    hit_seconds: float = 0.0
+    miss_seconds: float = 0.0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hit_ratio, 3),
+            "cached_mean_ms": (
+                round(self.hit_seconds / self.hits * 1000, 3) if self.hits else None
+            ),
+            "uncached_mean_ms": (
+                round(self.miss_seconds / self.misses * 1000, 3)
+                if self.misses
+                else None
+            ),
+        }
+
+    def summary(self) -> str:
+        stats = self.as_dict()
+        latencies = ", ".join(
+            f"{label} {stats[f'{label}_mean_ms']:.1f} ms"
+            for label in ("cached", "uncached")
+            if stats[f"{label}_mean_ms"] is not None
+        )
+        return (
+            f"{self.hits}/{self.hits + self.misses} hits "
+            f"({self.hit_ratio:.0%})" + (f", mean {latencies}" if latencies else "")
+        )
+
+
+@dataclass
+class _Entry:
+    version: str
+    stored_at: float
+    value: Any
+
+
+class ResultCache:
+    """Thread-safe LRU + TTL cache of search results, optionally saved to `path`
+
+    Keys are tuples whose first element names the kind of search; hits,
+    misses and their latencies are counted per kind. Values are deep-copied
+    in and out, so callers may mutate what they get back.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_SIZE,
+        ttl: float = RESULT_CACHE_TTL,
+        path: Optional[str] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._stats: dict[str, CacheStats] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple, version: str) -> Optional[Any]:
+        """The cached value for `key` at `version`, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.version != version or time.time() - entry.stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            value = entry.value
+        return copy.deepcopy(value)
+
+    def put(self, key: tuple, version: str, value: Any) -> None:
+        entry = _Entry(version, time.time(), copy.deepcopy(value))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(
+        self,
+        key: tuple,
+        version: Optional[str],
+        compute: Callable[[], Any],
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Cached value for `key`, or `compute()`'s, stored for next time
+
+        A None `version` means the index is about to be rebuilt: nothing
+        cached can be current, and nothing computed is stored. Neither is a
+        computed value `cacheable` rejects.
+        """
+        start = time.perf_counter()
+        with span("result_cache.lookup", kind=key[0]) as s:
+            value = self.get(key, version) if version is not None else None
+            s.set(hit=value is not None)
+        if value is not None:
+            self._record(key[0], True, time.perf_counter() - start)
+            return value
+        value = compute()
+        if version is not None and (cacheable is None or cacheable(value)):
+            self.put(key, version, value)
+        self._record(key[0], False, time.perf_counter() - start)
+        return value
+
+    def _record(self, kind: str, hit: bool, seconds: float) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(kind, CacheStats())
+            if hit:
+                stats.hits += 1
+                stats.hit_seconds += seconds
+            else:
+                stats.misses += 1
+                stats.miss_seconds += seconds
+
+    def stats(self) -> dict[str, CacheStats]:
+        """Per-kind counters, plus their sum under "total" """
+        with self._lock:
+            stats = {kind: copy.copy(s) for kind, s in self._stats.items()}
+        total = CacheStats()
+        for s in stats.values():
+            total.hits += s.hits
+            total.misses += s.misses
+            total.hit_seconds += s.hit_seconds
+            total.miss_seconds += s.miss_seconds
+        stats["total"] = total
+        return stats
+
+    def stats_dict(self) -> dict:
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            **{kind: s.as_dict() for kind, s in self.stats().items()},
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+
+    def save(self) -> None:
+        """Write unexpired entries and the counters to `path`"""
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            entries = [
+                (key, entry)
+                for key, entry in self._entries.items()
+                if now - entry.stored_at <= self.ttl
+            ]
+            stats = dict(self._stats)
+        with span("result_cache.save", entries=len(entries)):
+            with atomic_write(self.path) as f:
+                pickle.dump(
+                    {
+                        "format_version": RESULT_CACHE_FORMAT_VERSION,
+                        "entries": entries,
+                        "stats": stats,
+                    },
+                    f,
+                )
+
+    def _load(self, path: str) -> None:
+        with span("result_cache.load"):
+            try:
+                with open(path, "rb") as f:
+                    data = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+                # A cache is never worth failing a search over.
+                return
+        if data.get("format_version") != RESULT_CACHE_FORMAT_VERSION:
+            return
+        now = time.time()
+        for key, entry in data["entries"][-self.max_entries :]:
+            if now - entry.stored_at <= self.ttl:
+                self._entries[key] = entry
+        self._stats = data["stats"]
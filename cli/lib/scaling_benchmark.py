@@ -0,0 +1,284 @@
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from .search_utils import PROJECT_ROOT, RRF_K, STOPWORDS_PATH, load_stopwords
+
+# Each corpus size runs in its own interpreter, with RAG_DATA_DIR and
+# RAG_CACHE_DIR pointing at a synthetic corpus and an empty cache, so every
+# engine builds from scratch and peak memory is not inherited from a
+# previous size. The child prints one JSON report as its last line.
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+DEFAULT_QUERIES = 20
+DEFAULT_DIM = 384
+TOKENIZE_SAMPLE = 1000
+QUERY_LIMIT = 10
+
+_CHILD = """
+import json, sys
+from lib.scaling_benchmark import run_size
+report = run_size({num_docs!r}, {num_queries!r}, {dim!r}, {seed!r})
+sys.stdout.write("\\n" + json.dumps(report) + "\\n")
+"""
+
+
+def _reset_peak_rss() -> bool:
+    # Linux lets a process reset its own high-water mark (VmHWM).
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _rss_mb(field: str) -> Optional[float]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class Recorder:
+    """Wall time and peak RSS of each benchmark phase"""
+
+    def __init__(self) -> None:
+        self.results: dict[str, dict] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        resettable = _reset_peak_rss()
+        before = _rss_mb("VmRSS")
+        extra: dict = {}
+        start = time.perf_counter()
+        yield extra
+        seconds = time.perf_counter() - start
+        peak = _rss_mb("VmHWM")
+        if peak is None or not resettable:
+            # Process-lifetime high-water mark: an upper bound for this phase.
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        result = {"seconds": round(seconds, 6), "peak_rss_mb": round(peak, 1)}
+        if before is not None:
+            result["rss_growth_mb"] = round(_rss_mb("VmRSS") - before, 1)
+        result.update(extra)
+        self.results[name] = result
+
+    def per_call(self, name: str, func: Callable, inputs: list) -> list:
+        """Time `func` on every input; records per-call p50/p95 in ms"""
+        func(inputs[0])
+        outputs, times = [], []
+        with self.phase(name) as extra:
+            for item in inputs:
+                start = time.perf_counter()
+                outputs.append(func(item))
+                times.append(time.perf_counter() - start)
+            times.sort()
+            extra["calls"] = len(times)
+            extra["p50_ms"] = round(statistics.median(times) * 1000, 3)
+            extra["p95_ms"] = round(times[int(0.95 * (len(times) - 1))] * 1000, 3)
+        return outputs
+
+
+def make_queries(documents, num_queries: int, seed: int) -> list[str]:
+    """Two or three words from the descriptions of random documents"""
+    rng = random.Random(seed)
+    stopwords = load_stopwords()
+    queries = []
+    while len(queries) < num_queries:
+        doc = documents[rng.randrange(len(documents))]
+        words = [
+            word.strip(".").lower()
+            for word in doc["description"].split()
+            if word.strip(".").lower() not in stopwords
+        ]
+        if len(words) >= 3:
+            queries.append(" ".join(rng.sample(words, rng.randint(2, 3))))
+    return queries
+
+
+def run_size(num_docs: int, num_queries: int, dim: int, seed: int) -> dict:
+    """Benchmark every stage against the corpus in RAG_DATA_DIR (child process)"""
+    from .hybrid_search import HybridSearch, reciprocal_rank_fusion
+    from .keyword_search import InvertedIndex, tokenize_text
+    from .search_utils import load_movies
+    from .semantic_search import ChunkedSemanticSearch
+    from .synthetic_corpus import HashingEncoder
+
+    recorder = Recorder()
+    with recorder.phase("corpus.compile"):
+        documents = load_movies()
+    queries = make_queries(documents, num_queries, seed)
+
+    sample = [
+        documents[i]["description"] for i in range(min(TOKENIZE_SAMPLE, num_docs))
+    ]
+    with recorder.phase("tokenize") as extra:
+        tokens = sum(len(tokenize_text(text)) for text in sample)
+        extra["tokens"] = tokens
+
+    idx = InvertedIndex()
+    with recorder.phase("index.build") as extra:
+        idx.build()
+        extra["terms"] = len(idx.index)
+    with recorder.phase("index.save"):
+        idx.save()
+    del idx
+    idx = InvertedIndex()
+    with recorder.phase("index.load"):
+        idx.load()
+
+    recorder.per_call("bm25.search", lambda q: idx.bm25_search(q, QUERY_LIMIT), queries)
+
+    encoder = HashingEncoder(dim, seed)
+    semantic = ChunkedSemanticSearch(model_name=encoder.name, model=encoder)
+    with recorder.phase("chunks.build") as extra:
+        semantic.build_chunk_embeddings(documents)
+        extra["chunks"] = len(semantic.chunk_metadata)
+    with recorder.phase("chunks.load"):
+        semantic.load_or_create_chunk_embeddings(documents)
+    recorder.per_call(
+        "chunks.search", lambda q: semantic.search_chunks(q, QUERY_LIMIT), queries
+    )
+
+    # Fusion sees the same candidate depth rrf_search asks each engine for.
+    depth = QUERY_LIMIT * 500
+    candidates = [
+        (idx.bm25_search(q, depth), semantic.search_chunks(q, depth)) for q in queries
+    ]
+    recorder.per_call(
+        "fusion.rrf", lambda pair: reciprocal_rank_fusion(*pair, RRF_K), candidates
+    )
+
+    with recorder.phase("hybrid.setup"):
+        searcher = HybridSearch(documents, semantic_search=semantic)
+    recorder.per_call(
+        "e2e.rrf_search",
+        lambda q: searcher.rrf_search(q, RRF_K, QUERY_LIMIT),
+        queries,
+    )
+
+    return {
+        "docs": num_docs,
+        "chunks": len(semantic.chunk_metadata),
+        "queries": len(queries),
+        "benchmarks": recorder.results,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def prepare_corpus(workdir: str, num_docs: int, seed: int) -> tuple[str, str]:
+    """Data and (emptied) cache directories for one size, generating if needed"""
+    from .synthetic_corpus import write_corpus
+
+    root = os.path.join(workdir, f"docs-{num_docs}-seed-{seed}")
+    data_dir = os.path.join(root, "data")
+    cache_dir = os.path.join(root, "cache")
+    movies_path = os.path.join(data_dir, "movies.json")
+    if not os.path.exists(movies_path):
+        os.makedirs(data_dir, exist_ok=True)
+        shutil.copy(STOPWORDS_PATH, os.path.join(data_dir, "stopwords.txt"))
+        with open(STOPWORDS_PATH) as f:
+            stopwords = f.read().split()
+        print(f"Generating {num_docs} synthetic movies...", file=sys.stderr)
+        write_corpus(movies_path, num_docs, stopwords, seed)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return data_dir, cache_dir
+
+
+def scaling_exponents(sizes: list[dict]) -> dict[str, list[Optional[float]]]:
+    """Slope of log(time) against log(docs) between consecutive sizes
+
+    1.0 is linear scaling; a query stage well above 0 means it touches
+    every document.
+    """
+    exponents: dict[str, list[Optional[float]]] = {}
+    for smaller, larger in zip(sizes, sizes[1:]):
+        ratio = math.log(larger["docs"] / smaller["docs"])
+        for name, result in larger["benchmarks"].items():
+            before = smaller["benchmarks"].get(name)
+            key = "p50_ms" if "p50_ms" in result else "seconds"
+            slope = None
+            if before and before[key] > 0 and result[key] > 0:
+                slope = round(math.log(result[key] / before[key]) / ratio, 2)
+            exponents.setdefault(name, []).append(slope)
+    return exponents
+
+
+def scaling_benchmark_command(
+    sizes: tuple[int, ...] = DEFAULT_SIZES,
+    num_queries: int = DEFAULT_QUERIES,
+    dim: int = DEFAULT_DIM,
+    seed: int = 0,
+    workdir: Optional[str] = None,
+    output: Optional[str] = None,
+) -> dict:
+    commit = _git_commit()
+    workdir = workdir or os.path.join(PROJECT_ROOT, "cache", "benchmarks")
+    output = output or os.path.join(
+        PROJECT_ROOT, "benchmarks", f"scaling-{commit}.json"
+    )
+    cli_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    reports = []
+    for num_docs in sorted(sizes):
+        data_dir, cache_dir = prepare_corpus(workdir, num_docs, seed)
+        env = dict(os.environ, RAG_DATA_DIR=data_dir, RAG_CACHE_DIR=cache_dir)
+        code = _CHILD.format(
+            num_docs=num_docs, num_queries=num_queries, dim=dim, seed=seed
+        )
+        print(f"Benchmarking {num_docs} docs...", file=sys.stderr)
+        proc = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=cli_dir,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(
+                f"Benchmark at {num_docs} docs failed:\n{proc.stderr.strip()}"
+            )
+        reports.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "commit": commit,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "encoder": f"hashing-{dim}",
+        "seed": seed,
+        "sizes": reports,
+        "exponents": scaling_exponents(reports),
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    report["output"] = output
+    return report
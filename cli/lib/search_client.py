@@ -0,0 +1,144 @@
+import http.client
+import json
+import socket
+from typing import Optional
+from urllib.parse import urlsplit
+
+from .search_utils import SEARCH_SERVER_TIMEOUT
+
+# Thin client for search_server.py. Server URLs are http://host:port or
+# unix:/path/to.sock. Responses come back as the same dicts the local
+# *_command functions return, so the CLIs print them unchanged.
+
+
+class SearchServerError(RuntimeError):
+    def __init__(self, message: str, status: int = 0, error_type: str = "") -> None:
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class SearchClient:
+    def __init__(self, url: str, timeout: float = SEARCH_SERVER_TIMEOUT) -> None:
+        self.url = url
+        self.timeout = timeout
+        self._connection: Optional[http.client.HTTPConnection] = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.url.startswith("unix:"):
+            path = self.url[len("unix:") :]
+            if path.startswith("//"):
+                path = path[2:]
+            return _UnixHTTPConnection(path, self.timeout)
+        parts = urlsplit(self.url)
+        if parts.scheme != "http":
+            raise ValueError(
+                f"Unsupported search server URL '{self.url}', expected http://host:port or unix:/path"
+            )
+        connection = http.client.HTTPConnection(parts.netloc, timeout=self.timeout)
+        connection.connect()
+        # http.client writes headers and body separately.
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def call(self, endpoint: str, payload: Optional[dict] = None) -> dict:
+        """POST `payload` (or GET, if None) to /<endpoint> and return the JSON reply"""
+        method, body = (
+            ("GET", None) if payload is None else ("POST", json.dumps(payload))
+        )
+        # A kept-alive connection the server has since closed gets one retry.
+        for attempt in range(2):
+            reused = self._connection is not None
+            try:
+                if self._connection is None:
+                    self._connection = self._connect()
+                self._connection.request(
+                    method, f"/{endpoint}", body, {"Content-Type": "application/json"}
+                )
+                response = self._connection.getresponse()
+                data = json.loads(response.read() or b"{}")
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                if reused and attempt == 0:
+                    continue
+                raise SearchServerError(
+                    f"Search server at {self.url} is unreachable: {type(e).__name__}: {e}"
+                ) from e
+        if response.status != 200:
+            raise SearchServerError(
+                data.get("error", f"HTTP {response.status}"),
+                response.status,
+                data.get("type", ""),
+            )
+        return data
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def keyword(self, query: str, mode: str = "bm25", limit: int = 5, slop: int = 0):
+        from .boolean_query import BooleanQueryError
+
+        payload = {"query": query, "mode": mode, "limit": limit, "slop": slop}
+        try:
+            return self.call("keyword", payload)["results"]
+        except SearchServerError as e:
+            if e.error_type == "BooleanQueryError":
+                raise BooleanQueryError(str(e)) from e
+            raise
+
+    def semantic(self, query: str, limit: int = 5) -> list[dict]:
+        return self.call("semantic", {"query": query, "limit": limit})["results"]
+
+    def hybrid(self, query: str, mode: str = "rrf", **options) -> dict:
+        from .rerank import StageReport
+
+        result = self.call("hybrid", {"query": query, "mode": mode, **options})
+        if result.get("rerank_stages"):
+            result["rerank_stages"] = [
+                StageReport(**stage) for stage in result["rerank_stages"]
+            ]
+        if result.get("variants"):
+            result["variants"] = [tuple(variant) for variant in result["variants"]]
+        return result
+
+    def rerank(
+        self, query: str, results: list[dict], method: str, **options
+    ) -> list[dict]:
+        payload = {"query": query, "results": results, "method": method, **options}
+        return self.call("rerank", payload)["results"]
+
+    def rag(
+        self,
+        query: str,
+        command: str = "rag",
+        limit: int = 5,
+        deadline: Optional[float] = None,
+    ) -> dict:
+        from .llm_gateway import LLMResponse
+
+        payload = {"query": query, "command": command, "limit": limit}
+        if deadline is not None:
+            payload["deadline"] = deadline
+        result = self.call("rag", payload)
+        result["response"] = LLMResponse(**result["response"])
+        return result
+
+    def reload(self, wait: bool = True) -> dict:
+        return self.call("reload", {"wait": wait})
+
+    def health(self) -> dict:
+        return self.call("health")
@@ -0,0 +1,402 @@
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import wait
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+from .augmented_generation import rag
+from .batch import to_json
+from .deadline import Deadline
+from .hybrid_search import (
+    HybridSearch,
+    SnapshotError,
+    run_rrf_search,
+    run_weighted_search,
+)
+from .keyword_search import BATCH_MODES, _keyword_search, _phrase_search
+from .rerank import cascade_rerank, rerank
+from .result_cache import ResultCache
+from .search_utils import (
+    DEFAULT_ALPHA,
+    DEFAULT_RERANK_BUDGET,
+    DEFAULT_SEARCH_LIMIT,
+    RRF_K,
+    SPECULATIVE_ENHANCE_TIMEOUT,
+    load_movies,
+)
+from .tracing import is_enabled, report, span
+
+# A resident search process. The corpus, keyword index, chunk embeddings and
+# embedding model are loaded once at startup, so a request only pays for
+# its own query. JSON over HTTP/1.1 (keep-alive), on TCP or a Unix socket;
+# every connection gets its own thread.
+#
+#   POST /keyword   {"query", "mode": bm25|search|boolean|phrase, "limit", "slop"}
+#   POST /semantic  {"query", "limit"}
+#   POST /hybrid    {"query", "mode": rrf|weighted, "limit", "k", "alpha",
+#                    "enhance", "rerank_method", "latency_budget",
+#                    "speculative", "enhance_timeout", "multi_query", "deadline"}
+#   POST /rerank    {"query", "results", "method", "latency_budget"}
+#   POST /rag       {"query", "command": rag|summarize|citations|question, "limit",
+#                    "deadline"}
+#   POST /reload    {"wait": true}  swap in the index and embeddings now on disk
+#   GET  /health
+#
+# Every request is answered from the snapshot that was current when it
+# arrived; a reload (also on SIGHUP) never interrupts one.
+RAG_COMMANDS = ("rag", "summarize", "citations", "question")
+RERANK_METHODS = ("individual", "batch", "listwise", "cross_encoder", "cascade")
+
+
+class RequestError(ValueError):
+    """A malformed request, answered with HTTP 400"""
+
+
+@dataclass
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        mean = self.seconds / self.requests if self.requests else 0.0
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "mean_ms": round(mean * 1000, 3),
+        }
+
+
+def _deadline(request: dict) -> Optional[Deadline]:
+    seconds = request.get("deadline")
+    if seconds is None:
+        return None
+    if isinstance(seconds, bool) or not isinstance(seconds, (int, float)):
+        raise RequestError("deadline must be a number of seconds")
+    return Deadline(seconds)
+
+
+def _query(request: dict) -> str:
+    query = request.get("query")
+    if not isinstance(query, str) or not query.strip():
+        raise RequestError("missing or empty query")
+    return query
+
+
+class SearchService:
+    """The endpoints, answered from one loaded HybridSearch"""
+
+    def __init__(self, searcher: HybridSearch) -> None:
+        self.searcher = searcher
+        self.started = time.time()
+        self.endpoints: dict[str, Callable[[dict, HybridSearch], dict]] = {
+            "keyword": self.keyword,
+            "semantic": self.semantic,
+            "hybrid": self.hybrid,
+            "rerank": self.rerank,
+            "rag": self.rag,
+            "reload": lambda request, _searcher: self.reload(request),
+            "health": lambda _request, _searcher: self.health(),
+        }
+        self.stats = {name: EndpointStats() for name in self.endpoints}
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, result_cache: bool = True) -> "SearchService":
+        with span("server.load"):
+            cache = ResultCache() if result_cache else None
+            service = cls(HybridSearch(load_movies(), result_cache=cache))
+            service.warm_up()
+        return service
+
+    def warm_up(self) -> None:
+        """Run one query through each engine so lazy setup happens before serving"""
+        with span("server.warm_up"):
+            self.searcher.rrf_search("warm up", RRF_K, 1)
+
+    def handle(self, endpoint: str, request: dict) -> dict:
+        handler = self.endpoints.get(endpoint)
+        if handler is None:
+            raise KeyError(endpoint)
+        start = time.perf_counter()
+        failed = True
+        try:
+            with span(f"server.{endpoint}"):
+                result = handler(request, self.searcher.pinned())
+            failed = False
+            return result
+        finally:
+            with self._stats_lock:
+                stats = self.stats[endpoint]
+                stats.requests += 1
+                stats.errors += failed
+                stats.seconds += time.perf_counter() - start
+
+    def keyword(self, request: dict, searcher: HybridSearch) -> dict:
+        query = _query(request)
+        limit = request.get("limit", DEFAULT_SEARCH_LIMIT)
+        idx = searcher.idx
+        match request.get("mode", "bm25"):
+            case "bm25":
+                results = idx.bm25_search(query, limit)
+            case "search":
+                results = _keyword_search(idx, query, limit)
+            case "boolean":
+                results = _keyword_search(idx, query, limit, boolean=True)
+            case "phrase":
+                results = _phrase_search(idx, query, request.get("slop", 0), limit)
+            case other:
+                raise RequestError(
+                    f"unknown mode {other!r}, expected one of {BATCH_MODES}"
+                )
+        return {"results": results}
+
+    def semantic(self, request: dict, searcher: HybridSearch) -> dict:
+        query = _query(request)
+        limit = request.get("limit", DEFAULT_SEARCH_LIMIT)
+        return {"results": searcher.semantic_search.search_chunks(query, limit)}
+
+    def hybrid(self, request: dict, searcher: HybridSearch) -> dict:
+        query = _query(request)
+        limit = request.get("limit", DEFAULT_SEARCH_LIMIT)
+        match request.get("mode", "rrf"):
+            case "rrf":
+                multi_query = request.get("multi_query")
+                return run_rrf_search(
+                    searcher,
+                    query,
+                    request.get("k", RRF_K),
+                    request.get("enhance"),
+                    limit,
+                    request.get("rerank_method"),
+                    request.get("latency_budget", DEFAULT_RERANK_BUDGET),
+                    request.get("speculative", False),
+                    request.get("enhance_timeout", SPECULATIVE_ENHANCE_TIMEOUT),
+                    tuple(multi_query) if multi_query else None,
+                    deadline=_deadline(request),
+                )
+            case "weighted":
+                return run_weighted_search(
+                    searcher, query, request.get("alpha", DEFAULT_ALPHA), limit
+                )
+            case other:
+                raise RequestError(f"unknown mode {other!r}, expected rrf or weighted")
+
+    def rerank(self, request: dict, searcher: HybridSearch) -> dict:
+        query = _query(request)
+        results = request.get("results")
+        if not isinstance(results, list):
+            raise RequestError("results must be a list of search results")
+        method = request.get("method", "cross_encoder")
+        if method not in RERANK_METHODS:
+            raise RequestError(
+                f"unknown method {method!r}, expected one of {RERANK_METHODS}"
+            )
+        if method == "cascade":
+            budget = request.get("latency_budget", DEFAULT_RERANK_BUDGET)
+            results, stages = cascade_rerank(query, results, budget)
+            return {"results": results, "rerank_stages": stages}
+        return {"results": rerank(query, results, method), "rerank_stages": []}
+
+    def rag(self, request: dict, searcher: HybridSearch) -> dict:
+        query = _query(request)
+        command = request.get("command", "rag")
+        if command not in RAG_COMMANDS:
+            raise RequestError(
+                f"unknown command {command!r}, expected one of {RAG_COMMANDS}"
+            )
+        limit = request.get("limit", DEFAULT_SEARCH_LIMIT)
+        deadline = _deadline(request)
+        return rag(
+            query,
+            command,
+            limit,
+            searcher,
+            deadline=deadline.seconds if deadline else None,
+        )
+
+    def reload(self, request: dict) -> dict:
+        """Swap in a new snapshot; without "wait", reply before it is loaded"""
+        if not request.get("wait", True):
+            self.searcher.reload_in_background().add_done_callback(_log_reload)
+            return {"status": "reloading"}
+        try:
+            snapshot = self.searcher.reload()
+        except SnapshotError as e:
+            # The old snapshot is still serving; nothing for the caller to fix.
+            raise RuntimeError(f"reload failed: {e}") from e
+        return {"status": "reloaded", "version": snapshot.version}
+
+    def health(self) -> dict:
+        with self._stats_lock:
+            endpoints = {name: s.as_dict() for name, s in self.stats.items()}
+        snapshot = self.searcher.snapshot
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "documents": len(snapshot.documents),
+            "chunks": len(snapshot.semantic_search.chunk_metadata),
+            "snapshot": {
+                "version": snapshot.version,
+                "age_seconds": round(time.time() - snapshot.loaded_at, 1),
+                "retired": self.searcher.retired_snapshots(),
+            },
+            "result_cache": (
+                self.searcher.result_cache.stats_dict()
+                if self.searcher.result_cache
+                else None
+            ),
+            "endpoints": endpoints,
+        }
+
+
+def _log_reload(future) -> None:
+    try:
+        snapshot = future.result()
+    except Exception as e:
+        print(f"Reload failed, still serving the old snapshot: {e}", file=sys.stderr)
+    else:
+        print(f"Reloaded snapshot {snapshot.version}", file=sys.stderr)
+
+
+def make_handler(service: SearchService, tcp: bool = True):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this, Nagle
+        # plus delayed ACKs add ~40 ms to every keep-alive response.
+        disable_nagle_algorithm = tcp
+
+        def do_GET(self) -> None:
+            self._dispatch({})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError as e:
+                self._reply(
+                    400, {"error": f"invalid JSON: {e}", "type": "RequestError"}
+                )
+                return
+            if not isinstance(request, dict):
+                self._reply(
+                    400, {"error": "expected a JSON object", "type": "RequestError"}
+                )
+                return
+            self._dispatch(request)
+
+        def _dispatch(self, request: dict) -> None:
+            endpoint = self.path.strip("/").split("?")[0]
+            if endpoint not in service.endpoints:
+                self._reply(
+                    404, {"error": f"no endpoint /{endpoint}", "type": "NotFound"}
+                )
+                return
+            # The request's own root, reported alone: other requests may be
+            # in flight on other threads.
+            with span("server.request", endpoint=endpoint) as root:
+                try:
+                    result = service.handle(endpoint, request)
+                    status = 200
+                except ValueError as e:
+                    # RequestError, BooleanQueryError and the engines' own
+                    # argument checks are all the caller's to fix.
+                    status, result = 400, {
+                        "error": str(e),
+                        "type": type(e).__name__,
+                    }
+                except Exception as e:
+                    status, result = 500, {
+                        "error": f"{type(e).__name__}: {e}",
+                        "type": type(e).__name__,
+                    }
+                root.set(status=status)
+                self._reply(status, result)
+            if is_enabled():
+                report(root=root)
+
+        def _reply(self, status: int, body: dict) -> None:
+            payload = to_json(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+def make_server(
+    service: SearchService,
+    host: str,
+    port: int,
+    socket_path: Optional[str] = None,
+) -> socketserver.BaseServer:
+    """An HTTP server for `service` on host:port, or on a Unix socket if given"""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, make_handler(service, tcp=False))
+    return ThreadingHTTPServer((host, port), make_handler(service))
+
+
+def serve_command(
+    host: str,
+    port: int,
+    socket_path: Optional[str] = None,
+    result_cache: bool = True,
+) -> None:
+    start = time.perf_counter()
+    service = SearchService.load(result_cache)
+    server = make_server(service, host, port, socket_path)
+    address = (
+        f"unix:{socket_path}"
+        if socket_path
+        else f"http://{host}:{server.server_address[1]}"
+    )
+    print(
+        f"Search server ready in {time.perf_counter() - start:.1f} s, "
+        f"{len(service.searcher.documents)} documents, listening on {address}",
+        file=sys.stderr,
+    )
+
+    def reload_traced() -> None:
+        # Traced like a request: the reload's spans nest under this one.
+        with span("server.hangup") as root:
+            future = service.searcher.reload_in_background()
+            wait([future])
+        _log_reload(future)
+        if is_enabled():
+            report(root=root)
+
+    def reload_on_hangup(_signum, _frame) -> None:
+        threading.Thread(
+            target=reload_traced, name="server-hangup", daemon=True
+        ).start()
+
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, reload_on_hangup)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
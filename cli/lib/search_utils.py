@@ -1,43 +1,131 @@
-import json
+import functools
 import os
 from typing import Any
 
+import numpy as np
+
+from .corpus_store import CorpusStore, open_corpus_store
+from .tracing import span
+
 DEFAULT_ALPHA = 0.5
 RRF_K = 60
 
 DEFAULT_SEARCH_LIMIT = 5
+# Batch mode: worker threads, and queries embedded per encoder call.
+DEFAULT_BATCH_WORKERS = 4
+DEFAULT_BATCH_SIZE = 32
 DOCUMENT_PREVIEW_LENGTH = 100
 SCORE_PRECISION = 3
 SEARCH_MULTIPLIER = 5
+# Seconds a speculative search waits for the enhanced query before settling
+# for the original query's results.
+SPECULATIVE_ENHANCE_TIMEOUT = 2.0
+# Multi-query search: enhancement methods that produce the extra variants,
+# and each variant's weight in the fusion (the original query counts fully).
+MULTI_QUERY_METHODS = ("spell", "rewrite", "expand")
+MULTI_QUERY_WEIGHTS = {
+    "original": 1.0,
+    "spell": 1.0,
+    "local_spell": 1.0,
+    "rewrite": 0.8,
+    "expand": 0.6,
+}
 
 BM25_K1 = 1.5
 BM25_B = 0.75
+# Added to a document's BM25 score per matched phrase, times the summed IDF of
+# the phrase's terms.
+PHRASE_BOOST = 1.0
+# BM25 weight of a local expansion term, times its relatedness score (<= 1).
+EXPANSION_WEIGHT = 0.5
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_ENCODER_BACKEND = os.getenv("RAG_ENCODER_BACKEND", "torch")
+ONNX_QUANTIZATION = os.getenv("RAG_ONNX_QUANTIZATION", "avx2")
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-TinyBERT-L2-v2"
+GEMINI_MODEL = "gemini-2.0-flash"
+# Point LLM calls at an HTTP stand-in (see llm_stub_server.py) instead of Gemini.
+LLM_URL = os.getenv("RAG_LLM_URL")
+LLM_TIMEOUT_SECONDS = float(os.getenv("RAG_LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = 3
+LLM_MAX_CONCURRENCY = 8
+# Seconds before a slow call is raced against a duplicate; unset disables.
+LLM_HEDGE_AFTER = (
+    float(os.environ["RAG_LLM_HEDGE_AFTER"])
+    if os.getenv("RAG_LLM_HEDGE_AFTER")
+    else None
+)
+
+# Cascade reranking: seconds allowed per request, and the cost model used to
+# decide how many cross-encoder survivors the LLM stage can afford.
+DEFAULT_RERANK_BUDGET = 3.0
+CASCADE_LLM_BASE_SECONDS = 1.0
+CASCADE_LLM_SECONDS_PER_CANDIDATE = 0.05
+CASCADE_MAX_LLM_CANDIDATES = 20
+
+# Deadline-aware requests: the time each stage is assumed to need when
+# deciding what the rest of a request's budget can afford. Retrieval always
+# runs, so its time is kept back from the stages before it.
+DEADLINE_RETRIEVAL_SECONDS = 0.5
+DEADLINE_LOCAL_ENHANCE_SECONDS = 0.1
+# One LLM call: an enhancement, or generation with a single document.
+DEADLINE_LLM_SECONDS = 2.0
+DEADLINE_SECONDS_PER_CONTEXT_DOC = 0.2
+DEADLINE_CROSS_ENCODER_SECONDS = 0.5
+
+# Listwise reranking: candidates per prompt, step between window starts, and
+# how many windows are ranked at once.
+RERANK_WINDOW_SIZE = 10
+RERANK_WINDOW_STRIDE = 5
+RERANK_MAX_CONCURRENCY = 4
+RERANK_PARSE_RETRIES = 2
+
+# Resident search server (search_server_cli.py). Set RAG_SEARCH_SERVER to
+# http://host:port or unix:/path/to.sock to send CLI searches there.
+SEARCH_SERVER_HOST = "127.0.0.1"
+SEARCH_SERVER_PORT = 8766
+SEARCH_SERVER_URL = os.getenv("RAG_SEARCH_SERVER")
+SEARCH_SERVER_TIMEOUT = float(os.getenv("RAG_SEARCH_SERVER_TIMEOUT", "120"))
+
+# Hybrid search result cache: entries kept, and seconds before one expires.
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = float(os.getenv("RAG_RESULT_CACHE_TTL", "3600"))
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-DATA_PATH = os.path.join(PROJECT_ROOT, "data", "movies.json")
-STOPWORDS_PATH = os.path.join(PROJECT_ROOT, "data", "stopwords.txt")
-GOLDEN_SET_PATH = os.path.join(PROJECT_ROOT, "data", "golden_dataset.json")
+# Overridable so benchmarks can point every engine at a synthetic corpus.
+DATA_DIR = os.getenv("RAG_DATA_DIR", os.path.join(PROJECT_ROOT, "data"))
+DATA_PATH = os.path.join(DATA_DIR, "movies.json")
+STOPWORDS_PATH = os.path.join(DATA_DIR, "stopwords.txt")
+GOLDEN_SET_PATH = os.path.join(DATA_DIR, "golden_dataset.json")
 
-CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
+CACHE_DIR = os.getenv("RAG_CACHE_DIR", os.path.join(PROJECT_ROOT, "cache"))
+CORPUS_STORE_PATH = os.path.join(CACHE_DIR, "corpus.bin")
+MANIFEST_PATH = os.path.join(CACHE_DIR, "manifest.json")
+SPELL_DICTIONARY_PATH = os.path.join(CACHE_DIR, "spell.pkl")
+EXPANSIONS_PATH = os.path.join(CACHE_DIR, "expansions.pkl")
+RESULT_CACHE_PATH = os.path.join(CACHE_DIR, "results.pkl")
 
 DEFAULT_CHUNK_SIZE = 200
 DEFAULT_CHUNK_OVERLAP = 1
 DEFAULT_SEMANTIC_CHUNK_SIZE = 4
+DEFAULT_EMBED_BATCH_SIZE = 256
 
 MOVIE_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "movie_embeddings.npy")
 CHUNK_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "chunk_embeddings.npy")
 CHUNK_METADATA_PATH = os.path.join(CACHE_DIR, "chunk_metadata.json")
 
 
-def load_movies() -> list[dict]:
-    with open(DATA_PATH, "r") as f:
-        data = json.load(f)
-    return data["movies"]
+def load_movies() -> CorpusStore:
+    """Open the memory-mapped movie corpus, recompiling it if movies.json changed"""
+    with span("corpus.load_movies"):
+        return open_corpus_store(DATA_PATH, CORPUS_STORE_PATH)
 
 
-def load_stopwords() -> list[str]:
+@functools.cache
+def load_stopwords() -> frozenset[str]:
     with open(STOPWORDS_PATH, "r") as f:
-        return f.read().splitlines()
+        return frozenset(f.read().splitlines())
 
 
 def format_search_result(
@@ -62,3 +150,21 @@ def format_search_result(
         "score": round(score, SCORE_PRECISION),
         "metadata": metadata if metadata else {},
     }
+
+
+def top_k_indices(scores: np.ndarray, limit: int) -> np.ndarray:
+    """Indices of the `limit` highest scores, best first
+
+    Ties keep index order, exactly as a stable sort of all the scores
+    would, but only the candidates that can make the cut get sorted.
+    """
+    if limit <= 0:
+        return np.empty(0, dtype=np.intp)
+    if limit < len(scores):
+        cut = len(scores) - limit
+        threshold = np.partition(scores, cut)[cut]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(len(scores))
+    order = np.argsort(-scores[candidates], kind="stable")
+    return candidates[order[:limit]]
@@ -1,59 +1,90 @@
 import json
-import os
-from os import path
 import re
+import sys
+import time
 import numpy as np
 
-from sentence_transformers import SentenceTransformer
+from lib.artifacts import Manifest, atomic_write
+from lib.batch import batch_main
+from lib.chunk_build import build_streaming, discard_partial_build
+from lib.encode_scheduler import EncodeScheduler
+from lib.parallel_encode import ParallelEncoder
+from lib.resources import get_encoder_backend, get_sentence_transformer
+from lib.search_client import SearchClient
+from lib.search_utils import CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH, DEFAULT_BATCH_SIZE, DEFAULT_BATCH_WORKERS, DEFAULT_CHUNK_OVERLAP, DEFAULT_EMBED_BATCH_SIZE, DEFAULT_SEARCH_LIMIT, DEFAULT_SEMANTIC_CHUNK_SIZE, EMBEDDING_MODEL, ENCODER_BACKENDS, MOVIE_EMBEDDINGS_PATH, SCORE_PRECISION, load_movies, top_k_indices
+from lib.tracing import span
 
-from lib.search_utils import CACHE_DIR, CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH, DEFAULT_SEARCH_LIMIT, SCORE_PRECISION, load_movies
+MOVIE_EMBEDDINGS_ARTIFACT = "movie_embeddings"
+CHUNK_EMBEDDINGS_ARTIFACT = "chunk_embeddings"
 
 
 class SemanticSearch:
-    def __init__(self, model_name = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name = EMBEDDING_MODEL, backend = None, model = None):
+        self.model_name = model_name
+        self.backend = backend or get_encoder_backend()
+        # `model` replaces the sentence transformer, e.g. with a fake encoder in benchmarks.
+        self.model = model if model is not None else get_sentence_transformer(model_name, self.backend)
         self.embeddings = None
+        # The shared corpus store; chunk metadata's movie_idx indexes into it.
         self.documents = None
-        self.document_map = {}
 
     def generate_embedding(self, text):
         if not text or text.isspace():
             raise ValueError("Input text cannot be empty.")
-        embedding = self.model.encode([text])
+        with span("semantic.encode_query"):
+            embedding = self.model.encode([text])
         return embedding[0]
+
+    def embed_queries(self, texts):
+        """Encode several queries in one batch"""
+        with span("semantic.encode_queries", queries=len(texts)):
+            return self.model.encode(list(texts))
     
-    def build_embeddings(self, documents):
+    def build_embeddings(self, documents, workers=1, torch_threads=None):
         self.documents = documents
-        doc_strings = []
-        for doc in documents:
-            self.document_map[doc['id']] = doc
-            doc_strings.append(f"{doc['title']}: {doc['description']}")
-        self.embeddings = self.model.encode(doc_strings, show_progress_bar=True)
-        np.save(path.join(CACHE_DIR, "movie_embeddings.npy"), self.embeddings)
+        doc_strings = [f"{doc['title']}: {doc['description']}" for doc in documents]
+        with span("semantic.encode_documents", docs=len(doc_strings), workers=workers):
+            if workers > 1:
+                with self.parallel_encoder(workers, torch_threads) as encoder:
+                    scheduler = EncodeScheduler(self.model, encoder.encode_batches)
+                    self.embeddings = scheduler.encode(doc_strings)
+            else:
+                scheduler = EncodeScheduler(self.model)
+                self.embeddings = scheduler.encode(doc_strings)
+        print(f"Encode scheduler: {scheduler.stats.summary()}", file=sys.stderr)
+        manifest = Manifest()
+        manifest.forget(MOVIE_EMBEDDINGS_ARTIFACT)
+        with atomic_write(MOVIE_EMBEDDINGS_PATH) as f:
+            np.save(f, self.embeddings)
+        manifest.record(MOVIE_EMBEDDINGS_ARTIFACT, [MOVIE_EMBEDDINGS_PATH], self._movie_params())
         return self.embeddings
     
+    def _movie_params(self):
+        # onnx-int8 and torch embeddings differ, so each backend builds its own.
+        return {"model": self.model_name, "backend": self.backend}
+
+    def parallel_encoder(self, workers, torch_threads=None):
+        return ParallelEncoder(self.model_name, self.backend, workers, torch_threads)
+
     def load_or_create_embeddings(self, documents):
         self.documents = documents
-        for doc in documents:
-            self.document_map[doc['id']] = doc
-        if os.path.exists(path.join(CACHE_DIR, "movie_embeddings.npy")):
-            self.embeddings = np.load(path.join(CACHE_DIR, "movie_embeddings.npy"))
-            if len(self.embeddings) == len(documents):
-                return self.embeddings
+        if Manifest().is_fresh(MOVIE_EMBEDDINGS_ARTIFACT, self._movie_params()):
+            with span("semantic.load_embeddings"):
+                self.embeddings = freeze(np.load(MOVIE_EMBEDDINGS_PATH))
+            return self.embeddings
         return self.build_embeddings(documents)
     
-    def search(self, query, limit):
+    def search(self, query, limit, query_embedding=None):
         if self.embeddings is None or self.embeddings.size == 0:
             raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
         if self.documents is None or len(self.documents) == 0:
             raise ValueError("No documents loaded. Call `load_or_create_embeddings` first.")
-        embedded_query = self.generate_embedding(query)
-        res = []
-        for doc, emb in zip(self.documents, self.embeddings):
-            similarity_score = cosine_similarity(embedded_query, emb)
-            res.append((similarity_score, doc))
-        res.sort(key=lambda x: x[0], reverse=True)
-        return [{"score": score, "title": doc["title"], "description": doc["description"]} for score, doc in res[:limit]]
+        embedded_query = self.generate_embedding(query) if query_embedding is None else query_embedding
+        with span("semantic.score", docs=len(self.documents)):
+            scores = cosine_similarities(self.embeddings, np.linalg.norm(self.embeddings, axis=1), embedded_query)
+            top = top_k_indices(scores, limit).tolist()
+        # Only the returned documents are decoded from the store.
+        return [{"score": float(scores[i]), "title": self.documents[i]["title"], "description": self.documents[i]["description"]} for i in top]
     
         
 
@@ -93,6 +124,17 @@ def cosine_similarity(vec1, vec2):
         return 0.0
     return dot_product / (norm1 * norm2)
 
+def cosine_similarities(matrix, row_norms, vec):
+    """cosine_similarity of `vec` against every row of `matrix` (0.0 for zero vectors)"""
+    denominators = row_norms * np.linalg.norm(vec)
+    dots = matrix @ vec
+    return np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators != 0)
+
+def freeze(array):
+    """Mark an array read-only, so it can be shared between query threads"""
+    array.flags.writeable = False
+    return array
+
 def search_command(query, limit=DEFAULT_SEARCH_LIMIT):
     semantic_search = SemanticSearch()
     documents = load_movies()
@@ -126,6 +168,15 @@ def semantic_chunk(text: str, max_chunk_size, overlap=0):
             chunks.append(stripped_chunk)
     return chunks
         
+def iter_document_chunks(documents):
+    for i, doc in enumerate(documents):
+        text = doc.get("description", " ").strip()
+        if not text:
+            continue
+        chunks = semantic_chunk(text, max_chunk_size=DEFAULT_SEMANTIC_CHUNK_SIZE, overlap=DEFAULT_CHUNK_OVERLAP)
+        for j, chunk in enumerate(chunks):
+            yield {'movie_idx': i, 'chunk_idx': j, 'total_chunks': len(chunks)}, chunk
+
 def semantic_chunk_command(text: str, max_chunk_size, overlap=0):
     chunks = semantic_chunk(text, max_chunk_size, overlap)
     for i, chunk in enumerate(chunks, 1):
@@ -133,81 +184,188 @@ def semantic_chunk_command(text: str, max_chunk_size, overlap=0):
     
     
     
+def chunk_params(model_name, backend, documents):
+    """Manifest parameters of the chunk embeddings for `documents`"""
+    return {
+        "model": model_name,
+        "backend": backend,
+        "max_chunk_size": DEFAULT_SEMANTIC_CHUNK_SIZE,
+        "overlap": DEFAULT_CHUNK_OVERLAP,
+        "documents": len(documents),
+    }
+
+
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name = "all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(self, model_name = EMBEDDING_MODEL, backend = None, model = None) -> None:
+        super().__init__(model_name, backend, model)
         self.chunk_embeddings = None
         self.chunk_metadata = None  
+        # Derived from the two above when they are loaded, read-only after.
+        self.chunk_norms = None
+        self.chunk_movie_idx = None
         
-    def build_chunk_embeddings(self, documents):
+    def build_chunk_embeddings(self, documents, batch_size=DEFAULT_EMBED_BATCH_SIZE, workers=1, torch_threads=None):
         self.documents = documents
-        all_chunks = []
-        chunk_data = []
-        for i, doc in enumerate(documents):
-            self.document_map[doc['id']] = doc
-            text = doc.get("description", " ").strip()
-            if not text:
-                continue
-            chunks = semantic_chunk(text, max_chunk_size=4, overlap=1)
-            for j, chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                chunk_data.append({'movie_idx': i, 'chunk_idx': j, 'total_chunks': len(chunks)})
-        self.chunk_embeddings = self.model.encode(all_chunks, show_progress_bar=True)
-        self.chunk_metadata = chunk_data
-        os.makedirs(os.path.dirname(CHUNK_EMBEDDINGS_PATH), exist_ok=True)
-        np.save(CHUNK_EMBEDDINGS_PATH, self.chunk_embeddings)
-        with open(CHUNK_METADATA_PATH, "w") as f:
-            json.dump({"chunks": chunk_data, "total_chunks": len(all_chunks)}, f, indent=2)
-        return self.chunk_embeddings
-    
-    def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
-        self.documents = documents
-        for doc in documents:
-            self.document_map[doc['id']] = doc
-        if os.path.exists(CHUNK_EMBEDDINGS_PATH):
+        with span("chunks.count"):
+            total = sum(1 for _ in iter_document_chunks(documents))
+        params = self._chunk_params(documents)
+        manifest = Manifest()
+        manifest.forget(CHUNK_EMBEDDINGS_ARTIFACT)
+        # A partial build of an edited corpus with the same document count
+        # must not be resumed; the manifest checks the hash itself, so only
+        # the resume key carries it.
+        resume_params = {**params, "corpus_sha256": manifest.source_sha256()}
+        encoder = self.parallel_encoder(workers, torch_threads) if workers > 1 else None
+        scheduler = EncodeScheduler(self.model, encoder.encode_batches if encoder else None)
+        try:
+            # Each streamed batch is deduped and length-bucketed, and its
+            # buckets are spread across the workers.
+            resumed = build_streaming(
+                iter_document_chunks(documents),
+                total,
+                self.model.get_sentence_embedding_dimension(),
+                scheduler.encode,
+                CHUNK_EMBEDDINGS_PATH,
+                CHUNK_METADATA_PATH,
+                resume_params,
+                batch_size * workers,
+            )
+        finally:
+            if encoder:
+                encoder.close()
+        manifest.record(CHUNK_EMBEDDINGS_ARTIFACT, [CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH], params)
+        if resumed:
+            print(f"Resumed from chunk {resumed} of {total}", file=sys.stderr)
+        print(f"Encode scheduler: {scheduler.stats.summary()}", file=sys.stderr)
+        return self._load_chunk_embeddings()
+
+    def _chunk_params(self, documents):
+        return chunk_params(self.model_name, self.backend, documents)
+
+    def _load_chunk_embeddings(self) -> np.ndarray:
+        with span("chunks.load_embeddings") as s:
             self.chunk_embeddings = np.load(CHUNK_EMBEDDINGS_PATH)
             with open(CHUNK_METADATA_PATH, "r") as f:
                 data = json.load(f)
                 self.chunk_metadata = data["chunks"]
-            return self.chunk_embeddings
-        return self.build_chunk_embeddings(documents)
+            self.chunk_norms = freeze(np.linalg.norm(self.chunk_embeddings, axis=1))
+            self.chunk_movie_idx = freeze(np.fromiter((chunk["movie_idx"] for chunk in self.chunk_metadata), dtype=np.intp, count=len(self.chunk_metadata)))
+            freeze(self.chunk_embeddings)
+            s.set(chunks=len(self.chunk_metadata))
+        return self.chunk_embeddings
+
+    def stale_reason(self, documents):
+        """Why the saved chunk embeddings must be rebuilt for `documents`, or None if they are current"""
+        return Manifest().stale_reason(CHUNK_EMBEDDINGS_ARTIFACT, self._chunk_params(documents))
+
+    def load_chunk_embeddings(self, documents):
+        """Load the saved chunk embeddings, never rebuilding them"""
+        self.documents = documents
+        return self._load_chunk_embeddings()
+
+    def load_or_create_chunk_embeddings(self, documents: list[dict], batch_size: int = DEFAULT_EMBED_BATCH_SIZE, workers: int = 1, torch_threads=None) -> np.ndarray:
+        self.documents = documents
+        if self.stale_reason(documents) is None:
+            return self._load_chunk_embeddings()
+        return self.build_chunk_embeddings(documents, batch_size, workers, torch_threads)
     
-    def search_chunks(self, query: str, limit: int = 10):
-        embedded_query = self.generate_embedding(query)
-        chunk_scores = []
+    def search_chunks(self, query: str, limit: int = 10, query_embedding=None):
         if self.chunk_embeddings is None or self.chunk_embeddings.size == 0 or self.chunk_metadata is None:
             raise ValueError("No chunk embeddings loaded. Call `load_or_create_chunk_embeddings` first.")
-        for chunk_data, chunk_emb in zip(self.chunk_metadata, self.chunk_embeddings):
-            score = cosine_similarity(embedded_query, chunk_emb)
-            chunk_scores.append({"chunk_idx": chunk_data['chunk_idx'], "movie_idx": chunk_data['movie_idx'], "score": score})
-        movie_scores = {}
-        for chunk_score in chunk_scores:
-            movie_idx = chunk_score['movie_idx']
-            score = chunk_score['score']
-            if movie_idx not in movie_scores or score > movie_scores[movie_idx]:
-                movie_scores[movie_idx] = score
-        sorted_movies = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
-        return [{
-            "id": self.documents[movie_idx]['id'],
-            "title": self.documents[movie_idx]['title'],
-            "document": self.documents[movie_idx]['description'][:100],
-            "score": round(score, SCORE_PRECISION),
-            "metadata": self.documents[movie_idx].get('metadata', {})
-                } for movie_idx, score in sorted_movies[:limit]]
-                            
-
-def embed_chunks_command():
+        embedded_query = self.generate_embedding(query) if query_embedding is None else query_embedding
+        with span("chunks.score", chunks=len(self.chunk_metadata)):
+            # One matrix-vector product (numpy releases the GIL for it, so
+            # concurrent queries run in parallel); the arrays are shared and
+            # read-only, the scores belong to this query.
+            chunk_scores = cosine_similarities(self.chunk_embeddings, self.chunk_norms, embedded_query)
+        with span("chunks.aggregate"):
+            # Best chunk per movie; movies without chunks stay at -inf.
+            movie_scores = np.full(len(self.documents), -np.inf, dtype=chunk_scores.dtype)
+            np.maximum.at(movie_scores, self.chunk_movie_idx, chunk_scores)
+            top = [i for i in top_k_indices(movie_scores, limit).tolist() if movie_scores[i] > -np.inf]
+        results = []
+        for movie_idx in top:
+            doc = self.documents[movie_idx]
+            results.append({
+                "id": doc['id'],
+                "title": doc['title'],
+                "document": doc['description'][:100],
+                "score": round(float(movie_scores[movie_idx]), SCORE_PRECISION),
+                "metadata": doc.get('metadata', {})
+            })
+        return results
+
+
+def compare_backends_command(backends=ENCODER_BACKENDS, num_queries=50, num_docs=512, min_cosine=0.99):
+    documents = load_movies()
+    doc_strings = [f"{doc['title']}: {doc['description']}" for doc in documents[:num_docs]]
+    queries = [doc['title'] for doc in documents[:num_queries]]
+
+    reference = get_sentence_transformer(EMBEDDING_MODEL, "torch")
+    reference_embeddings = reference.encode(doc_strings)
+
+    for backend in backends:
+        model = get_sentence_transformer(EMBEDDING_MODEL, backend)
+        model.encode(queries[:2])  # warm up
+
+        start = time.perf_counter()
+        for query in queries:
+            model.encode([query])
+        single_qps = len(queries) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        embeddings = model.encode(doc_strings)
+        bulk_dps = len(doc_strings) / (time.perf_counter() - start)
+
+        cosines = np.sum(embeddings * reference_embeddings, axis=1) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference_embeddings, axis=1)
+        )
+        max_abs_diff = float(np.max(np.abs(embeddings - reference_embeddings)))
+        status = "ok" if cosines.min() >= min_cosine else "MISMATCH"
+
+        print(f"{backend}:")
+        print(f"  single query: {single_qps:.1f} queries/s ({1000 / single_qps:.2f} ms/query)")
+        print(f"  bulk encode:  {bulk_dps:.1f} docs/s")
+        print(f"  parity vs torch: min cosine {cosines.min():.5f}, mean {cosines.mean():.5f}, max |diff| {max_abs_diff:.5f} [{status}]")
+
+
+def embed_chunks_command(batch_size=DEFAULT_EMBED_BATCH_SIZE, rebuild=False, workers=1, torch_threads=None):
     documents = load_movies()
     chunked_semantic_search = ChunkedSemanticSearch()
-    embeddings = chunked_semantic_search.load_or_create_chunk_embeddings(documents)
+    if rebuild:
+        discard_partial_build(CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH)
+        embeddings = chunked_semantic_search.build_chunk_embeddings(documents, batch_size, workers, torch_threads)
+    else:
+        embeddings = chunked_semantic_search.load_or_create_chunk_embeddings(documents, batch_size, workers, torch_threads)
     print(f"Generated {len(embeddings)} chunked embeddings")
     
-def search_chunked_command(query, limit=DEFAULT_SEARCH_LIMIT):
-    documents = load_movies()
-    chunked_semantic_search = ChunkedSemanticSearch()
-    chunked_semantic_search.load_or_create_chunk_embeddings(documents)
-    results = chunked_semantic_search.search_chunks(query, limit)
+def search_chunked_command(query, limit=DEFAULT_SEARCH_LIMIT, server=None):
+    if server:
+        results = SearchClient(server).semantic(query, limit)
+    else:
+        documents = load_movies()
+        chunked_semantic_search = ChunkedSemanticSearch()
+        chunked_semantic_search.load_or_create_chunk_embeddings(documents)
+        results = chunked_semantic_search.search_chunks(query, limit)
     for i, res in enumerate(results, 1):
         print(f"\n{i}. {res['title']} (score: {res['score']:.4f})")
         print(f"   {res['document']}...")
-    
\ No newline at end of file
+    
+
+
+def batch_command(input_path, output_path=None, chunked=True, limit=DEFAULT_SEARCH_LIMIT, workers=DEFAULT_BATCH_WORKERS, batch_size=DEFAULT_BATCH_SIZE):
+    """Answer a JSONL file of queries, embedding them `batch_size` at a time"""
+    documents = load_movies()
+    if chunked:
+        searcher = ChunkedSemanticSearch()
+        searcher.load_or_create_chunk_embeddings(documents)
+        run = searcher.search_chunks
+    else:
+        searcher = SemanticSearch()
+        searcher.load_or_create_embeddings(documents)
+        run = searcher.search
+
+    def search(request, embedding):
+        return {"results": run(request["query"], request.get("limit", limit), query_embedding=embedding)}
+
+    return batch_main(input_path, output_path, search, workers, batch_size, searcher.embed_queries)
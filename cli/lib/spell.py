@@ -0,0 +1,161 @@
+import pickle
+import re
+from collections import Counter
+from typing import Iterable
+
+from .artifacts import atomic_write
+
+# Symmetric-delete spelling correction (the SymSpell approach): every
+# dictionary word is indexed under each string reachable from it by up to
+# `max_distance` deletions. A misspelling is looked up through its own
+# deletes, so only the deletes are generated at query time, never the
+# inserts/substitutions, and candidate generation is a few dict lookups.
+DEFAULT_MAX_EDIT_DISTANCE = 2
+# Deletes are generated from this many leading characters only; longer words
+# are still verified against their full length.
+DEFAULT_PREFIX_LENGTH = 7
+# Words this short are left alone: too many dictionary words are within two
+# edits of them.
+MIN_CORRECTION_LENGTH = 3
+
+_WORD_PATTERN = re.compile(r"[A-Za-z]+")
+
+
+class SpellCorrector:
+    def __init__(
+        self,
+        word_counts: dict[str, int],
+        max_distance: int = DEFAULT_MAX_EDIT_DISTANCE,
+        prefix_length: int = DEFAULT_PREFIX_LENGTH,
+    ) -> None:
+        self.word_counts = dict(word_counts)
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.deletes: dict[str, list[str]] = {}
+        for word in self.word_counts:
+            for delete in self._deletes(word[:prefix_length]):
+                self.deletes.setdefault(delete, []).append(word)
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], **kwargs) -> "SpellCorrector":
+        counts = Counter()
+        for text in texts:
+            counts.update(word.lower() for word in _WORD_PATTERN.findall(text))
+        return cls(counts, **kwargs)
+
+    def _deletes(self, word: str) -> set[str]:
+        found = {word}
+        frontier = {word}
+        for _ in range(self.max_distance):
+            frontier = {
+                candidate[:i] + candidate[i + 1 :]
+                for candidate in frontier
+                for i in range(len(candidate))
+            }
+            found |= frontier
+        return found
+
+    def lookup(self, word: str) -> str:
+        """The most frequent dictionary word closest to `word` (lower case)"""
+        word = word.lower()
+        if word in self.word_counts or len(word) < MIN_CORRECTION_LENGTH:
+            return word
+
+        best, best_distance, best_count = None, self.max_distance, 0
+        seen = set()
+        for delete in self._deletes(word[: self.prefix_length]):
+            for candidate in self.deletes.get(delete, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                # Anything at best_distance + 1 or more cannot win.
+                distance = edit_distance(word, candidate, best_distance + 1)
+                if distance > best_distance:
+                    continue
+                count = self.word_counts[candidate]
+                if best is None or distance < best_distance or count > best_count:
+                    best, best_distance, best_count = candidate, distance, count
+        return best or word
+
+    def correct(self, query: str) -> str:
+        """Correct each word of `query`, leaving punctuation and spacing as-is"""
+
+        def replace(match: re.Match) -> str:
+            original = match.group(0)
+            corrected = self.lookup(original)
+            return original if corrected == original.lower() else corrected
+
+        return _WORD_PATTERN.sub(replace, query)
+
+    def save(self, path: str) -> None:
+        with atomic_write(path) as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: str) -> "SpellCorrector":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance, or `limit` once it is certain to reach it"""
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) >= limit:
+        return limit
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if (
+                previous2 is not None
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) >= limit:
+            return limit
+        previous2, previous = previous, current
+    return min(previous[-1], limit)
+
+
+def make_typo(word: str, rng) -> str:
+    """Apply one random deletion, insertion, substitution or transposition."""
+    i = rng.randrange(len(word))
+    letter = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    match rng.randrange(4):
+        case 0:
+            return word[:i] + word[i + 1 :]
+        case 1:
+            return word[:i] + letter + word[i:]
+        case 2:
+            return word[:i] + letter + word[i + 1 :]
+        case _:
+            if i == len(word) - 1:
+                i -= 1
+            return word[:i] + word[i + 1] + word[i] + word[i + 2 :]
+
+
+def make_typo_queries(queries: Iterable[str], rng, typos_per_query: int = 1):
+    """(misspelled, original) pairs with typos in words long enough to correct"""
+    cases = []
+    for query in queries:
+        words = query.split()
+        eligible = [
+            i for i, word in enumerate(words) if len(word) >= 4 and word.isalpha()
+        ]
+        if not eligible:
+            continue
+        for i in rng.sample(eligible, min(typos_per_query, len(eligible))):
+            typo = make_typo(words[i], rng)
+            while typo == words[i]:
+                typo = make_typo(words[i], rng)
+            words[i] = typo
+        cases.append((" ".join(words), query))
+    return cases
@@ -0,0 +1,164 @@
+import json
+import math
+import os
+import zlib
+
+import numpy as np
+
+from .tracing import span
+
+# Synthetic movie catalogs for scaling benchmarks, shaped like real text:
+# word frequencies follow a Zipf-Mandelbrot law, the vocabulary grows with
+# corpus size per Heaps' law, and description and sentence lengths are
+# log-normal. That keeps postings lengths, document lengths and chunk
+# counts realistic as the corpus grows, which uniform sampling from a small
+# vocabulary (like the bundled catalog) does not.
+ZIPF_EXPONENT = 1.07
+ZIPF_SHIFT = 2.7
+HEAPS_K = 30
+HEAPS_BETA = 0.55
+MEAN_DESCRIPTION_WORDS = 60
+MEAN_SENTENCE_WORDS = 12
+LENGTH_SIGMA = 0.5
+STOPWORD_RATE = 0.3
+MAX_TITLE_WORDS = 4
+GENERATE_BATCH_SIZE = 10_000
+
+# Pseudo-words are spelled from these syllables, frequent words shortest.
+_SYLLABLES = [
+    consonant + vowel
+    for consonant in "bdfgklmnprstvz"
+    for vowel in ("a", "e", "i", "o", "u", "ai", "ou", "ar", "en")
+]
+
+
+def vocabulary_size(num_docs: int) -> int:
+    return int(HEAPS_K * (num_docs * MEAN_DESCRIPTION_WORDS) ** HEAPS_BETA)
+
+
+def pseudo_word(rank: int) -> str:
+    """A unique, pronounceable word for every rank (at least two syllables)"""
+    n = rank + len(_SYLLABLES)
+    syllables = []
+    while n:
+        n, digit = divmod(n, len(_SYLLABLES))
+        syllables.append(_SYLLABLES[digit])
+    return "".join(reversed(syllables))
+
+
+def _zipf_cdf(size: int) -> np.ndarray:
+    weights = 1.0 / (np.arange(1, size + 1) + ZIPF_SHIFT) ** ZIPF_EXPONENT
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def _lognormal_lengths(rng, mean: float, count: int, minimum: int) -> np.ndarray:
+    mu = math.log(mean) - LENGTH_SIGMA**2 / 2
+    lengths = rng.lognormal(mu, LENGTH_SIGMA, count).astype(np.int64)
+    return np.maximum(lengths, minimum)
+
+
+def generate_movies(num_docs: int, stopwords: list[str], seed: int = 0):
+    """Yield `num_docs` movie dicts ({"id", "title", "description"})"""
+    rng = np.random.default_rng(seed)
+    vocab = [pseudo_word(rank) for rank in range(vocabulary_size(num_docs))]
+    cdf = _zipf_cdf(len(vocab))
+    stopwords = stopwords or ["the"]
+
+    next_id = 1
+    for start in range(0, num_docs, GENERATE_BATCH_SIZE):
+        count = min(GENERATE_BATCH_SIZE, num_docs - start)
+        lengths = _lognormal_lengths(rng, MEAN_DESCRIPTION_WORDS, count, 3)
+        total = int(lengths.sum())
+        ranks = np.searchsorted(cdf, rng.random(total)).tolist()
+        is_stopword = (rng.random(total) < STOPWORD_RATE).tolist()
+        stopword_ids = rng.integers(len(stopwords), size=total).tolist()
+        sentence_ends = (rng.random(total) < 1 / MEAN_SENTENCE_WORDS).tolist()
+        title_lengths = rng.integers(1, MAX_TITLE_WORDS + 1, size=count).tolist()
+        title_ranks = np.searchsorted(cdf, rng.random(count * MAX_TITLE_WORDS)).tolist()
+
+        position = 0
+        for i, length in enumerate(lengths.tolist()):
+            words, sentence_start = [], True
+            for j in range(position, position + length):
+                word = stopwords[stopword_ids[j]] if is_stopword[j] else vocab[ranks[j]]
+                if sentence_start:
+                    word = word.capitalize()
+                if sentence_ends[j] or j == position + length - 1:
+                    word += "."
+                sentence_start = sentence_ends[j]
+                words.append(word)
+            position += length
+            first = i * MAX_TITLE_WORDS
+            title_words = title_ranks[first : first + title_lengths[i]]
+            yield {
+                "id": next_id,
+                "title": " ".join(vocab[rank].capitalize() for rank in title_words),
+                "description": " ".join(words),
+            }
+            next_id += 1
+
+
+def write_corpus(path: str, num_docs: int, stopwords: list[str], seed: int = 0) -> None:
+    """Stream a synthetic movies.json to `path` without holding it in memory"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with span("synthetic.write_corpus", docs=num_docs), open(tmp_path, "w") as f:
+        f.write('{"movies": [')
+        for i, movie in enumerate(generate_movies(num_docs, stopwords, seed)):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(movie))
+        f.write("]}")
+    os.replace(tmp_path, path)
+
+
+class HashingEncoder:
+    """Deterministic stand-in for a sentence transformer, with no model download
+
+    Words are feature-hashed into a fixed table of random vectors and a
+    text embeds as the normalized sum of its words' vectors, so texts that
+    share words are similar and every run produces the same embeddings.
+    Covers the parts of the SentenceTransformer interface the engines use.
+    """
+
+    BUCKETS = 1 << 14
+    max_seq_length = 256
+
+    def __init__(self, dim: int = 384, seed: int = 0) -> None:
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+        rng = np.random.default_rng(seed)
+        self._table = rng.standard_normal((self.BUCKETS, dim)).astype(np.float32)
+        self._buckets: dict[str, int] = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _words(self, text: str) -> list[str]:
+        return text.lower().split()[: self.max_seq_length]
+
+    def _bucket(self, word: str) -> int:
+        bucket = self._buckets.get(word)
+        if bucket is None:
+            bucket = zlib.crc32(word.strip(".,!?;:").encode()) % self.BUCKETS
+            self._buckets[word] = bucket
+        return bucket
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            buckets = [self._bucket(word) for word in self._words(text)]
+            if buckets:
+                embeddings[i] = self._table[buckets].sum(axis=0)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def tokenizer(self, texts, max_length: int = 256, **kwargs) -> dict:
+        # Word counts plus [CLS]/[SEP], which is all EncodeScheduler needs.
+        return {
+            "input_ids": [
+                [0] * (min(len(text.split()), max_length - 2) + 2) for text in texts
+            ]
+        }
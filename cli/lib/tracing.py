@@ -0,0 +1,271 @@
+import argparse
+import contextvars
+import functools
+import json
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional, TextIO, TypeVar
+
+# Tracing is off unless a CLI enables it with --trace. While disabled,
+# `span()` hands back a shared no-op context manager, so instrumented code
+# only pays for one global lookup and a function call.
+#
+# The open span lives in a context variable, so coroutines on the LLM
+# gateway's loop (and asyncio.to_thread) nest under whoever called them.
+# Thread pools don't carry it over on their own: submit `propagate(func)`.
+_enabled = False
+_jsonl_path: Optional[str] = None
+_print_tree = True
+_lock = threading.Lock()
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+_roots: list["Span"] = []
+
+T = TypeVar("T")
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "duration", "children", "parent", "_token")
+
+    def __init__(self, name: str, attrs: dict[str, Any]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.duration = 0.0
+        self.children: list[Span] = []
+        self.parent: Optional[Span] = None
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self.parent = _current.get()
+        # Spans from worker threads may share a parent; both appends hold
+        # the lock so report() never sees a list change under it.
+        with _lock:
+            if self.parent is not None:
+                self.parent.children.append(self)
+            else:
+                _roots.append(self)
+        self._token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _current.reset(self._token)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs: Any) -> Span | _NoopSpan:
+    """Time a pipeline stage
+
+    Use as a context manager. Spans opened while another span is active in
+    the same thread or task, or in a function wrapped with `propagate()`
+    there, become its children.
+
+    Args:
+        name: Stage name shown in the breakdown
+        **attrs: Extra fields recorded with the span (counts, sizes, ...)
+
+    Returns:
+        A span, or a shared no-op object when tracing is disabled
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+def traced(name: str):
+    """Decorator form of `span()` for whole functions."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def propagate(func: Callable[..., T]) -> Callable[..., T]:
+    """`func`, made to nest the spans it opens under the span open now
+
+    Wrap what is handed to a thread pool or thread, so the work done there
+    shows up inside the request that asked for it rather than as separate
+    roots counted again in the total.
+    """
+    if not _enabled:
+        return func
+    parent = _current.get()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return wrapper
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable(jsonl_path: Optional[str] = None, print_tree: bool = True) -> None:
+    global _enabled, _jsonl_path, _print_tree
+    _enabled = True
+    _jsonl_path = jsonl_path
+    _print_tree = print_tree
+
+
+def disable() -> None:
+    global _enabled, _jsonl_path
+    _enabled = False
+    _jsonl_path = None
+
+
+def reset() -> list[Span]:
+    with _lock:
+        roots = list(_roots)
+        _roots.clear()
+    return roots
+
+
+def _take(root: Span) -> list[Span]:
+    with _lock:
+        if root in _roots:
+            _roots.remove(root)
+    return [root]
+
+
+def add_trace_arguments(parser) -> None:
+    """Add --trace/--trace-jsonl to a CLI parser and all of its subcommands."""
+    _add_trace_arguments(parser, default_trace=False, default_jsonl=None)
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            for subparser in action.choices.values():
+                # SUPPRESS keeps a subcommand from resetting a flag that was
+                # given before the subcommand name.
+                _add_trace_arguments(
+                    subparser,
+                    default_trace=argparse.SUPPRESS,
+                    default_jsonl=argparse.SUPPRESS,
+                )
+
+
+def _add_trace_arguments(parser, default_trace, default_jsonl) -> None:
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        default=default_trace,
+        help="Print a per-stage timing breakdown to stderr",
+    )
+    parser.add_argument(
+        "--trace-jsonl",
+        type=str,
+        default=default_jsonl,
+        metavar="PATH",
+        help="Append trace spans as JSON lines to PATH ('-' for stderr)",
+    )
+
+
+def configure_from_args(args) -> None:
+    if getattr(args, "trace", False) or getattr(args, "trace_jsonl", None):
+        enable(getattr(args, "trace_jsonl", None), getattr(args, "trace", False))
+
+
+def report(out: TextIO = sys.stderr, root: Optional[Span] = None) -> None:
+    """Print the collected span tree and flush JSON lines, then reset.
+
+    With `root`, report only that span's tree and leave the rest collected:
+    a server reports each request on its own while others are in flight.
+    """
+    if not _enabled:
+        return
+    roots = reset() if root is None else _take(root)
+    if not roots:
+        return
+
+    if _jsonl_path:
+        if _jsonl_path == "-":
+            write_jsonl(roots, sys.stderr)
+        else:
+            with open(_jsonl_path, "a") as f:
+                write_jsonl(roots, f)
+
+    if not _print_tree:
+        return
+    # Work in worker threads is nested under the span that asked for it,
+    # so only the top-level spans make up the total.
+    total = sum(r.duration for r in roots)
+    print("\nTrace:", file=out)
+    for r in roots:
+        _print_span(r, total, 0, out)
+
+
+def _print_span(s: Span, total: float, depth: int, out: TextIO) -> None:
+    share = (s.duration / total * 100) if total > 0 else 0.0
+    attrs = " ".join(f"{k}={v}" for k, v in s.attrs.items())
+    line = f"{'  ' * depth}{s.name:<{max(40 - 2 * depth, 1)}} {s.duration * 1000:10.2f} ms {share:6.1f}%"
+    if attrs:
+        line += f"  [{attrs}]"
+    print(line, file=out)
+
+    if s.children:
+        untracked = s.duration - sum(child.duration for child in s.children)
+        for child in s.children:
+            _print_span(child, total, depth + 1, out)
+        if untracked > 0.001 * total and untracked > 0.0005:
+            pad = max(40 - 2 * (depth + 1), 1)
+            print(
+                f"{'  ' * (depth + 1)}{'(self)':<{pad}} {untracked * 1000:10.2f} ms "
+                f"{untracked / total * 100 if total else 0.0:6.1f}%",
+                file=out,
+            )
+
+
+def write_jsonl(roots: list[Span], out: TextIO) -> None:
+    for root in roots:
+        _write_span(root, "", 0, out)
+
+
+def _write_span(s: Span, parent_path: str, depth: int, out: TextIO) -> None:
+    path = f"{parent_path}/{s.name}" if parent_path else s.name
+    record = {
+        "name": s.name,
+        "path": path,
+        "depth": depth,
+        "start": round(s.start, 6),
+        "duration_ms": round(s.duration * 1000, 3),
+        "attrs": s.attrs,
+    }
+    out.write(json.dumps(record, default=str) + "\n")
+    for child in s.children:
+        _write_span(child, path, depth + 1, out)
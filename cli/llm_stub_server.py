@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Local stand-in for the LLM, for running the pipeline offline.
+
+    python llm_stub_server.py --port 8765 --latency 0.2 --error-rate 0.1
+    RAG_LLM_URL=http://127.0.0.1:8765/generate python hybrid_search_cli.py ...
+
+Answers are canned but shaped like the real ones: ranking prompts get a
+JSON list of the IDs they list, rating prompts a number, anything else a
+short echo of the query.
+"""
+
+import argparse
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ID_LINE = re.compile(r"^\s*(\d+):", re.MULTILINE)
+_QUERY = re.compile(r'Query: "?([^"\n]*)"?')
+
+
+def stub_answer(prompt: str) -> str:
+    ids = [int(doc_id) for doc_id in _ID_LINE.findall(prompt)]
+    if ids and "JSON list" in prompt:
+        return json.dumps(ids)
+    if "Rate 0-10" in prompt:
+        return str(random.randint(0, 10))
+    query = _QUERY.search(prompt)
+    return query.group(1) if query else "Stub response."
+
+
+def make_handler(latency: float, jitter: float, error_rate: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this, Nagle
+        # plus delayed ACKs add ~40 ms to every keep-alive response.
+        disable_nagle_algorithm = True
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", 0))
+            prompt = json.loads(self.rfile.read(length)).get("prompt", "")
+            time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+            if random.random() < error_rate:
+                self._reply(503, {"error": "stub overloaded"})
+                return
+            text = stub_answer(prompt)
+            self._reply(
+                200,
+                {
+                    "text": text,
+                    "prompt_tokens": len(prompt.split()),
+                    "response_tokens": len(text.split()),
+                },
+            )
+
+        def _reply(self, status: int, body: dict) -> None:
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local LLM stub server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="Seconds per response"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Uniform +/- seconds of latency"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with HTTP 503",
+    )
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        (args.host, args.port), make_handler(args.latency, args.jitter, args.error_rate)
+    )
+    print(f"LLM stub listening on http://{args.host}:{args.port}/generate")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
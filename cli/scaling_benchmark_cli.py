@@ -0,0 +1,68 @@
+import argparse
+
+from lib.scaling_benchmark import (
+    DEFAULT_DIM,
+    DEFAULT_QUERIES,
+    DEFAULT_SIZES,
+    scaling_benchmark_command,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Scaling benchmarks on synthetic corpora of increasing size"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_SIZES),
+        help="Corpus sizes in documents (default=10000 100000 1000000)",
+    )
+    parser.add_argument(
+        "--queries",
+        type=int,
+        default=DEFAULT_QUERIES,
+        help=f"Queries per query benchmark (default={DEFAULT_QUERIES})",
+    )
+    parser.add_argument(
+        "--dim",
+        type=int,
+        default=DEFAULT_DIM,
+        help=f"Fake encoder embedding dimension (default={DEFAULT_DIM})",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Corpus and query seed")
+    parser.add_argument(
+        "--workdir",
+        type=str,
+        help="Where corpora and caches are kept (default=cache/benchmarks)",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="JSON report path (default=benchmarks/scaling-<commit>.json)",
+    )
+    args = parser.parse_args()
+
+    report = scaling_benchmark_command(
+        args.sizes, args.queries, args.dim, args.seed, args.workdir, args.output
+    )
+    for size in report["sizes"]:
+        print(f"\n{size['docs']} docs, {size['chunks']} chunks:")
+        for name, result in size["benchmarks"].items():
+            timing = (
+                f"p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms"
+                if "p50_ms" in result
+                else f"{result['seconds']:12.3f} s"
+            )
+            print(f"  {name:<16} {timing}  peak {result['peak_rss_mb']:8.1f} MB")
+    if len(report["sizes"]) > 1:
+        print("\nScaling exponents (log time / log docs, 1.0 = linear):")
+        for name, exponents in report["exponents"].items():
+            shown = ", ".join("n/a" if e is None else f"{e:.2f}" for e in exponents)
+            print(f"  {name:<16} {shown}")
+    print(f"\nReport written to {report['output']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+
+from lib.resources import set_encoder_backend
+from lib.search_server import serve_command
+from lib.search_utils import ENCODER_BACKENDS, SEARCH_SERVER_HOST, SEARCH_SERVER_PORT
+from lib.tracing import add_trace_arguments, configure_from_args
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Resident search server: loads everything once, then answers keyword, semantic, hybrid, rerank and RAG requests"
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=SEARCH_SERVER_HOST,
+        help=f"Address to listen on (default={SEARCH_SERVER_HOST})",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=SEARCH_SERVER_PORT,
+        help=f"TCP port to listen on (default={SEARCH_SERVER_PORT})",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=None,
+        help="Listen on this Unix socket path instead of TCP",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=ENCODER_BACKENDS,
+        default=None,
+        help="Inference backend for the embedding model (default: $RAG_ENCODER_BACKEND or torch)",
+    )
+    parser.add_argument(
+        "--no-result-cache",
+        action="store_true",
+        help="Recompute every hybrid search instead of answering repeats from memory",
+    )
+    add_trace_arguments(parser)
+
+    args = parser.parse_args()
+    configure_from_args(args)
+    if args.backend:
+        set_encoder_backend(args.backend)
+
+    serve_command(args.host, args.port, args.socket, not args.no_result_cache)
+
+
+if __name__ == "__main__":
+    main()
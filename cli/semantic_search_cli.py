@@ -2,8 +2,18 @@
 
 import argparse
 
+from lib.resources import set_encoder_backend
+from lib.search_utils import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_BATCH_WORKERS,
+    DEFAULT_EMBED_BATCH_SIZE,
+    ENCODER_BACKENDS,
+    SEARCH_SERVER_URL,
+)
 from lib.semantic_search import (
+    batch_command,
     chunk_command,
+    compare_backends_command,
     embed_chunks_command,
     embed_query_text,
     embed_text,
@@ -13,10 +23,24 @@ from lib.semantic_search import (
     verify_embeddings,
     verify_model,
 )
+from lib.tracing import add_trace_arguments, configure_from_args, report, span
 
 
 def main():
     parser = argparse.ArgumentParser(description="Semantic Search CLI")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=ENCODER_BACKENDS,
+        default=None,
+        help="Inference backend for the embedding model (default: $RAG_ENCODER_BACKEND or torch)",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=SEARCH_SERVER_URL,
+        help="Send searches to a running search_server_cli.py, at http://host:port or unix:/path (default: $RAG_SEARCH_SERVER); used by search_chunked",
+    )
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     subparsers.add_parser("verify", help="Verify the model")
@@ -57,7 +81,32 @@ def main():
         "--overlap", type=int, default=0, help="Size of each chunk overlap"
     )
 
-    subparsers.add_parser("embed_chunks", help="Embed semantic chunks")
+    embed_chunks_parser = subparsers.add_parser(
+        "embed_chunks", help="Embed semantic chunks (resumes an interrupted build)"
+    )
+    embed_chunks_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_EMBED_BATCH_SIZE,
+        help="Chunks encoded and checkpointed per batch",
+    )
+    embed_chunks_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Encoder processes, each with its own model (default=1)",
+    )
+    embed_chunks_parser.add_argument(
+        "--torch-threads",
+        type=int,
+        default=None,
+        help="Torch threads per worker (default: CPU count / workers)",
+    )
+    embed_chunks_parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Discard existing or partial chunk embeddings and rebuild",
+    )
 
     search_chunked_parser = subparsers.add_parser(
         "search_chunked", help="Search using chunked semantic search"
@@ -69,38 +118,121 @@ def main():
 
     subparsers.add_parser("verify_embeddings", help="Verify embeddings generation")
 
-    args = parser.parse_args()
+    compare_backends_parser = subparsers.add_parser(
+        "compare_backends",
+        help="Check backend embedding parity against torch and report throughput",
+    )
+    compare_backends_parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=ENCODER_BACKENDS,
+        default=list(ENCODER_BACKENDS),
+        help="Backends to compare",
+    )
+    compare_backends_parser.add_argument(
+        "--queries", type=int, default=50, help="Single-query encodes to time"
+    )
+    compare_backends_parser.add_argument(
+        "--docs", type=int, default=512, help="Documents to bulk encode"
+    )
+    compare_backends_parser.add_argument(
+        "--min-cosine",
+        type=float,
+        default=0.98,
+        help="Minimum per-document cosine similarity to the torch embeddings",
+    )
+
+    batch_parser = subparsers.add_parser(
+        "batch",
+        help="Answer a JSONL file of queries with one loaded model, streaming JSONL results",
+    )
+    batch_parser.add_argument(
+        "input",
+        type=str,
+        help='JSONL queries, "query" strings or {"query": ...} objects (- for stdin)',
+    )
+    batch_parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Where to write JSONL results (default: stdout)",
+    )
+    batch_parser.add_argument(
+        "--documents",
+        action="store_true",
+        help="Search whole-document embeddings instead of chunks",
+    )
+    batch_parser.add_argument(
+        "--limit", type=int, default=5, help="Limit the number of results"
+    )
+    batch_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_BATCH_WORKERS,
+        help=f"Worker threads (default={DEFAULT_BATCH_WORKERS})",
+    )
+    batch_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Queries embedded per encoder call (default={DEFAULT_BATCH_SIZE})",
+    )
+
+    add_trace_arguments(parser)
 
-    match args.command:
-        case "verify":
-            print("Verifying the semantic search model...")
-            verify_model()
-        case "embed_text":
-            print("Generating embedding for text...")
-            embed_text(args.text)
-        case "verify_embeddings":
-            print("Verifying embeddings...")
-            verify_embeddings()
-        case "embedquery":
-            print("Generating embedding for query...")
-            embed_query_text(args.query)
-        case "search":
-            print(f"Searching for: {args.query} (limit: {args.limit})")
-            search_command(args.query, args.limit)
-        case "chunk":
-            print(f"Chunking {len(args.text)} characters")
-            chunk_command(args.text, args.chunk_size, args.overlap)
-        case "semantic_chunk":
-            print(f"Semantically chunking {len(args.text)} characters")
-            semantic_chunk_command(args.text, args.max_chunk_size, args.overlap)
-        case "embed_chunks":
-            print("Embedding semantic chunks...")
-            embed_chunks_command()
-        case "search_chunked":
-            print(f"Searching chunked for: {args.query} (limit: {args.limit})")
-            search_chunked_command(args.query, args.limit)
-        case _:
-            parser.print_help()
+    args = parser.parse_args()
+    configure_from_args(args)
+    if args.backend:
+        set_encoder_backend(args.backend)
+
+    with span(f"semantic_cli.{args.command}"):
+        match args.command:
+            case "verify":
+                print("Verifying the semantic search model...")
+                verify_model()
+            case "embed_text":
+                print("Generating embedding for text...")
+                embed_text(args.text)
+            case "verify_embeddings":
+                print("Verifying embeddings...")
+                verify_embeddings()
+            case "embedquery":
+                print("Generating embedding for query...")
+                embed_query_text(args.query)
+            case "search":
+                print(f"Searching for: {args.query} (limit: {args.limit})")
+                search_command(args.query, args.limit)
+            case "chunk":
+                print(f"Chunking {len(args.text)} characters")
+                chunk_command(args.text, args.chunk_size, args.overlap)
+            case "semantic_chunk":
+                print(f"Semantically chunking {len(args.text)} characters")
+                semantic_chunk_command(args.text, args.max_chunk_size, args.overlap)
+            case "embed_chunks":
+                print("Embedding semantic chunks...")
+                embed_chunks_command(
+                    args.batch_size, args.rebuild, args.workers, args.torch_threads
+                )
+            case "compare_backends":
+                print("Comparing encoder backends...")
+                compare_backends_command(
+                    args.backends, args.queries, args.docs, args.min_cosine
+                )
+            case "search_chunked":
+                print(f"Searching chunked for: {args.query} (limit: {args.limit})")
+                search_chunked_command(args.query, args.limit, args.server)
+            case "batch":
+                batch_command(
+                    args.input,
+                    args.output,
+                    not args.documents,
+                    args.limit,
+                    args.workers,
+                    args.batch_size,
+                )
+            case _:
+                parser.print_help()
+    report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CLI_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must not be imported just to parse arguments or to run a
+# command that never touches a model or an LLM.
+HEAVY_MODULES = [
+    "sentence_transformers",
+    "torch",
+    "transformers",
+    "nltk",
+    "google.genai",
+]
+
+# Every subcommand is timed with --help, which pays for interpreter start,
+# imports and argument parsing but stops before any real work. Commands that
+# are pure computation are also run for real.
+SUBCOMMANDS = {
+    "keyword_search_cli.py": [
+        "build",
+        "tf",
+        "idf",
+        "tfidf",
+        "bm25idf",
+        "bm25tf",
+        "bm25search",
+        "phrase",
+        "search",
+        "batch",
+    ],
+    "semantic_search_cli.py": [
+        "verify",
+        "embed_text",
+        "embedquery",
+        "search",
+        "chunk",
+        "semantic_chunk",
+        "embed_chunks",
+        "search_chunked",
+        "verify_embeddings",
+        "compare_backends",
+        "batch",
+    ],
+    "hybrid_search_cli.py": [
+        "normalize",
+        "weighted-search",
+        "rrf-search",
+        "cache-stats",
+        "verify-listwise",
+        "batch",
+    ],
+    "augmented_generation_cli.py": ["rag", "summarize", "citations", "question"],
+    "evaluation_cli.py": [None],
+    "scaling_benchmark_cli.py": [None],
+    "search_server_cli.py": [None],
+}
+
+LIGHT_RUNS = [
+    ("hybrid_search_cli.py", ["normalize", "1", "2", "3"]),
+    (
+        "semantic_search_cli.py",
+        ["chunk", "one two three four", "--chunk-size", "2", "--overlap", "0"],
+    ),
+    (
+        "semantic_search_cli.py",
+        ["semantic_chunk", "One. Two! Three?", "--max-chunk-size", "2"],
+    ),
+]
+
+# Runs inside the child interpreter: execute the CLI as __main__, then report
+# which heavy modules ended up in sys.modules.
+_CHILD = """
+import json, runpy, sys, time
+start = time.perf_counter()
+sys.argv = {argv!r}
+try:
+    runpy.run_path({script!r}, run_name="__main__")
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+sys.__stdout__.write("\\n" + json.dumps({{"in_process": elapsed, "heavy": heavy}}) + "\\n")
+"""
+
+
+def measure(script: str, args: list[str], runs: int) -> dict:
+    code = _CHILD.format(
+        argv=[script] + args,
+        script=os.path.join(CLI_DIR, script),
+        heavy=HEAVY_MODULES,
+    )
+    wall_times, in_process_times, heavy = [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=CLI_DIR,
+            capture_output=True,
+            text=True,
+        )
+        wall_times.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            raise RuntimeError(
+                f"{script} {' '.join(args)} failed:\n{proc.stderr.strip()}"
+            )
+        report = json.loads(proc.stdout.strip().splitlines()[-1])
+        in_process_times.append(report["in_process"])
+        heavy = report["heavy"]
+    return {
+        "command": " ".join([script] + args),
+        "wall_s": statistics.median(wall_times),
+        "in_process_s": statistics.median(in_process_times),
+        "heavy_modules": heavy,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Guard cold-start time of every CLI subcommand"
+    )
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=1.0,
+        help="Fail if any command's median wall time exceeds this (default=1.0)",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Runs per command (default=3)"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print results as JSON lines"
+    )
+    args = parser.parse_args()
+
+    cases = []
+    for script, subcommands in SUBCOMMANDS.items():
+        for subcommand in subcommands:
+            cases.append((script, [subcommand, "--help"] if subcommand else ["--help"]))
+    cases.extend(LIGHT_RUNS)
+
+    failures = 0
+    for script, cli_args in cases:
+        result = measure(script, cli_args, args.runs)
+        too_slow = result["wall_s"] > args.max_seconds
+        ok = not too_slow and not result["heavy_modules"]
+        failures += 0 if ok else 1
+        result["ok"] = ok
+        if args.json:
+            print(json.dumps(result))
+            continue
+        status = "ok  " if ok else "FAIL"
+        line = f"{status} {result['wall_s'] * 1000:8.1f} ms  {result['command']}"
+        if result["heavy_modules"]:
+            line += f"  (imported {', '.join(result['heavy_modules'])})"
+        print(line)
+
+    if failures:
+        print(f"{failures} command(s) exceeded the cold-start budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()